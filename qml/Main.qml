@@ -43,6 +43,7 @@ MainView {
     property bool isSyncing: false
     property string syncMessage: ""
     property bool syncSuccess: false
+    property int changesRevision: -1
 
     function refreshServerList() {
         python.call('server.get_servers', [], function (result) {
@@ -57,6 +58,25 @@ MainView {
             });
     }
 
+    function watchChanges() {
+        python.call('server.get_changes', [root.changesRevision], function (result) {
+                if (!result)
+                    return;
+                var firstCall = root.changesRevision < 0;
+                root.changesRevision = result.revision;
+                if (!firstCall && (result.reset || result.server_ids.length > 0))
+                    root.refreshServerList();
+            });
+    }
+
+    Timer {
+        id: changesTimer
+        interval: 5000
+        repeat: true
+        running: mainPage.active && root.changesRevision >= 0
+        onTriggered: root.watchChanges()
+    }
+
     PageStack {
         id: pageStack
         anchors.fill: parent
@@ -182,6 +202,7 @@ MainView {
         Component.onCompleted: {
             addImportPath(Qt.resolvedUrl('../src/'));
             importModule('server', function () {
+                    root.watchChanges();
                     root.refreshServerList();
                 });
         }
@@ -30,6 +30,7 @@ Page {
     property var syncLogs: []
     property bool isUpdatingAddressBook: false
     property bool isDeletingServer: false
+    property int changesRevision: -1
 
     function loadServerDetails() {
         if (serverId === "") {
@@ -58,6 +59,23 @@ Page {
         });
     }
 
+    function watchChanges() {
+        python.call('server.get_changes', [changesRevision, serverId], function(result) {
+            if (!result)
+                return ;
+
+            var firstCall = changesRevision < 0;
+            changesRevision = result.revision;
+            if (firstCall || isDeletingServer)
+                return ;
+
+            if (result.reset || result.details_changed)
+                loadServerDetails();
+            else if (result.sync_log_changed)
+                loadSyncLogs();
+        });
+    }
+
     function updateAddressBookStatus(addressBookId, enabled) {
         isUpdatingAddressBook = true;
         python.call('server.update_address_book_status', [serverId, addressBookId, enabled], function(result) {
@@ -368,6 +386,15 @@ Page {
         onTriggered: copiedLabel.visible = false
     }
 
+    Timer {
+        id: changesTimer
+
+        interval: 5000
+        repeat: true
+        running: serverDetailsPage.active && changesRevision >= 0
+        onTriggered: watchChanges()
+    }
+
     LoadToast {
         showing: isLoading
         message: i18n.tr("Loading server details...")
@@ -426,6 +453,7 @@ Page {
         Component.onCompleted: {
             addImportPath(Qt.resolvedUrl('../../src/'));
             importModule('server', function() {
+                watchChanges();
                 loadServerDetails();
             });
         }
@@ -0,0 +1,141 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark of the keep-alive connection pool against urllib.request.urlopen,
+# which the HTTP helpers used before, on a local HTTPS server. Three ways of
+# sending the same PROPFIND are timed: urlopen (new connection and full TLS
+# handshake every time), the pool reusing one keep-alive connection, and the
+# pool opening a new connection every time but resuming the TLS session.
+# Needs the openssl command to create a throwaway certificate.
+#
+#   python scripts/bench_http_pool.py --runs 300
+
+import argparse
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+from benchenv import format_seconds, per_call, setup_temp_app
+
+BODY = b'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:"><d:response><d:href>/</d:href></d:response></d:multistatus>'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_PROPFIND(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(207)
+        self.send_header("Content-Type", "application/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def make_certificate(directory: str) -> Tuple[str, str]:
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the HTTP connection pool against urllib.")
+    parser.add_argument("--runs", type=int, default=300)
+    args = parser.parse_args()
+
+    setup_temp_app()
+    from src.ut_components.http import ConnectionPool, request
+
+    cert, key = make_certificate(tempfile.mkdtemp(prefix="contactbridge-bench-tls-"))
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert, key)
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    server.daemon_threads = True
+    server.socket = server_context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"https://localhost:{server.server_address[1]}/"
+
+    client_context = ssl.create_default_context(cafile=cert)
+    pool = ConnectionPool(context=client_context)
+    data = b'<?xml version="1.0"?><d:propfind xmlns:d="DAV:"><d:prop><d:current-user-principal/></d:prop></d:propfind>'
+    headers = {"Depth": "0", "Content-Type": "application/xml; charset=utf-8"}
+
+    def urllib_propfind() -> None:
+        req = urllib.request.Request(url, data=data, headers=headers, method="PROPFIND")
+        with urllib.request.urlopen(req, context=client_context) as response:
+            assert response.read() == BODY
+
+    def pool_propfind() -> None:
+        response = request(url, "PROPFIND", data=data, headers=headers, pool=pool, rate_limiter=None)
+        assert response.status_code == 207 and response.data == BODY
+
+    resumed = []
+
+    def pool_propfind_new_connection() -> None:
+        pool_propfind()
+        connections = [conn for idle in pool._idle.values() for conn, _ in idle]
+        resumed.extend(conn.sock.session_reused for conn in connections)
+        pool.close_all()
+
+    urllib_propfind()
+    pool_propfind()
+    before = per_call(urllib_propfind, args.runs)
+    keep_alive = per_call(pool_propfind, args.runs)
+    new_connection = per_call(pool_propfind_new_connection, args.runs)
+    server.shutdown()
+
+    print(f"PROPFIND to a local HTTPS server, {args.runs} runs each")
+    print(f"  urllib urlopen:                {format_seconds(before)} per request")
+    print(f"  pool, keep-alive connection:   {format_seconds(keep_alive)} per request")
+    print(
+        f"  pool, new connection:          {format_seconds(new_connection)} per request"
+        f" ({sum(resumed)}/{len(resumed)} TLS sessions resumed)"
+    )
+
+
+if __name__ == "__main__":
+    main()
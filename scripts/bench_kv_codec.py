@@ -0,0 +1,83 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark of the KV value codecs: stored size of rows shaped like server and
+# address book records with the legacy JSON encoding and with BinaryCodec
+# (after KV.migrate_codec()), and decode cost per value.
+#
+#   python scripts/bench_kv_codec.py --records 1000
+
+import argparse
+import os
+
+from benchenv import format_seconds, per_call, setup_temp_app
+
+
+def _sizes(kv) -> str:
+    # Only the kv table is compared: drop the change feed entries the writes
+    # and the migration added.
+    kv.conn.execute("DELETE FROM main.kv_changes")
+    kv.conn.commit()
+    kv.conn.execute("VACUUM")
+    kv.checkpoint("TRUNCATE")
+    value_bytes = kv.conn.execute("SELECT sum(length(value)) FROM main.kv").fetchone()[0]
+    file_bytes = os.path.getsize(kv.pool.path)
+    return f"values {value_bytes} bytes, kv.db after VACUUM {file_bytes} bytes"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark KV value codecs.")
+    parser.add_argument("--records", type=int, default=1000, help="address books, 6 rows each")
+    parser.add_argument("--runs", type=int, default=20000)
+    args = parser.parse_args()
+
+    setup_temp_app()
+    from src.ut_components.codec import BINARY_CODEC, JSON_CODEC
+    from src.ut_components.kv import DEFAULT_PROFILE, KV, KVProfile
+
+    with KV(KVProfile(codec=JSON_CODEC)) as kv:
+        for index in range(args.records):
+            prefix = f"server.s{index % 10}.addressbook.{index:040x}"
+            kv.put_cached(f"{prefix}.url", f"https://dav.example.com/addressbooks/user/book{index}/")
+            kv.put_cached(f"{prefix}.name", f"Address book {index}")
+            kv.put_cached(f"{prefix}.enabled", index % 2 == 0)
+            kv.put_cached(f"{prefix}.first_run", False)
+            kv.put_cached(f"{prefix}.last_run.time", 1760000000 + index)
+            kv.put_cached(f"{prefix}.last_run.success", True)
+        kv.commit_cached()
+        print(f"JSON:   {_sizes(kv)}")
+
+    with KV(DEFAULT_PROFILE) as kv:
+        migrated = kv.migrate_codec()
+        print(f"binary: {_sizes(kv)} ({migrated} rows migrated)")
+
+    print("decode per value, JSON -> binary:")
+    samples = {
+        "bool": True,
+        "int": 1760000000,
+        "str": "https://dav.example.com/addressbooks/user/book1/",
+        "small dict": {"name": "Home", "enabled": True, "count": 42},
+    }
+    for name, value in samples.items():
+        as_json = JSON_CODEC.encode(value)
+        as_binary = BINARY_CODEC.encode(value)
+        json_time = per_call(lambda: JSON_CODEC.decode(as_json), args.runs)
+        binary_time = per_call(lambda: BINARY_CODEC.decode(as_binary), args.runs)
+        print(f"  {name:<10} {format_seconds(json_time):>8} -> {format_seconds(binary_time):>8}")
+
+
+if __name__ == "__main__":
+    main()
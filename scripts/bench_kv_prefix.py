@@ -0,0 +1,65 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark of KV prefix queries on a large table: get_partial() (index range
+# scan) against the LIKE query it replaced, which scanned the whole table and
+# sorted by value.
+#
+#   python scripts/bench_kv_prefix.py --rows 120000
+
+import argparse
+
+from benchenv import format_seconds, per_call, setup_temp_app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark KV prefix queries.")
+    parser.add_argument("--rows", type=int, default=120000, help="unrelated rows in kv.db")
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_temp_app()
+    from src.ut_components.kv import KV
+
+    with KV() as kv:
+        # Per-run log rows pile up next to the server records in kv.db.
+        for index in range(args.rows):
+            kv.put_cached(f"log.{index // 100}.{index % 100}", {"line": index})
+        for server in range(args.servers):
+            for field in range(10):
+                kv.put_cached(f"server.s{server}.field{field}", f"value {field}")
+        kv.commit_cached()
+
+        prefix = f"server.s{args.servers // 2}."
+        assert len(kv.get_partial(prefix)) == 10
+
+        def like_scan():
+            kv.cursor.execute("SELECT key, value FROM main.kv WHERE key LIKE ? || '%' ORDER BY value", (prefix,))
+            return kv.cursor.fetchall()
+
+        assert len(like_scan()) == 10
+        before = per_call(like_scan, max(1, args.runs // 20))
+        after = per_call(lambda: kv.get_partial(prefix), args.runs)
+
+    total = args.rows + args.servers * 10
+    print(f"{total} rows, 10 matching the prefix")
+    print(f"  LIKE scan:    {format_seconds(before)} per call")
+    print(f"  get_partial:  {format_seconds(after)} per call")
+
+
+if __name__ == "__main__":
+    main()
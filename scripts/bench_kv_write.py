@@ -0,0 +1,65 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark of batched KV writes: put_cached() + commit_cached() (chunked
+# executemany) against the single multi-VALUES INSERT commit_cached() used to
+# build, in rows per second.
+#
+#   python scripts/bench_kv_write.py --sizes 1000 10000 100000
+
+import argparse
+import sqlite3
+import time
+
+from benchenv import setup_temp_app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark batched KV writes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    setup_temp_app()
+    from src.ut_components.kv import KV
+
+    print(f"{'rows':>8} {'multi-VALUES':>16} {'executemany':>16}")
+    for size in args.sizes:
+        with KV() as kv:
+            kv.delete_partial("bench.")
+            start = time.perf_counter()
+            rows = [(f"bench.{index}", kv._encode_value({"value": index}), None) for index in range(size)]
+            try:
+                kv.cursor.execute(
+                    f"INSERT OR REPLACE INTO kv (key, value, ttl) VALUES {','.join(['(?, ?, ?)'] * size)}",
+                    [column for row in rows for column in row],
+                )
+                kv.conn.commit()
+                before = f"{size / (time.perf_counter() - start):,.0f}/s"
+            except sqlite3.OperationalError as e:
+                kv.conn.rollback()
+                before = f"fails ({e})"
+
+            kv.delete_partial("bench.")
+            start = time.perf_counter()
+            for index in range(size):
+                kv.put_cached(f"bench.{index}", {"value": index})
+            kv.commit_cached()
+            after = f"{size / (time.perf_counter() - start):,.0f}/s"
+        print(f"{size:>8} {before:>16} {after:>16}")
+
+
+if __name__ == "__main__":
+    main()
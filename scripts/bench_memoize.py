@@ -0,0 +1,88 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark of memoize key derivation: hash_function_args() (BLAKE2b over a
+# canonical encoding) against the JSON + SHA1 hash it replaced, for typical
+# argument shapes, plus the cost of a whole memoized call served from the
+# memory tier and of a cached None result read from the KV store.
+#
+#   python scripts/bench_memoize.py --runs 100000
+
+import argparse
+import hashlib
+import json
+from dataclasses import dataclass
+
+from benchenv import format_seconds, per_call, setup_temp_app
+
+
+def json_sha1_args(args, kwargs) -> str:
+    # hash_function_args() before the canonical encoding.
+    encoded_args = f"{json.dumps(args, sort_keys=True)}-{json.dumps(kwargs, sort_keys=True)}"
+    return hashlib.sha1(f"{encoded_args}".encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class Account:
+    server_url: str
+    username: str
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark memoize key derivation.")
+    parser.add_argument("--runs", type=int, default=100000)
+    args = parser.parse_args()
+
+    setup_temp_app()
+    from src.ut_components.memoize import MemoryCache, hash_function_args, memoize
+
+    shapes = {
+        "3 str args": (("https://dav.example.com/", "alice", "secret"), {}),
+        "1 int arg": ((42,), {}),
+        "nested dict + kwargs": (
+            ({"server": {"url": "https://dav.example.com/", "ids": [1, 2, 3]}},),
+            {"refresh": True, "limit": 50},
+        ),
+    }
+    print(f"key derivation, {args.runs} runs each")
+    for name, (call_args, call_kwargs) in shapes.items():
+        before = per_call(lambda: json_sha1_args(call_args, call_kwargs), args.runs)
+        after = per_call(lambda: hash_function_args(call_args, call_kwargs), args.runs)
+        print(f"  {name:<22} json+sha1 {format_seconds(before):>8}   blake2b {format_seconds(after):>8}")
+    account = (Account("https://dav.example.com/", "alice"),)
+    after = per_call(lambda: hash_function_args(account, {}), args.runs)
+    print(f"  {'dataclass arg':<22} json+sha1 {'fails':>8}   blake2b {format_seconds(after):>8}")
+
+    @memoize(ttl_seconds=3600, memory=MemoryCache())
+    def addressbooks(server_url: str, username: str, password: str):
+        return [{"url": f"{server_url}{username}/contacts/", "name": "Contacts"}]
+
+    # No memory tier, so every hit is a KV read.
+    @memoize(ttl_seconds=3600, memory=None)
+    def principal(server_url: str, username: str, password: str):
+        return None
+
+    addressbooks(*shapes["3 str args"][0])
+    principal(*shapes["3 str args"][0])
+    hit = per_call(lambda: addressbooks(*shapes["3 str args"][0]), args.runs)
+    none_hit = per_call(lambda: principal(*shapes["3 str args"][0]), max(1, args.runs // 10))
+    print("memoized calls")
+    print(f"  memory tier hit:       {format_seconds(hit)} per call")
+    print(f"  cached None (KV) hit:  {format_seconds(none_hit)} per call")
+
+
+if __name__ == "__main__":
+    main()
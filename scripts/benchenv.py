@@ -0,0 +1,62 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Shared setup of the benchmark and stress scripts in this directory. Run them
+# from the repository root, e.g. `python scripts/stress_kv.py`. They use a
+# throwaway config/cache directory, never the app's real data.
+
+import os
+import sys
+import tempfile
+import time
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_temp_app(app_name: str = "contactbridge.bench") -> str:
+    """
+    Point the XDG config and cache directories to a new temporary directory
+    and initialize ut_components, so KV and memoize write there.
+
+    Returns:
+        str: The temporary directory.
+    """
+    directory = tempfile.mkdtemp(prefix="contactbridge-bench-")
+    os.environ["XDG_CONFIG_HOME"] = directory
+    os.environ["XDG_CACHE_HOME"] = directory
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from src.ut_components import setup
+
+    setup(app_name, None)
+    return directory
+
+
+def per_call(func: Callable[[], object], runs: int) -> float:
+    """
+    Run func runs times and return the average seconds per call.
+    """
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - start) / runs
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
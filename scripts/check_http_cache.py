@@ -0,0 +1,119 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Checks of the HTTP response cache against a local server: a stored GET
+# response is revalidated and answered from the cache on a 304, a PROPFIND
+# whose validators get a 412 (as sabre/dav servers answer them) is sent
+# again without them, and a cache that cannot be written to leaves requests
+# working. Exits non-zero on failure.
+#
+#   python scripts/check_http_cache.py
+
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchenv import setup_temp_app
+
+BODY = b'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:"/>'
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Conditional requests received, by method.
+    conditional = {"GET": 0, "PROPFIND": 0}
+
+    def do_GET(self) -> None:
+        self._answer(200, 304)
+
+    def do_PROPFIND(self) -> None:
+        # RFC 9110 section 13.1.2: a matching If-None-Match on a method other
+        # than GET or HEAD is answered with 412 Precondition Failed.
+        self._answer(207, 412)
+
+    def _answer(self, status: int, not_modified: int) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("If-None-Match") is not None:
+            self.conditional[self.command] += 1
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(not_modified)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def main() -> None:
+    directory = setup_temp_app()
+    from src.ut_components.http import ACCEPT_ENCODING, USER_AGENT, HTTPCache, request
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/dav/"
+    # The headers request() adds, which are part of the cache key.
+    headers = {"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING}
+
+    cache = HTTPCache(path=os.path.join(directory, "http"))
+    response = request(url, "GET", cache=cache, rate_limiter=None)
+    assert response.success and response.data == BODY, response.data
+    response = request(url, "GET", cache=cache, rate_limiter=None)
+    assert response.success and response.status_code == 200 and response.data == BODY, response.data
+    assert Handler.conditional["GET"] == 1, Handler.conditional
+
+    # PROPFIND is not cached by default, so no validators are sent.
+    for _ in range(2):
+        response = request(url, "PROPFIND", data=b"", cache=cache, rate_limiter=None)
+        assert response.success and response.status_code == 207 and response.data == BODY, response.data
+    assert Handler.conditional["PROPFIND"] == 0, Handler.conditional
+
+    # Opted in, the 412 answering the cached validators is a cache miss.
+    dav_cache = HTTPCache(path=os.path.join(directory, "dav"), methods=frozenset({"GET", "PROPFIND"}))
+    key = dav_cache.key("PROPFIND", url, headers, b"")
+    response = request(url, "PROPFIND", data=b"", cache=dav_cache, rate_limiter=None)
+    assert response.success and response.data == BODY, response.data
+    assert dav_cache.get(key) is not None
+    for stream in (False, True):
+        response = request(url, "PROPFIND", data=b"", cache=dav_cache, rate_limiter=None, stream=stream)
+        assert response.success and response.status_code == 207 and response.data == BODY, response.data
+    # One 412 per request, each followed by an unconditional resend.
+    assert Handler.conditional["PROPFIND"] == 2, Handler.conditional
+
+    # The cache directory would have to be created under a regular file.
+    _, blocker = tempfile.mkstemp(dir=directory)
+    broken = HTTPCache(path=os.path.join(blocker, "http"))
+    response = request(url, "GET", cache=broken, rate_limiter=None)
+    assert response.success and response.status_code == 200 and response.data == BODY, response.data
+    response = request(url, "GET", cache=broken, rate_limiter=None, stream=True)
+    assert response.success and response.data == BODY, response.data
+    assert broken.get(broken.key("GET", url, headers, None)) is None
+
+    server.shutdown()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Checks of the KV change feed: every real write moves the revision, and
+# rewriting a key with the value (and expiry) it already has does not, so
+# pollers like the QML view don't redraw for nothing. Sync results the views
+# poll are tracked, and asking for keys stored in a shard without a feed
+# fails loudly. Exits non-zero on failure.
+#
+#   python scripts/check_kv_change_feed.py
+
+from benchenv import setup_temp_app
+
+
+def main() -> None:
+    setup_temp_app()
+    from src.ut_components.kv import KV
+
+    with KV() as kv:
+        kv.put("server.a.name", "Home")
+        revision = kv.revision()
+
+        kv.put("server.a.name", "Home")
+        assert kv.revision() == revision, "put() of an identical value moved the revision"
+
+        kv.put_cached("server.a.name", "Home")
+        kv.put_cached("server.a.url", "https://dav.example.com/")
+        kv.commit_cached()
+        assert kv.revision() == revision + 1, "commit_cached() recorded an unchanged row"
+        revision = kv.revision()
+
+        kv.put("server.a.name", "Office")
+        assert kv.revision() == revision + 1, "put() of a new value was not recorded"
+        revision = kv.revision()
+
+        kv.put("server.a.name", "Office", ttl_seconds=3600)
+        assert kv.revision() == revision + 1, "put() with a new ttl was not recorded"
+        revision = kv.revision()
+
+        kv.delete("server.a.name")
+        changes = kv.changes_since(revision, "server.").changes
+        assert [(change.key, change.deleted) for change in changes] == [("server.a.name", True)], changes
+        revision = kv.revision()
+
+        kv.put("server.a.addressbook.b.last_run.success", True)
+        kv.put("sync.lease", {"owner": "check"})
+        changes = kv.changes_since(revision).changes
+        assert [change.key for change in changes] == ["server.a.addressbook.b.last_run.success"], changes
+
+        try:
+            kv.changes_since(revision, "sync.")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("changes_since() of a shard without a change feed did not fail")
+
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+contactbridge is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Stress test of concurrent KV access: several writer and reader processes
+# hammer the same kv.db for a while, each operation opening a fresh KV() like
+# the app and the background sync do. Reports throughput and "database is
+# locked" errors per role. Compare journal modes with --journal-mode DELETE.
+#
+#   python scripts/stress_kv.py --writers 3 --readers 3 --seconds 5
+
+import argparse
+import multiprocessing
+import sqlite3
+import time
+
+from benchenv import setup_temp_app
+
+
+def _worker(role: str, index: int, seconds: float, journal_mode: str, results) -> None:
+    from src.ut_components.kv import KV, KVProfile
+
+    profile = KVProfile(journal_mode=journal_mode)
+    operations = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            with KV(profile) as kv:
+                if role == "writer":
+                    kv.put(f"server.{index}.counter", operations)
+                else:
+                    kv.get_partial("server.")
+            operations += 1
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            errors += 1
+    results.put((role, operations, errors))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stress test concurrent KV access.")
+    parser.add_argument("--writers", type=int, default=3)
+    parser.add_argument("--readers", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--journal-mode", default="WAL")
+    args = parser.parse_args()
+
+    directory = setup_temp_app()
+    from src.ut_components.kv import KV, KVProfile
+
+    with KV(KVProfile(journal_mode=args.journal_mode)) as kv:
+        for index in range(args.writers):
+            kv.put(f"server.{index}.name", f"Server {index}")
+    # Children open their own connections.
+    kv.pool.close_all()
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(role, index, args.seconds, args.journal_mode, results))
+        for role, count in (("writer", args.writers), ("reader", args.readers))
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    totals = {"writer": [0, 0], "reader": [0, 0]}
+    for _ in processes:
+        role, operations, errors = results.get()
+        totals[role][0] += operations
+        totals[role][1] += errors
+    for process in processes:
+        process.join()
+
+    print(f"journal_mode={args.journal_mode}, {args.seconds:g}s, database in {directory}")
+    for role, (operations, errors) in totals.items():
+        print(f"  {role}s: {operations / args.seconds:8.0f} ops/s, {errors} lock errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,9 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from src.constants import APP_ID, APP_NAME, CRASH_REPORT_URL
+import traceback
+
+from src.constants import APP_ID, APP_NAME, CODEC_MIGRATED_KEY, CRASH_REPORT_URL
 from src.ut_components import setup
 
 setup(APP_NAME, CRASH_REPORT_URL)
@@ -61,5 +63,24 @@ def sync_library():
                 send_notification(notification, token, APP_ID)
 
 
+def kv_maintenance():
+    with KV() as kv:
+        # migrate_codec() scans every row, so it only runs until it
+        # completed once for the current codec.
+        codec = type(kv.pool.profile.codec).__name__
+        if kv.get(CODEC_MIGRATED_KEY) != codec:
+            kv.migrate_codec()
+            kv.put(CODEC_MIGRATED_KEY, codec)
+        kv.checkpoint("TRUNCATE")
+
+
 if __name__ == "__main__":
-    sync_library()
+    try:
+        sync_library()
+    finally:
+        # Maintenance is retried on the next run, so a failure here (a
+        # locked database, a full disk) must not hide the sync's own error.
+        try:
+            kv_maintenance()
+        except Exception:
+            traceback.print_exc()
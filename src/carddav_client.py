@@ -21,6 +21,18 @@ from urllib.parse import urljoin, urlparse
 from xml.etree import ElementTree as ET
 
 import src.ut_components.http as http
+from src.ut_components.memoize import memoize
+
+# Discovery results rarely change; they are dropped with invalidate_tag() when
+# the account is deleted.
+DISCOVERY_TTL_SECONDS = 24 * 60 * 60
+
+NAMESPACES = {
+    "D": "DAV:",
+    "C": "urn:ietf:params:xml:ns:carddav",
+    "CS": "http://calendarserver.org/ns/",
+    "CR": "urn:ietf:params:xml:ns:carddav",
+}
 
 
 @dataclass
@@ -29,6 +41,13 @@ class AddressBook:
     url: str
 
 
+def account_tag(server_url: str, username: str) -> str:
+    """
+    Memoize tag of the cached results of one account, see invalidate_tag().
+    """
+    return f"carddav:{username}@{urlparse(server_url).netloc}"
+
+
 def format_basic_auth_header(username: str, password: str) -> str:
     credentials = f"{username}:{password}"
     encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
@@ -52,18 +71,20 @@ def _discover_principal(base_url: str, username: str, password: str, namespaces:
             "Authorization": format_basic_auth_header(username, password),
         },
         data=propfind_body.encode(),
+        stream=True,
     )
-    response.raise_for_status()
-
-    if response.status_code in [207, 200]:
-        root = ET.fromstring(response.text)
-
-        # Look for current-user-principal href
-        for elem in root.iter():
-            if elem.tag.endswith("current-user-principal"):
-                href_elem = elem.find(".//{DAV:}href")
-                if href_elem is not None and href_elem.text:
-                    return urljoin(base_url, href_elem.text)
+    with response:
+        response.raise_for_status()
+        if response.status_code not in [207, 200]:
+            return None
+        root = ET.parse(response.raw).getroot()
+
+    # Look for current-user-principal href
+    for elem in root.iter():
+        if elem.tag.endswith("current-user-principal"):
+            href_elem = elem.find(".//{DAV:}href")
+            if href_elem is not None and href_elem.text:
+                return urljoin(base_url, href_elem.text)
 
     return None
 
@@ -85,20 +106,57 @@ def _discover_addressbook_home(principal_url: str, username: str, password: str,
             "Authorization": format_basic_auth_header(username, password),
         },
         data=propfind_body.encode(),
+        stream=True,
     )
-    response.raise_for_status()
-
-    if response.status_code in [207, 200]:
-        root = ET.fromstring(response.text)
-        for elem in root.iter():
-            if elem.tag.endswith("addressbook-home-set"):
-                href_elem = elem.find(".//{DAV:}href")
-                if href_elem is not None and href_elem.text:
-                    return urljoin(principal_url, href_elem.text)
+    with response:
+        response.raise_for_status()
+        if response.status_code not in [207, 200]:
+            return None
+        root = ET.parse(response.raw).getroot()
+
+    for elem in root.iter():
+        if elem.tag.endswith("addressbook-home-set"):
+            href_elem = elem.find(".//{DAV:}href")
+            if href_elem is not None and href_elem.text:
+                return urljoin(principal_url, href_elem.text)
 
     return None
 
 
+def _addressbook_from_response(response_elem: ET.Element, collection_url: str) -> Optional[Dict[str, str]]:
+    href_elem = response_elem.find("{DAV:}href")
+    if href_elem is None or not href_elem.text:
+        return None
+
+    is_addressbook = False
+    for resourcetype in response_elem.iter("{DAV:}resourcetype"):
+        if resourcetype.find(".//{urn:ietf:params:xml:ns:carddav}addressbook") is not None:
+            is_addressbook = True
+            break
+
+    if not is_addressbook:
+        return None
+
+    displayname = None
+    displayname_elem = response_elem.find(".//{DAV:}displayname")
+    if displayname_elem is not None and displayname_elem.text:
+        displayname = displayname_elem.text
+
+    if not displayname:
+        desc_elem = response_elem.find(".//{urn:ietf:params:xml:ns:carddav}addressbook-description")
+        if desc_elem is not None and desc_elem.text:
+            displayname = desc_elem.text
+
+    if not displayname:
+        path = urlparse(href_elem.text).path
+        displayname = path.rstrip("/").split("/")[-1] or "Address Book"
+
+    return {
+        "name": displayname,
+        "url": urljoin(collection_url, href_elem.text),
+    }
+
+
 def _get_addressbooks_from_collection(
     collection_url: str, username: str, password: str, namespaces: Dict
 ) -> List[Dict[str, str]]:
@@ -122,48 +180,91 @@ def _get_addressbooks_from_collection(
             "Authorization": format_basic_auth_header(username, password),
         },
         data=propfind_body.encode(),
+        stream=True,
     )
-    response.raise_for_status()
-
-    if response.status_code in [207, 200]:
-        root = ET.fromstring(response.text)
-
-        for response_elem in root.findall(".//{DAV:}response"):
-            href_elem = response_elem.find("{DAV:}href")
-            if href_elem is None or not href_elem.text:
-                continue
-
-            is_addressbook = False
-            for resourcetype in response_elem.iter("{DAV:}resourcetype"):
-                if resourcetype.find(".//{urn:ietf:params:xml:ns:carddav}addressbook") is not None:
-                    is_addressbook = True
-                    break
-
-            if is_addressbook:
-                displayname = None
-                displayname_elem = response_elem.find(".//{DAV:}displayname")
-                if displayname_elem is not None and displayname_elem.text:
-                    displayname = displayname_elem.text
-
-                if not displayname:
-                    desc_elem = response_elem.find(".//{urn:ietf:params:xml:ns:carddav}addressbook-description")
-                    if desc_elem is not None and desc_elem.text:
-                        displayname = desc_elem.text
-
-                if not displayname:
-                    path = urlparse(href_elem.text).path
-                    displayname = path.rstrip("/").split("/")[-1] or "Address Book"
-
-                addressbooks.append(
-                    {
-                        "name": displayname,
-                        "url": urljoin(collection_url, href_elem.text),
-                    }
-                )
+    with response:
+        response.raise_for_status()
+        if response.status_code not in [207, 200]:
+            return addressbooks
+
+        # Depth 1 lists every child of the collection; handle one response
+        # element at a time and drop it instead of building the whole tree.
+        for _, response_elem in ET.iterparse(response.raw):
+            if response_elem.tag == "{DAV:}response":
+                addressbook = _addressbook_from_response(response_elem, collection_url)
+                if addressbook:
+                    addressbooks.append(addressbook)
+                response_elem.clear()
 
     return addressbooks
 
 
+@memoize(
+    ttl_seconds=DISCOVERY_TTL_SECONDS,
+    cache_none=False,
+    tags=lambda server_url, username, password, namespaces: [account_tag(server_url, username)],
+)
+def _discover_principal_info(
+    server_url: str, username: str, password: str, namespaces: Dict
+) -> Optional[Dict[str, str]]:
+    principal_url = _discover_principal(server_url, username, password, namespaces)
+    if not principal_url:
+        return None
+    # Read right after the first request to server_url, so it is cached with
+    # the principal instead of depending on http.REDIRECTS.
+    return {"principal_url": principal_url, "context_url": http.REDIRECTS.resolve("PROPFIND", server_url)}
+
+
+@memoize(
+    ttl_seconds=DISCOVERY_TTL_SECONDS,
+    cache_none=False,
+    tags=lambda server_url, principal_url, username, password, namespaces: [account_tag(server_url, username)],
+)
+def _discover_addressbook_home_url(
+    server_url: str, principal_url: str, username: str, password: str, namespaces: Dict
+) -> Optional[str]:
+    return _discover_addressbook_home(principal_url, username, password, namespaces)
+
+
+def _discover_account(server_url: str, username: str, password: str, namespaces: Dict) -> Dict[str, str]:
+    # Each step is memoized only when the server answered it. The fallbacks
+    # are not, so a temporary failure or a server fixed later is retried on
+    # the next call instead of being served from the cache for a day.
+    principal = _discover_principal_info(server_url, username, password, namespaces)
+    if principal is None:
+        principal = {"principal_url": server_url, "context_url": http.REDIRECTS.resolve("PROPFIND", server_url)}
+    principal_url = principal["principal_url"]
+
+    addressbook_home_url = _discover_addressbook_home_url(server_url, principal_url, username, password, namespaces)
+    if not addressbook_home_url:
+        addressbook_home_url = principal_url
+
+    return {"addressbook_home_url": addressbook_home_url, "context_url": principal["context_url"]}
+
+
+def get_context_url(server_url: str, username: str, password: str) -> str:
+    """
+    Get the DAV context path server_url permanently redirects to, such as
+    the target of /.well-known/carddav, as learned by the account discovery.
+
+    The result is memoized with the principal discovery, so after
+    get_carddav_addressbooks() this makes no request unless the server
+    reported no principal.
+
+    Args:
+        server_url: The URL given to get_carddav_addressbooks()
+        username: Username for authentication
+        password: Password for authentication
+
+    Returns:
+        The final URL of the permanent redirect chain, or server_url when the
+        server did not redirect
+    """
+    if not server_url.endswith("/"):
+        server_url += "/"
+    return _discover_account(server_url, username, password, NAMESPACES)["context_url"]
+
+
 def get_carddav_addressbooks(server_url: str, username: str, password: str) -> List[AddressBook]:
     """
     Discover and retrieve CardDAV address books from a DAV server.
@@ -180,23 +281,7 @@ def get_carddav_addressbooks(server_url: str, username: str, password: str) -> L
     if not server_url.endswith("/"):
         server_url += "/"
 
-    namespaces = {
-        "D": "DAV:",
-        "C": "urn:ietf:params:xml:ns:carddav",
-        "CS": "http://calendarserver.org/ns/",
-        "CR": "urn:ietf:params:xml:ns:carddav",
-    }
-
-    addressbooks = []
-
-    principal_url = _discover_principal(server_url, username, password, namespaces)
-    if not principal_url:
-        principal_url = server_url
-
-    addressbook_home_url = _discover_addressbook_home(principal_url, username, password, namespaces)
-    if not addressbook_home_url:
-        addressbook_home_url = principal_url
-
-    addressbooks = _get_addressbooks_from_collection(addressbook_home_url, username, password, namespaces)
+    addressbook_home_url = _discover_account(server_url, username, password, NAMESPACES)["addressbook_home_url"]
+    addressbooks = _get_addressbooks_from_collection(addressbook_home_url, username, password, NAMESPACES)
 
     return [AddressBook(url=x.get("url", ""), name=x.get("name", "")) for x in addressbooks]
@@ -19,3 +19,6 @@ CRASH_REPORT_URL = "https://ut.brennoflavio.com.br/crash"
 APP_ID = "contactbridge.brennoflavio_contactbridge"
 SYNC_SERVICE_DEST_PATH = "/home/phablet/.config/systemd/user/contactbridge-sync.service"
 TIMER_SERVICE_DEST_PATH = "/home/phablet/.config/systemd/user/contactbridge-timer.timer"
+SYNC_LEASE_KEY = "sync.lease"
+SYNC_LEASE_TTL_SECONDS = 300
+CODEC_MIGRATED_KEY = "kv.codec_migrated"
@@ -17,6 +17,8 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from src.constants import (
     APP_NAME,
     CRASH_REPORT_URL,
+    SYNC_LEASE_KEY,
+    SYNC_LEASE_TTL_SECONDS,
 )
 from src.ut_components import setup
 
@@ -28,7 +30,7 @@ from datetime import datetime
 from typing import List, Optional
 from urllib.parse import urljoin
 
-from src.carddav_client import get_carddav_addressbooks
+from src.carddav_client import account_tag, get_carddav_addressbooks, get_context_url
 from src.syncevolution import (
     syncevolution_first_run,
     syncevolution_remove_address_book,
@@ -36,7 +38,8 @@ from src.syncevolution import (
 )
 from src.ut_components.config import get_app_data_path
 from src.ut_components.crash import crash_reporter, get_crash_report, set_crash_report
-from src.ut_components.kv import KV
+from src.ut_components.kv import KV, Lease
+from src.ut_components.memoize import invalidate_tag
 from src.ut_components.utils import dataclass_to_dict, short_string
 from src.utils import (
     get_root_url,
@@ -63,14 +66,19 @@ def save_server(url: str, username: str, password: str) -> DefaultServerResponse
     try:
         addressbooks = get_carddav_addressbooks(parsed_url, username, password)
     except Exception as e:
+        invalidate_tag(account_tag(parsed_url, username))
         return DefaultServerResponse(success=False, message=f"Failed to fetch server. Error: {str(e)}")
 
     if not addressbooks:
+        # Rediscover from scratch on the next attempt, e.g. once the server is fixed.
+        invalidate_tag(account_tag(parsed_url, username))
         return DefaultServerResponse(success=False, message="Could not find any addressbooks from url")
 
     with KV() as kv:
         id_ = short_string()
         kv.put_cached(f"server.{id_}.url", parsed_url)
+        # Where the url redirects to, so syncs skip the .well-known hop.
+        kv.put_cached(f"server.{id_}.context_url", get_context_url(parsed_url, username, password))
         kv.put_cached(f"server.{id_}.username", username)
         kv.put_cached(f"server.{id_}.password", password)
         kv.put_cached(f"server.{id_}.name", get_root_url(url))
@@ -101,19 +109,17 @@ class Servers:
 @dataclass_to_dict
 def get_servers() -> Servers:
     with KV() as kv:
-        partial = kv.get_partial("server") or []
-        ids = list(set([x[0].split(".")[1] for x in partial]))
+        ids = [id_ for id_, _ in kv.children("server")]
+        names = kv.get_many([f"server.{id_}.name" for id_ in ids])
         servers = []
         file_path = os.path.join(get_app_data_path(), "assets/address-book-app-symbolic.svg")
         for id_ in ids:
-            name = kv.get(f"server.{id_}.name") or ""
-            addressbooks_partial = kv.get_partial(f"server.{id_}.addressbook") or []
-            addressbook_ids = list(set([x[0].split(".")[3] for x in addressbooks_partial]))
+            name = names[f"server.{id_}.name"] or ""
             servers.append(
                 Server(
                     id=id_,
                     name=name,
-                    item_count=len(addressbook_ids),
+                    item_count=len(kv.children(f"server.{id_}.addressbook")),
                     description="CardDAV",
                     file_path=file_path,
                 )
@@ -137,14 +143,19 @@ class ServerDetail:
 @dataclass_to_dict
 def get_server_detail(server_id: str) -> ServerDetail:
     with KV() as kv:
-        partial = kv.get_partial(f"server.{server_id}.addressbook") or []
-        addressbook_ids = sorted(list(set([x[0].split(".")[3] for x in partial])))
+        addressbook_ids = [id_ for id_, _ in kv.children(f"server.{server_id}.addressbook")]
+        prefix = f"server.{server_id}.addressbook"
+        values = kv.get_many([f"{prefix}.{id_}.{field}" for id_ in addressbook_ids for field in ("name", "enabled")])
 
         addressbooks = []
         for id_ in addressbook_ids:
-            addressbook_name = kv.get(f"server.{server_id}.addressbook.{id_}.name") or ""
-            enabled = kv.get(f"server.{server_id}.addressbook.{id_}.enabled", False, True) or False
+            addressbook_name = values[f"{prefix}.{id_}.name"] or ""
+            enabled_key = f"{prefix}.{id_}.enabled"
+            if values[enabled_key] is None:
+                kv.put_cached(enabled_key, False)
+            enabled = values[enabled_key] or False
             addressbooks.append(AddressBook(id=id_, name=addressbook_name, enabled=enabled))
+        kv.commit_cached()
     return ServerDetail(addressbooks=addressbooks)
 
 
@@ -156,24 +167,40 @@ def update_address_book_status(server_id: str, addressbook_id: str, enabled: boo
             if not addressbook_name:
                 return
             syncevolution_remove_address_book(addressbook_name=addressbook_name, addressbook_id=addressbook_id)
-            kv.delete(f"server.{server_id}.addressbook.{addressbook_id}.first_run")
-        kv.put(f"server.{server_id}.addressbook.{addressbook_id}.enabled", enabled)
+        with kv.transaction():
+            if not enabled:
+                kv.delete(f"server.{server_id}.addressbook.{addressbook_id}.first_run")
+            kv.put(f"server.{server_id}.addressbook.{addressbook_id}.enabled", enabled)
 
 
 @crash_reporter
 @dataclass_to_dict
 def delete_server(server_id: str) -> DefaultServerResponse:
+    response = DefaultServerResponse(success=True, message="")
     with KV() as kv:
-        addressbook_partial = kv.get_partial(f"server.{server_id}.addressbook") or []
-        addressbook_ids = sorted(list(set([x[0].split(".")[3] for x in addressbook_partial])))
+        addressbook_ids = [id_ for id_, _ in kv.children(f"server.{server_id}.addressbook")]
+        names = kv.get_many([f"server.{server_id}.addressbook.{id_}.name" for id_ in addressbook_ids])
+        removed_addressbook_ids = []
         for addressbook_id in addressbook_ids:
-            addressbook_name = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.name") or ""
+            addressbook_name = names[f"server.{server_id}.addressbook.{addressbook_id}.name"] or ""
             if not addressbook_name:
-                return DefaultServerResponse(success=False, message="Error deleting address books")
+                response = DefaultServerResponse(success=False, message="Error deleting address books")
+                break
             syncevolution_remove_address_book(addressbook_name=addressbook_name, addressbook_id=addressbook_id)
-            kv.delete_partial(f"server.{server_id}.addressbook.{addressbook_id}")
-        kv.delete_partial(f"server.{server_id}")
-    return DefaultServerResponse(success=True, message="")
+            removed_addressbook_ids.append(addressbook_id)
+
+        account = kv.get_many([f"server.{server_id}.url", f"server.{server_id}.username"])
+        with kv.transaction():
+            for addressbook_id in removed_addressbook_ids:
+                kv.delete_partial(f"server.{server_id}.addressbook.{addressbook_id}.")
+            if response.success:
+                kv.delete_partial(f"server.{server_id}.")
+
+    if response.success:
+        invalidate_tag(
+            account_tag(account[f"server.{server_id}.url"] or "", account[f"server.{server_id}.username"] or "")
+        )
+    return response
 
 
 @crash_reporter
@@ -220,42 +247,41 @@ def crash_report(crash_report: bool):
 def sync_servers() -> DefaultServerResponse:
     success = True
     message = ""
-    with KV() as kv:
-        lock = kv.get("sync.lock", False)
-        if lock:
+    with KV() as kv, Lease(SYNC_LEASE_KEY, SYNC_LEASE_TTL_SECONDS) as lease:
+        if not lease.acquired:
             return DefaultServerResponse(
                 success=False,
                 message="Another instance of sync server is running",
             )
-        kv.put("sync.lock", True, ttl_seconds=1800)
-        server_partial = kv.get_partial("server") or []
-        ids = list(set([x[0].split(".")[1] for x in server_partial]))
+        ids = [id_ for id_, _ in kv.children("server")]
 
         for server_id in ids:
-            addressbook_partial = kv.get_partial(f"server.{server_id}.addressbook") or []
-            addressbook_ids = sorted(list(set([x[0].split(".")[3] for x in addressbook_partial])))
-            server_url = kv.get(f"server.{server_id}.url") or ""
+            server_tree = kv.get_tree(f"server.{server_id}.")
+            addressbook_ids = [id_ for id_, _ in kv.children(f"server.{server_id}.addressbook")]
+            server_url = (
+                server_tree.get(f"server.{server_id}.context_url") or server_tree.get(f"server.{server_id}.url") or ""
+            )
 
             for addressbook_id in addressbook_ids:
-                enabled = (
-                    kv.get(
-                        f"server.{server_id}.addressbook.{addressbook_id}.enabled",
-                        False,
-                        True,
+                if not lease.confirm():
+                    return DefaultServerResponse(
+                        success=False,
+                        message="Sync was taken over by another instance",
                     )
-                    or False
-                )
+                addressbook_prefix = f"server.{server_id}.addressbook.{addressbook_id}"
+                enabled = server_tree.get(f"{addressbook_prefix}.enabled")
+                if enabled is None:
+                    kv.put(f"{addressbook_prefix}.enabled", False)
                 if enabled:
-                    first_run = kv.get(
-                        f"server.{server_id}.addressbook.{addressbook_id}.first_run",
-                        True,
-                        True,
-                    )
+                    first_run = server_tree.get(f"{addressbook_prefix}.first_run")
+                    if first_run is None:
+                        kv.put(f"{addressbook_prefix}.first_run", True)
+                        first_run = True
                     if first_run:
-                        username = kv.get(f"server.{server_id}.username")
-                        password = kv.get(f"server.{server_id}.password")
-                        addressbook_url = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.url")
-                        addressbook_name = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.name")
+                        username = server_tree.get(f"server.{server_id}.username")
+                        password = server_tree.get(f"server.{server_id}.password")
+                        addressbook_url = server_tree.get(f"{addressbook_prefix}.url")
+                        addressbook_name = server_tree.get(f"{addressbook_prefix}.name")
                         if not addressbook_name or not addressbook_url or not username or not password:
                             return DefaultServerResponse(
                                 success=False,
@@ -270,8 +296,6 @@ def sync_servers() -> DefaultServerResponse:
                             addressbook_url=addressbook_url,
                         )
                         last_run_type = "first_time"
-                        if result.success:
-                            kv.put(f"server.{server_id}.addressbook.{addressbook_id}.first_run", False)
                     else:
                         result = syncevolution_two_way_sync(addressbook_id)
                         last_run_type = "regular"
@@ -283,24 +307,21 @@ def sync_servers() -> DefaultServerResponse:
                         success = False
                         message = last_run_message
 
-                    kv.put_cached(
-                        f"server.{server_id}.addressbook.{addressbook_id}.last_run.time",
-                        last_run_time,
-                    )
-                    kv.put_cached(
-                        f"server.{server_id}.addressbook.{addressbook_id}.last_run.type",
-                        last_run_type,
-                    )
-                    kv.put_cached(
-                        f"server.{server_id}.addressbook.{addressbook_id}.last_run.success",
-                        last_run_success,
-                    )
-                    kv.put_cached(
-                        f"server.{server_id}.addressbook.{addressbook_id}.last_run.message",
-                        last_run_message,
-                    )
-                    kv.commit_cached()
-        kv.put("sync.lock", False, ttl_seconds=1800)
+                    # Suspended past the lease TTL: another instance runs the
+                    # sync now and records its own results.
+                    if not lease.confirm():
+                        return DefaultServerResponse(
+                            success=False,
+                            message="Sync was taken over by another instance",
+                        )
+                    with kv.transaction():
+                        if first_run and last_run_success:
+                            kv.put(f"{addressbook_prefix}.first_run", False)
+                        kv.put_cached(f"{addressbook_prefix}.last_run.time", last_run_time)
+                        kv.put_cached(f"{addressbook_prefix}.last_run.type", last_run_type)
+                        kv.put_cached(f"{addressbook_prefix}.last_run.success", last_run_success)
+                        kv.put_cached(f"{addressbook_prefix}.last_run.message", last_run_message)
+                        kv.commit_cached()
     return DefaultServerResponse(success=success, message=message)
 
 
@@ -322,15 +343,16 @@ class ServerSyncLogResponse:
 @dataclass_to_dict
 def server_sync_log(server_id: str):
     with KV() as kv:
-        addressbook_partial = kv.get_partial(f"server.{server_id}.addressbook") or []
-        addressbook_ids = sorted(list(set([x[0].split(".")[3] for x in addressbook_partial])))
+        addressbook_tree = kv.get_tree(f"server.{server_id}.addressbook.")
+        addressbook_ids = [id_ for id_, _ in kv.children(f"server.{server_id}.addressbook")]
         server_logs = []
         for addressbook_id in addressbook_ids:
-            addressbook_name = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.name") or ""
-            last_run_time = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.last_run.time") or ""
-            last_run_type = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.last_run.type") or ""
-            last_run_success = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.last_run.success")
-            last_run_message = kv.get(f"server.{server_id}.addressbook.{addressbook_id}.last_run.message") or ""
+            addressbook_prefix = f"server.{server_id}.addressbook.{addressbook_id}"
+            addressbook_name = addressbook_tree.get(f"{addressbook_prefix}.name") or ""
+            last_run_time = addressbook_tree.get(f"{addressbook_prefix}.last_run.time") or ""
+            last_run_type = addressbook_tree.get(f"{addressbook_prefix}.last_run.type") or ""
+            last_run_success = addressbook_tree.get(f"{addressbook_prefix}.last_run.success")
+            last_run_message = addressbook_tree.get(f"{addressbook_prefix}.last_run.message") or ""
 
             if not last_run_time:
                 continue
@@ -345,3 +367,37 @@ def server_sync_log(server_id: str):
                 )
             )
         return ServerSyncLogResponse(server_logs=server_logs)
+
+
+@dataclass
+class ChangesResponse:
+    revision: int
+    reset: bool
+    server_ids: List[str]
+    sync_log_changed: bool
+    details_changed: bool
+
+
+@crash_reporter
+@dataclass_to_dict
+def get_changes(revision: int, server_id: str = "") -> ChangesResponse:
+    prefix = f"server.{server_id}." if server_id else "server."
+    with KV() as kv:
+        if revision < 0:
+            return ChangesResponse(
+                revision=kv.revision(),
+                reset=False,
+                server_ids=[],
+                sync_log_changed=False,
+                details_changed=False,
+            )
+        change_set = kv.changes_since(revision, prefix)
+
+    keys = [change.key for change in change_set.changes]
+    return ChangesResponse(
+        revision=change_set.revision,
+        reset=change_set.reset,
+        server_ids=sorted(set([key.split(".")[1] for key in keys])),
+        sync_log_changed=any(".last_run." in key for key in keys),
+        details_changed=any(".last_run." not in key for key in keys),
+    )
@@ -0,0 +1,253 @@
+"""
+Copyright (C) 2025  Brenno Flávio de Almeida
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 3.
+
+ut-components is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, Tuple, Union
+
+_NONE = b"N"
+_FALSE = b"F"
+_TRUE = b"T"
+_INT = b"i"
+_FLOAT = b"d"
+_STR = b"s"
+_BYTES = b"b"
+_LIST = b"l"
+_DICT = b"m"
+
+# The same tags as ints, which is what indexing into bytes returns.
+_N, _F, _T, _I, _D, _S, _B, _L, _M = b"NFTidsblm"
+
+_DOUBLE = struct.Struct("<d")
+
+
+class Codec(ABC):
+    """
+    Base class for the value encodings used by the KV store.
+
+    A codec turns Python values into something SQLite can store and back.
+    Subclasses implement encode() and decode(); KV picks the codec from its
+    KVProfile when writing, and uses decode_value() when reading so rows
+    written with any codec stay readable.
+    """
+
+    @abstractmethod
+    def encode(self, value: Any) -> Union[str, bytes]: ...
+
+    @abstractmethod
+    def decode(self, raw: Union[str, bytes]) -> Any: ...
+
+
+class JSONCodec(Codec):
+    """
+    The original KV encoding: the value wrapped as {"value": ...} in JSON text.
+
+    Kept to read rows written by older versions and for callers that want
+    human-readable rows.
+
+    Example:
+        >>> JSONCodec().encode(True)
+        '{"value": true}'
+    """
+
+    def encode(self, value: Any) -> str:
+        return json.dumps({"value": value})
+
+    def decode(self, raw: Union[str, bytes]) -> Any:
+        return json.loads(raw).get("value", None)
+
+
+def _write_varint(out: bytearray, number: int) -> None:
+    while True:
+        byte = number & 0x7F
+        number >>= 7
+        if number:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(raw: bytes, position: int) -> Tuple[int, int]:
+    number = 0
+    shift = 0
+    while True:
+        byte = raw[position]
+        position += 1
+        number |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return number, position
+        shift += 7
+
+
+class BinaryCodec(Codec):
+    """
+    Compact, typed binary encoding stored as a SQLite BLOB.
+
+    Every value starts with a one byte type tag:
+
+        N / F / T   None, False, True (the tag is the whole value)
+        i           varint length + little-endian two's complement integer
+        d           8-byte little-endian IEEE 754 double
+        s / b       varint length + UTF-8 text / raw bytes
+        l           varint item count + items
+        m           varint item count + key, value pairs
+
+    A boolean takes 1 byte instead of 16 for the JSON wrapper, scalars are
+    decoded without a JSON parse, and bytes round-trip as bytes. Tuples are
+    stored as lists, like JSON does. Dict keys must be str, int, float, bool
+    or None, as with JSON, but keep their type instead of becoming strings.
+
+    Example:
+        >>> codec = BinaryCodec()
+        >>> codec.encode(True)
+        b'T'
+        >>> codec.decode(codec.encode({"ids": [1, 2], "name": "home"}))
+        {'ids': [1, 2], 'name': 'home'}
+    """
+
+    def encode(self, value: Any) -> bytes:
+        if value is None:
+            return _NONE
+        if value is True:
+            return _TRUE
+        if value is False:
+            return _FALSE
+        out = bytearray()
+        self._encode_into(out, value)
+        return bytes(out)
+
+    def _encode_into(self, out: bytearray, value: Any) -> None:
+        if value is None:
+            out += _NONE
+        elif value is True:
+            out += _TRUE
+        elif value is False:
+            out += _FALSE
+        elif isinstance(value, int):
+            encoded = value.to_bytes(value.bit_length() // 8 + 1, "little", signed=True)
+            out += _INT
+            _write_varint(out, len(encoded))
+            out += encoded
+        elif isinstance(value, float):
+            out += _FLOAT
+            out += _DOUBLE.pack(value)
+        elif isinstance(value, str):
+            encoded = value.encode("utf-8")
+            out += _STR
+            _write_varint(out, len(encoded))
+            out += encoded
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            out += _BYTES
+            _write_varint(out, len(value))
+            out += value
+        elif isinstance(value, (list, tuple)):
+            out += _LIST
+            _write_varint(out, len(value))
+            for item in value:
+                self._encode_into(out, item)
+        elif isinstance(value, dict):
+            out += _DICT
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                if key is not None and not isinstance(key, (str, int, float)):
+                    raise TypeError(f"Keys of type {type(key).__name__} are not supported by BinaryCodec")
+                self._encode_into(out, key)
+                self._encode_into(out, item)
+        else:
+            raise TypeError(f"Object of type {type(value).__name__} is not supported by BinaryCodec")
+
+    def decode(self, raw: Union[str, bytes]) -> Any:
+        tag = raw[0]
+        if tag == _T:
+            return True
+        if tag == _F:
+            return False
+        if tag == _N:
+            return None
+        value, _ = _decode_from(raw, 0)
+        return value
+
+
+def _decode_from(raw: bytes, position: int) -> Tuple[Any, int]:
+    tag = raw[position]
+    position += 1
+
+    if tag == _T:
+        return True, position
+    if tag == _F:
+        return False, position
+    if tag == _N:
+        return None, position
+    if tag == _D:
+        return _DOUBLE.unpack_from(raw, position)[0], position + 8
+
+    length = raw[position]
+    position += 1
+    if length & 0x80:
+        length, position = _read_varint(raw, position - 1)
+
+    if tag == _S:
+        end = position + length
+        return raw[position:end].decode("utf-8"), end
+    if tag == _I:
+        end = position + length
+        return int.from_bytes(raw[position:end], "little", signed=True), end
+    if tag == _L:
+        items = []
+        for _ in range(length):
+            item, position = _decode_from(raw, position)
+            items.append(item)
+        return items, position
+    if tag == _M:
+        mapping = {}
+        for _ in range(length):
+            key, position = _decode_from(raw, position)
+            mapping[key], position = _decode_from(raw, position)
+        return mapping, position
+    if tag == _B:
+        end = position + length
+        return bytes(raw[position:end]), end
+    raise ValueError(f"Unknown BinaryCodec tag {tag!r}")
+
+
+JSON_CODEC = JSONCodec()
+BINARY_CODEC = BinaryCodec()
+
+
+def decode_value(raw: Union[str, bytes]) -> Any:
+    """
+    Decode a stored KV value whatever codec wrote it.
+
+    BinaryCodec values are stored as BLOBs and JSONCodec values as TEXT, so
+    the SQLite storage class tells them apart.
+
+    Args:
+        raw (Union[str, bytes]): The value column as returned by sqlite3.
+
+    Returns:
+        Any: The decoded Python value.
+
+    Example:
+        >>> decode_value('{"value": 42}')
+        42
+        >>> decode_value(b"T")
+        True
+    """
+    if isinstance(raw, bytes):
+        return BINARY_CODEC.decode(raw)
+    return JSON_CODEC.decode(raw)
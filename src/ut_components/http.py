@@ -14,14 +14,61 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import codecs
+import concurrent.futures
+import email.utils
+import gzip
+import hashlib
+import http.client
+import io
 import json as json_
-import urllib.error
+import os
+import random
+import select
+import ssl
+import sys
+import threading
+import time
 import urllib.parse
 import urllib.request
-from typing import Dict, Optional
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import IO, Any, Dict, FrozenSet, Iterator, List, Optional, Tuple, Union
 
+from .config import get_cache_path
 from .mimetypes import guess_type
 
+_NOT_PARSED = object()
+
+
+@dataclass
+class TransferStats:
+    """
+    Body bytes moved by one request() call, before and after compression.
+
+    Redirects and retries of the call are included. For a streamed response
+    the response counters grow as the body is read.
+
+    Attributes:
+        request_bytes (int): Request body bytes before compression.
+        request_wire_bytes (int): Request body bytes actually sent.
+        response_bytes (int): Response body bytes after decompression.
+        response_wire_bytes (int): Response body bytes actually received.
+    """
+
+    request_bytes: int = 0
+    request_wire_bytes: int = 0
+    response_bytes: int = 0
+    response_wire_bytes: int = 0
+
+    @property
+    def saved_bytes(self) -> int:
+        """
+        Bytes compression kept off the network, both directions together.
+        """
+        return self.request_bytes - self.request_wire_bytes + self.response_bytes - self.response_wire_bytes
+
 
 class Response:
     """
@@ -32,12 +79,28 @@ class Response:
     It encapsulates the response data and provides utility methods for common
     operations like checking for errors or parsing JSON content.
 
+    Nothing is decoded until asked for: text and json() are computed on
+    first use and cached, so callers that only check the status or want the
+    bytes never pay for a decode. A streamed response (request(...,
+    stream=True)) reads its body from the connection only when it is used:
+    incrementally through iter_content() or raw, or whole on the first
+    access to data, view, text or json(). Close it (or use it as a context
+    manager) if the body may not be read to the end.
+
     Attributes:
         url (str): The URL that was requested.
         success (bool): Whether the request completed without network errors.
         status_code (int): HTTP status code (200, 404, etc.). 0 for network errors.
+        headers (Optional[http.client.HTTPMessage]): Response headers. None
+            for network errors.
+        transfer (TransferStats): Bytes sent and received, before and after
+            compression.
         data (bytes): Raw response body as bytes.
-        text (str): Response body decoded as UTF-8 string.
+        view (memoryview): Read-only view of data, to slice the body
+            without copying it.
+        text (str): Response body decoded with the charset of its
+            Content-Type, UTF-8 by default.
+        raw (IO[bytes]): File-like object reading the body.
 
     Example:
         >>> from src.ut_components.http import get
@@ -50,12 +113,127 @@ class Response:
         ...     print(f"Request failed: {response.text}")
     """
 
-    def __init__(self, url: str, success: bool, status_code: int, data: bytes):
+    __slots__ = (
+        "url",
+        "success",
+        "status_code",
+        "headers",
+        "transfer",
+        "_data",
+        "_raw",
+        "_text",
+        "_json",
+        "_consumed",
+    )
+
+    def __init__(
+        self,
+        url: str,
+        success: bool,
+        status_code: int,
+        data: bytes = b"",
+        raw: Optional[IO[bytes]] = None,
+        headers: Optional[http.client.HTTPMessage] = None,
+        transfer: Optional[TransferStats] = None,
+    ):
         self.url = url
         self.success = success
         self.status_code = status_code
-        self.data = data
-        self.text = data.decode("utf-8", errors="ignore")
+        self.headers = headers
+        self.transfer = transfer or TransferStats()
+        self._data: Optional[bytes] = None if raw is not None else data
+        self._raw = raw
+        self._text: Optional[str] = None
+        self._json: Any = _NOT_PARSED
+        self._consumed = False
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            if self._consumed:
+                raise ValueError(f"The body of {self.url} was already consumed from raw or iter_content()")
+            self._data = self._raw.read()
+            self._raw.close()
+        return self._data
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.data)
+
+    @property
+    def encoding(self) -> str:
+        """
+        The charset of the body from its Content-Type, "utf-8" if none.
+        """
+        charset = self.headers.get_content_charset() if self.headers is not None else None
+        if charset:
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                pass
+        return "utf-8"
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode(self.encoding, errors="ignore")
+        return self._text
+
+    @property
+    def raw(self) -> IO[bytes]:
+        if self._data is not None:
+            return io.BytesIO(self._data)
+        self._consumed = True
+        return self._raw
+
+    def iter_content(self, chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Iterate over the response body in chunks.
+
+        For a streamed response, chunks are read from the connection as they
+        are iterated, so memory use is bounded by chunk_size; chunks may be
+        smaller when less data has arrived.
+
+        Args:
+            chunk_size (int): Maximum size of a chunk, in bytes.
+                Defaults to 64 KiB.
+
+        Yields:
+            bytes: The next part of the body.
+
+        Example:
+            >>> with request(vcard_url, method="GET", stream=True) as response:
+            ...     with open(path, "wb") as f:
+            ...         for chunk in response.iter_content():
+            ...             f.write(chunk)
+        """
+        if self._data is not None:
+            for start in range(0, len(self._data), chunk_size):
+                yield self._data[start : start + chunk_size]
+            return
+        raw = self.raw
+        while True:
+            chunk = raw.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self) -> None:
+        """
+        Release the connection of a streamed response.
+
+        A body read to the end gives its connection back to the pool on its
+        own; otherwise the connection is closed. Does nothing for responses
+        that are not streamed.
+        """
+        if self._raw is not None:
+            self._raw.close()
+
+    def __enter__(self) -> "Response":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
     def json(self) -> Dict:
         """
@@ -65,6 +243,8 @@ class Response:
         by parsing it as JSON. This is useful for working with REST APIs that
         return JSON responses.
 
+        The result is cached: later calls return the same object.
+
         Returns:
             Dict: Parsed JSON data as a Python dictionary or list.
 
@@ -77,7 +257,12 @@ class Response:
             ...     user_data = response.json()
             ...     print(f"User name: {user_data['name']}")
         """
-        return json_.loads(self.data)
+        if self._json is _NOT_PARSED:
+            encoding = self.encoding
+            # json.loads() detects UTF-8/16/32 in bytes by itself; other
+            # charsets have to go through text.
+            self._json = json_.loads(self.data if encoding.startswith("utf") else self.text)
+        return self._json
 
     def raise_for_status(self):
         """
@@ -106,12 +291,1053 @@ class Response:
             )
 
     def __str__(self):
-        return f"Response(url={self.url}, success={self.success}, status_code={self.status_code}, data={self.text})"
+        text = "<streamed>" if self._data is None else self.text
+        return f"Response(url={self.url}, success={self.success}, status_code={self.status_code}, data={text})"
 
     def __repr__(self):
         return self.__str__()
 
 
+# The User-Agent urllib used to send, kept so servers see the same client.
+USER_AGENT = f"Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}"
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PERMANENT_REDIRECT_CODES = (301, 308)
+
+# Response compressions requested by default, and the smallest request body
+# worth compressing for hosts that accept compressed bodies.
+ACCEPT_ENCODING = "gzip, deflate"
+COMPRESS_MIN_SIZE = 4096
+
+# Methods that can be sent again without changing the outcome (RFC 9110
+# section 9.2.2, plus the WebDAV read methods).
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE", "PROPFIND", "REPORT"})
+
+
+@dataclass(frozen=True)
+class Timeout:
+    """
+    Time limits of a request, in seconds. None means no limit.
+
+    Attributes:
+        connect (Optional[float]): Limit for opening a connection, TLS
+            handshake included. Defaults to 10.
+        read (Optional[float]): Limit for each wait on the server once
+            connected: sending the request, the response headers and every
+            read of the body. Defaults to 30.
+        total (Optional[float]): Limit for the whole request() call,
+            including redirects, retries and their backoff. Defaults to 300.
+
+    Example:
+        >>> from src.ut_components.http import Timeout, request
+        >>>
+        >>> response = request("https://dav.example.com/", method="PROPFIND", timeout=Timeout(total=60))
+    """
+
+    connect: Optional[float] = 10.0
+    read: Optional[float] = 30.0
+    total: Optional[float] = 300.0
+
+
+DEFAULT_TIMEOUT = Timeout()
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    When and how fast request() sends a request again after a failure.
+
+    Only idempotent methods are retried: a connection error or timeout, or a
+    response with a status in retry_statuses, is followed by a new attempt
+    after an exponential backoff with full jitter (a random delay between 0
+    and backoff_factor * 2 ** attempt, capped at backoff_max). If the server
+    sends Retry-After, that delay is used instead, up to retry_after_max.
+    Retries stop when the delay would go past the total timeout; the last
+    response or error is returned then.
+
+    Attributes:
+        retries (int): Maximum number of attempts after the first one.
+            Defaults to 3.
+        backoff_factor (float): Base of the exponential backoff, in seconds.
+            Defaults to 0.5.
+        backoff_max (float): Maximum backoff, in seconds. Defaults to 30.
+        retry_after_max (float): Longest Retry-After honored, in seconds;
+            longer ones end the retries. Defaults to 120.
+        retry_statuses (FrozenSet[int]): Status codes worth retrying.
+            Defaults to 429, 502, 503 and 504.
+        methods (FrozenSet[str]): Methods that may be retried. Defaults to
+            IDEMPOTENT_METHODS.
+
+    Example:
+        >>> from src.ut_components.http import RetryPolicy, request
+        >>>
+        >>> patient = RetryPolicy(retries=5, backoff_factor=1.0)
+        >>> response = request("https://dav.example.com/", method="PROPFIND", retry=patient)
+    """
+
+    retries: int = 3
+    backoff_factor: float = 0.5
+    backoff_max: float = 30.0
+    retry_after_max: float = 120.0
+    retry_statuses: FrozenSet[int] = frozenset({429, 502, 503, 504})
+    methods: FrozenSet[str] = IDEMPOTENT_METHODS
+
+    def can_retry(self, method: str, attempt: int) -> bool:
+        """
+        Tell whether a failed attempt (0 being the first) can be retried.
+        """
+        return attempt < self.retries and method.upper() in self.methods
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Get the delay before the retry following an attempt (0 being the first).
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2**attempt))
+
+    def delay(self, attempt: int, headers: http.client.HTTPMessage) -> Optional[float]:
+        """
+        Get the delay before retrying a response, honoring its Retry-After.
+
+        Returns:
+            Optional[float]: The delay in seconds, or None if Retry-After asks
+            for a longer wait than retry_after_max.
+        """
+        retry_after = _parse_retry_after(headers.get("Retry-After"))
+        if retry_after is None:
+            return self.backoff(attempt)
+        if retry_after > self.retry_after_max:
+            return None
+        return retry_after
+
+
+DEFAULT_RETRY = RetryPolicy()
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date.
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class RateLimiter:
+    """
+    Per-host token bucket limiting how fast requests are sent.
+
+    Every host (host:port) gets its own bucket holding up to burst tokens,
+    refilled at rate tokens per second; each request takes one token and
+    waits for it if the bucket is empty. Keeping a large sync under the
+    provider's limits is faster than getting throttled with 429 responses.
+
+    Args:
+        rate (float): Sustained requests per second per host. Defaults to 10.
+        burst (int): Requests that can be sent at once after an idle period.
+            Defaults to 20.
+
+    Example:
+        >>> from src.ut_components.http import RateLimiter, request
+        >>>
+        >>> gentle = RateLimiter(rate=2, burst=5)
+        >>> response = request("https://dav.example.com/", method="PROPFIND", rate_limiter=gentle)
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 20) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        # host -> [tokens, monotonic time of the last refill]
+        self._buckets: Dict[str, List[float]] = {}
+
+    def acquire(self, host: str, timeout: Optional[float] = None) -> bool:
+        """
+        Take a token for host, waiting for one if needed.
+
+        Args:
+            host (str): The host:port the request is sent to.
+            timeout (Optional[float]): Longest wait accepted, in seconds.
+                Defaults to None (wait as long as needed).
+
+        Returns:
+            bool: True once the token is taken, False without waiting if it
+            would take longer than timeout.
+        """
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(host, [float(self.burst), now])
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            wait = max(0.0, (1 - bucket[0]) / self.rate)
+            if timeout is not None and wait > timeout:
+                return False
+            # Taking the token now (possibly going below zero) reserves it, so
+            # concurrent callers queue up behind each other.
+            bucket[0] -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+RATE_LIMITER = RateLimiter()
+
+
+class RedirectCache:
+    """
+    Permanent redirects (301, 308) remembered per method and URL.
+
+    request() looks every hop up here before sending it, so a URL that
+    permanently moved, like a /.well-known/carddav entry point, goes
+    straight to its final location instead of asking the server for the
+    same redirect chain every time. If the remembered location answers 404
+    or 410, the remembered hops are forgotten and the original URL is asked
+    again.
+
+    Args:
+        ttl_seconds (float): How long a redirect is remembered. Defaults to
+            one day.
+        max_entries (int): Redirects kept; the oldest are dropped first.
+            Defaults to 256.
+
+    Example:
+        >>> from src.ut_components.http import REDIRECTS, request
+        >>>
+        >>> request("https://dav.example.com/.well-known/carddav", method="PROPFIND")
+        >>> REDIRECTS.resolve("PROPFIND", "https://dav.example.com/.well-known/carddav")
+        'https://dav.example.com/remote.php/dav/'
+    """
+
+    def __init__(self, ttl_seconds: float = 24 * 60 * 60, max_entries: int = 256) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (method, url) -> (status code, absolute location, monotonic expiry)
+        self._redirects: Dict[Tuple[str, str], Tuple[int, str, float]] = {}
+
+    def get(self, method: str, url: str) -> Optional[Tuple[int, str]]:
+        """
+        Look a redirect up.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL.
+
+        Returns:
+            Optional[Tuple[int, str]]: The status code and absolute location,
+            or None if url isn't known to be permanently redirected.
+        """
+        key = (method.upper(), url)
+        with self._lock:
+            entry = self._redirects.get(key)
+            if entry is None:
+                return None
+            status_code, location, expires = entry
+            if expires <= time.monotonic():
+                del self._redirects[key]
+                return None
+        return status_code, location
+
+    def put(self, method: str, url: str, status_code: int, location: str) -> None:
+        """
+        Remember that url permanently redirects to location.
+        """
+        key = (method.upper(), url)
+        with self._lock:
+            self._redirects.pop(key, None)
+            self._redirects[key] = (status_code, location, time.monotonic() + self.ttl_seconds)
+            while len(self._redirects) > self.max_entries:
+                del self._redirects[next(iter(self._redirects))]
+
+    def forget(self, method: str, url: str) -> None:
+        """
+        Drop the redirect remembered for method and url, if any.
+        """
+        with self._lock:
+            self._redirects.pop((method.upper(), url), None)
+
+    def resolve(self, method: str, url: str, max_redirects: int = 10) -> str:
+        """
+        Follow the remembered redirects of url.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL.
+            max_redirects (int): Longest chain followed. Defaults to 10.
+
+        Returns:
+            str: The last location reached, url itself if it isn't redirected.
+        """
+        for _ in range(max_redirects):
+            hop = self.get(method, url)
+            if hop is None:
+                break
+            status_code, url = hop
+            if status_code == 301 and method.upper() in ("POST", "PUT", "DELETE"):
+                method = "GET"
+        return url
+
+
+REDIRECTS = RedirectCache()
+
+# Methods whose responses HTTPCache stores by default. Only GET: servers
+# answer a matching If-None-Match on any other method with 412 Precondition
+# Failed instead of 304 (RFC 9110 section 13.1.2), and mostly ignore
+# If-Modified-Since on PROPFIND and REPORT.
+CACHEABLE_METHODS = frozenset({"GET"})
+
+# Headers describing the transfer rather than the stored (decoded) body.
+_UNCACHED_HEADERS = frozenset({"connection", "content-encoding", "content-length", "keep-alive", "transfer-encoding"})
+
+
+@dataclass
+class CachedResponse:
+    """
+    A response stored by HTTPCache.
+
+    Attributes:
+        url (str): The URL the response came from.
+        status_code (int): Its status code.
+        headers (List[Tuple[str, str]]): Its headers, without the transfer
+            related ones (the body is stored decoded).
+        body (bytes): Its body.
+    """
+
+    url: str
+    status_code: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+    def validators(self) -> Dict[str, str]:
+        """
+        Get the conditional request headers revalidating this response.
+        """
+        conditions = {}
+        for name, value in self.headers:
+            if name.lower() == "etag":
+                conditions["If-None-Match"] = value
+            elif name.lower() == "last-modified":
+                conditions["If-Modified-Since"] = value
+        return conditions
+
+    def message(self) -> http.client.HTTPMessage:
+        message = http.client.HTTPMessage()
+        for name, value in self.headers:
+            message[name] = value
+        return message
+
+
+class HTTPCache:
+    """
+    Opt-in on-disk cache of responses, revalidated with conditional requests.
+
+    Responses carrying an ETag or Last-Modified are stored with their
+    validators. The next request() for the same method, URL, headers and
+    body sends If-None-Match / If-Modified-Since, and a 304 Not Modified is
+    answered with the stored response, so an unchanged document costs a
+    round trip but no body transfer. Stored responses are always
+    revalidated, never served without asking the server. Other methods can
+    be cached through methods (the request body is part of the key); a 412
+    Precondition Failed answering the validators drops the entry and the
+    request is sent again without them.
+
+    Every entry is one file in the cache directory, named after the hash of
+    its key. The directory is bounded to max_bytes by evicting the least
+    recently used entries; processes sharing the directory (e.g. the UI and
+    the background sync) each keep their own view of it, so the bound is
+    approximate across processes.
+
+    Args:
+        path (Optional[str]): Directory of the cache. Defaults to None
+            ("http" under get_cache_path()).
+        max_bytes (int): Total size of the stored entries. Defaults to 16 MiB.
+        methods (FrozenSet[str]): Methods whose responses are cached.
+            Defaults to CACHEABLE_METHODS.
+
+    Example:
+        >>> from src.ut_components.http import HTTPCache, request
+        >>>
+        >>> cache = HTTPCache()
+        >>> response = request(url, method="GET", headers=headers, cache=cache)
+        >>> # Same request again: 304 from the server, body from the cache
+        >>> response = request(url, method="GET", headers=headers, cache=cache)
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = 16 * 1024 * 1024,
+        methods: FrozenSet[str] = CACHEABLE_METHODS,
+    ) -> None:
+        self.path = path or os.path.join(get_cache_path(), "http")
+        self.max_bytes = max_bytes
+        self.methods = methods
+        self._lock = threading.Lock()
+        # Entry file name -> size, least recently used first. Loaded from the
+        # directory on first use.
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._bytes = 0
+
+    def key(self, method: str, url: str, headers: Dict[str, str], data: Optional[bytes]) -> str:
+        """
+        Get the cache key of a request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            headers (Dict[str, str]): The request headers, as all of them can
+                change the response (e.g. Authorization or Depth).
+            data (Optional[bytes]): The request body.
+
+        Returns:
+            str: A hexadecimal digest identifying the request.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{method.upper()} {url}\n".encode())
+        for name, value in sorted((name.lower(), value) for name, value in headers.items()):
+            digest.update(f"{name}: {value}\n".encode())
+        digest.update(b"\n")
+        digest.update(data or b"")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        Look a response up and mark it as recently used.
+
+        Args:
+            key (str): The key from key().
+
+        Returns:
+            Optional[CachedResponse]: The stored response, or None.
+        """
+        path = os.path.join(self.path, key)
+        try:
+            with open(path, "rb") as f:
+                meta = json_.loads(f.readline())
+                body = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        except (OSError, ValueError):
+            self.delete(key)
+            return None
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                index.move_to_end(key)
+        headers = [(name, value) for name, value in meta["headers"]]
+        return CachedResponse(url=meta["url"], status_code=meta["status_code"], headers=headers, body=body)
+
+    def put(self, key: str, url: str, status_code: int, headers: http.client.HTTPMessage, body: bytes) -> bool:
+        """
+        Store a response if it can be revalidated.
+
+        Args:
+            key (str): The key from key().
+            url (str): The URL the response came from.
+            status_code (int): Its status code.
+            headers (http.client.HTTPMessage): Its headers.
+            body (bytes): Its decoded body.
+
+        Returns:
+            bool: True if stored; False if the response has no validator, is
+            marked no-store, is larger than max_bytes, or could not be
+            written.
+        """
+        if not self.storable(status_code, headers):
+            return False
+        meta = {
+            "url": url,
+            "status_code": status_code,
+            "headers": [[name, value] for name, value in headers.items() if name.lower() not in _UNCACHED_HEADERS],
+        }
+        encoded = json_.dumps(meta).encode() + b"\n"
+        size = len(encoded) + len(body)
+        if size > self.max_bytes:
+            return False
+
+        path = os.path.join(self.path, key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(temporary, "wb") as f:
+                f.write(encoded)
+                f.write(body)
+            os.replace(temporary, path)
+        except OSError:
+            # Caching is best effort: a full disk or an unwritable directory
+            # must not fail the request the response belongs to.
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            index = self._load_index()
+            self._bytes += size - index.pop(key, 0)
+            index[key] = size
+            evicted = []
+            while self._bytes > self.max_bytes:
+                name, evicted_size = index.popitem(last=False)
+                self._bytes -= evicted_size
+                evicted.append(name)
+        for name in evicted:
+            self._unlink(name)
+        return True
+
+    def storable(self, status_code: int, headers: http.client.HTTPMessage) -> bool:
+        """
+        Tell whether a response is worth storing: a 200 or 207 with an ETag
+        or Last-Modified, not marked Cache-Control: no-store.
+        """
+        if status_code not in (200, 207):
+            return False
+        if "no-store" in (headers.get("Cache-Control") or "").lower():
+            return False
+        return headers.get("ETag") is not None or headers.get("Last-Modified") is not None
+
+    def delete(self, key: str) -> None:
+        """
+        Drop a stored response, if any.
+        """
+        self._forget(key)
+        self._unlink(key)
+
+    def clear(self) -> None:
+        """
+        Drop every stored response.
+        """
+        with self._lock:
+            index = self._load_index()
+            names = list(index)
+            index.clear()
+            self._bytes = 0
+        for name in names:
+            self._unlink(name)
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._bytes -= self._load_index().pop(key, 0)
+
+    def _unlink(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        # Called with the lock held.
+        if self._index is None:
+            entries = []
+            try:
+                with os.scandir(self.path) as scan:
+                    for entry in scan:
+                        if entry.is_file() and not entry.name.endswith(".tmp"):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, entry.name, stat.st_size))
+            except OSError:
+                pass
+            entries.sort()
+            self._index = OrderedDict((name, size) for _, name, size in entries)
+            self._bytes = sum(size for _, _, size in entries)
+        return self._index
+
+
+# Errors meaning a kept-alive connection was closed by the server while idle;
+# the request is sent again once on a new connection.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+    ssl.SSLEOFError,
+)
+
+# (scheme, host, port, proxy host, proxy port) a connection is bound to.
+_PoolKey = Tuple[str, str, int, Optional[str], Optional[int]]
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """
+    HTTPSConnection resuming the last TLS session negotiated with its host.
+
+    Resuming a session skips the certificate exchange and key agreement of a
+    full handshake when a new connection to the same host has to be opened.
+    """
+
+    def __init__(self, host: str, port: int, context: ssl.SSLContext, sessions: Dict[str, ssl.SSLSession]) -> None:
+        super().__init__(host, port, context=context)
+        self._sessions = sessions
+
+    @property
+    def _session_host(self) -> str:
+        return self._tunnel_host or self.host
+
+    def connect(self) -> None:
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self._session_host,
+            session=self._sessions.get(self._session_host),
+        )
+
+    def save_session(self) -> None:
+        # TLS 1.3 session tickets arrive after the handshake, so the session
+        # is saved once a response has been read rather than on connect.
+        if self.sock is not None and self.sock.session is not None:
+            self._sessions[self._session_host] = self.sock.session
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of persistent HTTP(S) connections, kept per host.
+
+    urllib opens a new TCP connection and does a full TLS handshake for every
+    request. The pool keeps connections open after a response has been read
+    (HTTP/1.1 keep-alive) and hands them to the next request to the same
+    scheme, host and port, so a sequence of requests to one server (e.g.
+    CardDAV discovery) pays for the connection once. When a new connection
+    has to be opened, the TLS session of the previous one is resumed.
+
+    Connections are used by one request at a time. Idle ones are closed
+    after idle_timeout seconds, before the server is likely to drop them;
+    a request sent on a connection the server closed anyway is retried once
+    on a new one. Proxies from the environment (https_proxy, http_proxy,
+    no_proxy) are honored like urllib does.
+
+    Args:
+        max_per_host (int): Maximum number of idle connections kept per host.
+            Extra connections are closed when released. Defaults to 4.
+        idle_timeout (float): Seconds an idle connection is kept open.
+            Defaults to 60.
+        context (Optional[ssl.SSLContext]): TLS settings for HTTPS
+            connections. Defaults to None (ssl.create_default_context()).
+
+    Example:
+        >>> from src.ut_components.http import ConnectionPool, request
+        >>>
+        >>> pool = ConnectionPool(max_per_host=8, idle_timeout=30)
+        >>> response = request("https://dav.example.com/", method="PROPFIND", pool=pool)
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = 4,
+        idle_timeout: float = 60.0,
+        context: Optional[ssl.SSLContext] = None,
+    ) -> None:
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.context = context or ssl.create_default_context()
+        self._lock = threading.Lock()
+        self._idle: Dict[_PoolKey, List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._sessions: Dict[str, ssl.SSLSession] = {}
+        # Content codings each host (host:port) accepts in request bodies,
+        # from the Accept-Encoding of its responses (RFC 7694).
+        self.request_encodings: Dict[str, FrozenSet[str]] = {}
+        self._pid = os.getpid()
+
+    def acquire(self, url: str) -> Tuple[http.client.HTTPConnection, str, bool]:
+        """
+        Get a connection for a URL.
+
+        Args:
+            url (str): Absolute http or https URL.
+
+        Returns:
+            Tuple[http.client.HTTPConnection, str, bool]: The connection, the
+            request target to send on it, and whether it was reused.
+
+        Raises:
+            ValueError: If the URL is not an http or https URL.
+        """
+        key, target = self._route(url)
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sockets inherited from the parent are shared with it; drop
+                # them without closing.
+                self._idle = {}
+                self._pid = os.getpid()
+            idle = self._idle.get(key, [])
+            expired = [conn for conn, released_at in idle if released_at <= deadline]
+            idle[:] = [(conn, released_at) for conn, released_at in idle if released_at > deadline]
+            conn = idle.pop()[0] if idle else None
+        for stale in expired:
+            stale.close()
+        if conn is not None and not _is_dropped(conn):
+            return conn, target, True
+        if conn is not None:
+            conn.close()
+        return self._connect(key), target, False
+
+    def release(self, url: str, conn: http.client.HTTPConnection, reusable: bool = True) -> None:
+        """
+        Give back a connection obtained with acquire().
+
+        The response must have been read completely. The connection is closed
+        instead of kept if it is not reusable (the server asked to close it,
+        or the request failed) or the host already has max_per_host idle ones.
+
+        Args:
+            url (str): The URL passed to acquire().
+            conn (http.client.HTTPConnection): The connection.
+            reusable (bool): Whether the connection can take another request.
+                Defaults to True.
+        """
+        if isinstance(conn, _HTTPSConnection):
+            conn.save_session()
+        if reusable and conn.sock is not None:
+            key, _ = self._route(url)
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_per_host and self._pid == os.getpid():
+                    idle.append((conn, time.monotonic()))
+                    return
+        conn.close()
+
+    def close_all(self) -> None:
+        """
+        Close every idle connection in the pool.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+    def _route(self, url: str) -> Tuple[_PoolKey, str]:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported URL {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+        proxy_host = proxy_port = None
+        proxy = urllib.request.getproxies().get(parts.scheme)
+        if proxy and not urllib.request.proxy_bypass(parts.hostname):
+            proxy_parts = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            proxy_host, proxy_port = proxy_parts.hostname, proxy_parts.port or 80
+            if parts.scheme == "http":
+                # Plain HTTP proxies take the absolute URL as request target.
+                target = urllib.parse.urlunsplit(parts._replace(fragment=""))
+        return (parts.scheme, parts.hostname, port, proxy_host, proxy_port), target
+
+    def _connect(self, key: _PoolKey) -> http.client.HTTPConnection:
+        scheme, host, port, proxy_host, proxy_port = key
+        if scheme == "https":
+            if proxy_host:
+                conn = _HTTPSConnection(proxy_host, proxy_port, self.context, self._sessions)
+                conn.set_tunnel(host, port)
+                return conn
+            return _HTTPSConnection(host, port, self.context, self._sessions)
+        if proxy_host:
+            return http.client.HTTPConnection(proxy_host, proxy_port)
+        return http.client.HTTPConnection(host, port)
+
+
+POOL = ConnectionPool()
+
+
+def _is_dropped(conn: http.client.HTTPConnection) -> bool:
+    # An idle connection has nothing to read unless the server closed it.
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def _time_limit(seconds: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    # The smaller of a per-operation limit and what is left until deadline.
+    if deadline is None:
+        return seconds
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Total timeout exceeded")
+    return remaining if seconds is None else min(seconds, remaining)
+
+
+class _ResponseBody(io.RawIOBase):
+    """
+    Body of a response read straight from its pooled connection.
+
+    The connection goes back to the pool once the body has been read to the
+    end, and is closed instead if the body is closed before that. A gzip or
+    deflate Content-Encoding is decoded as the body is read; a compressed
+    stream cut short raises http.client.IncompleteRead.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        url: str,
+        conn: http.client.HTTPConnection,
+        sock,
+        response: http.client.HTTPResponse,
+        read_timeout: Optional[float],
+        deadline: Optional[float],
+        transfer: TransferStats,
+    ) -> None:
+        super().__init__()
+        self._pool = pool
+        self._url = url
+        self._conn = conn
+        self._sock = sock
+        self._response = response
+        self._read_timeout = read_timeout
+        self._deadline = deadline
+        self._transfer = transfer
+        self._buffer = b""
+        self._decoder = None
+        self._raw_deflate = False
+        self._compressed = False
+        encoding = (response.getheader("Content-Encoding") or "").strip().lower()
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # 32 + MAX_WBITS accepts both the gzip and zlib headers.
+            self._decoder = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            self._raw_deflate = encoding == "deflate"
+        self.done = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+        if self.closed:
+            raise ValueError("I/O operation on closed response body")
+        if not size:
+            return b""
+        try:
+            while not self._buffer and not self.done:
+                self._buffer = self._next_chunk(size)
+        except BaseException:
+            self.close()
+            raise
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def _next_chunk(self, size: int) -> bytes:
+        decoder = self._decoder
+        if decoder is not None and decoder.unconsumed_tail:
+            return self._decode(decoder.unconsumed_tail, size)
+
+        chunk = b""
+        # The response closes its socket itself once the last byte of a
+        # "Connection: close" body is read.
+        if not self._response.isclosed():
+            self._sock.settimeout(_time_limit(self._read_timeout, self._deadline))
+            # read1() returns what has arrived instead of waiting for size
+            # bytes, so the time limits apply to every network read.
+            chunk = self._response.read1(size if decoder is None else 65536)
+        if not chunk:
+            self.done = True
+            # read1() doesn't mark the response done like read() does, and
+            # the connection takes no new request until it is.
+            self._response.close()
+            self._pool.release(self._url, self._conn, reusable=not self._response.will_close)
+            if decoder is None:
+                return b""
+            tail = decoder.flush()
+            self._transfer.response_bytes += len(tail)
+            if self._compressed and not decoder.eof:
+                # A "Connection: close" body has no length to check against,
+                # only the end of the compressed stream tells it was cut.
+                # Bodyless responses (HEAD, 204, 304) never started one.
+                raise http.client.IncompleteRead(tail)
+            return tail
+
+        self._transfer.response_wire_bytes += len(chunk)
+        if decoder is None:
+            self._transfer.response_bytes += len(chunk)
+            return chunk
+        return self._decode(chunk, size)
+
+    def _decode(self, chunk: bytes, size: int) -> bytes:
+        # Output is capped so a highly compressed body can't blow up memory;
+        # the rest of the input waits in unconsumed_tail.
+        self._compressed = True
+        try:
+            data = self._decoder.decompress(chunk, max(size, 65536))
+        except zlib.error:
+            if not self._raw_deflate:
+                raise
+            # Some servers send "deflate" without the zlib header.
+            self._raw_deflate = False
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decoder.decompress(chunk, max(size, 65536))
+        self._raw_deflate = False
+        self._transfer.response_bytes += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+    def readall(self) -> bytes:
+        chunks = []
+        while True:
+            chunk = self.read(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def close(self) -> None:
+        if not self.closed and not self.done:
+            self.done = True
+            self._conn.close()
+        self._buffer = b""
+        super().close()
+
+
+def _discard(body: Union[bytes, _ResponseBody]) -> None:
+    # Read what is left of a small body (redirects, errors) to keep its
+    # connection; bigger ones are cut short by closing the connection.
+    if isinstance(body, _ResponseBody):
+        remaining = 65536
+        while remaining > 0 and not body.done:
+            remaining -= len(body.read(remaining))
+        body.close()
+
+
+def _send(
+    pool: ConnectionPool,
+    url: str,
+    method: str,
+    data: Optional[bytes],
+    headers: Dict[str, str],
+    timeout: Timeout,
+    deadline: Optional[float],
+    transfer: TransferStats,
+    stream: bool = False,
+) -> Tuple[int, http.client.HTTPMessage, Union[bytes, _ResponseBody]]:
+    # Send one request on a pooled connection. The body is read whole, or
+    # returned unread when streaming. A reused connection the server already
+    # closed is replaced once, but only when resending can't repeat work:
+    # the method is idempotent or the request never went out.
+    retried = False
+    while True:
+        conn, target, reused = pool.acquire(url)
+        sent = False
+        try:
+            if conn.sock is None:
+                conn.timeout = _time_limit(timeout.connect, deadline)
+                conn.connect()
+            # Kept aside: the connection drops its reference when the
+            # response says the connection will close.
+            sock = conn.sock
+            sock.settimeout(_time_limit(timeout.read, deadline))
+            conn.request(method, target, body=data, headers=headers)
+            sent = True
+            response = conn.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            conn.close()
+            if reused and not retried and (method in IDEMPOTENT_METHODS or not sent):
+                retried = True
+                continue
+            raise
+        except BaseException:
+            conn.close()
+            raise
+
+        # A streamed body is read after request() returned, so only the read
+        # limit applies to it.
+        body = _ResponseBody(pool, url, conn, sock, response, timeout.read, None if stream else deadline, transfer)
+        if stream:
+            return response.status, response.headers, body
+        return response.status, response.headers, body.readall()
+
+
+def _parse_codings(value: str) -> FrozenSet[str]:
+    # "gzip, deflate;q=0.5, br;q=0" -> {"gzip", "deflate"}
+    codings = set()
+    for item in value.split(","):
+        coding, _, params = item.partition(";")
+        name, _, quality = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                if float(quality) == 0:
+                    continue
+            except ValueError:
+                pass
+        if coding.strip():
+            codings.add(coding.strip().lower())
+    return frozenset(codings)
+
+
+def _send_with_retries(
+    pool: ConnectionPool,
+    url: str,
+    method: str,
+    data: Optional[bytes],
+    headers: Dict[str, str],
+    timeout: Timeout,
+    deadline: Optional[float],
+    retry: Optional[RetryPolicy],
+    rate_limiter: Optional[RateLimiter],
+    transfer: TransferStats,
+    compress_min_size: Optional[int] = None,
+    stream: bool = False,
+) -> Tuple[int, http.client.HTTPMessage, Union[bytes, _ResponseBody]]:
+    host = urllib.parse.urlsplit(url).netloc
+    attempt = 0
+    while True:
+        if rate_limiter is not None and not rate_limiter.acquire(host, _time_limit(None, deadline)):
+            raise TimeoutError("Total timeout exceeded waiting for the rate limiter")
+        send_data, send_headers = data, headers
+        compressed = (
+            compress_min_size is not None
+            and data is not None
+            and len(data) >= compress_min_size
+            and "gzip" in pool.request_encodings.get(host, ())
+            and not any(name.lower() == "content-encoding" for name in headers)
+        )
+        if compressed:
+            send_data = gzip.compress(data, compresslevel=6)
+            send_headers = {**headers, "Content-Encoding": "gzip"}
+        transfer.request_bytes += len(data or b"")
+        transfer.request_wire_bytes += len(send_data or b"")
+        try:
+            status_code, response_headers, body = _send(
+                pool, url, method, send_data, send_headers, timeout, deadline, transfer, stream
+            )
+        except ssl.SSLCertVerificationError:
+            raise
+        except (OSError, http.client.HTTPException):
+            if retry is None or not retry.can_retry(method, attempt):
+                raise
+            delay: Optional[float] = retry.backoff(attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+        else:
+            accept_encoding = response_headers.get("Accept-Encoding")
+            if accept_encoding is not None:
+                pool.request_encodings[host] = _parse_codings(accept_encoding)
+            if compressed and status_code == 415:
+                # The server doesn't take compressed bodies after all; send
+                # it as is, without counting it as a retry.
+                pool.request_encodings[host] = frozenset()
+                _discard(body)
+                continue
+            if retry is None or status_code not in retry.retry_statuses or not retry.can_retry(method, attempt):
+                return status_code, response_headers, body
+            delay = retry.delay(attempt, response_headers)
+            if delay is None or (deadline is not None and time.monotonic() + delay >= deadline):
+                return status_code, response_headers, body
+            _discard(body)
+        time.sleep(delay)
+        attempt += 1
+
+
 def request(
     url: str,
     method: str,
@@ -119,6 +1345,14 @@ def request(
     headers: Optional[Dict[str, str]] = None,
     follow_redirects: bool = True,
     max_redirects: int = 10,
+    pool: Optional[ConnectionPool] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    retry: Optional[RetryPolicy] = DEFAULT_RETRY,
+    rate_limiter: Optional[RateLimiter] = RATE_LIMITER,
+    stream: bool = False,
+    compress_request: Optional[int] = COMPRESS_MIN_SIZE,
+    cache: Optional[HTTPCache] = None,
+    redirect_cache: Optional[RedirectCache] = REDIRECTS,
 ) -> Response:
     """
     Perform a generic HTTP request with automatic redirect handling.
@@ -126,7 +1360,11 @@ def request(
     This is the core function that handles all HTTP methods. It provides full
     control over the request, including custom methods, headers, and redirect
     behavior. It automatically handles various redirect status codes and follows
-    them according to HTTP specifications.
+    them according to HTTP specifications. Requests are sent on persistent
+    connections from a ConnectionPool, so consecutive requests to the same
+    host reuse one connection. Responses are requested with gzip or deflate
+    compression unless headers sets Accept-Encoding itself, and a gzip or
+    deflate Content-Encoding is always decompressed as the body is read.
 
     Args:
         url (str): The target URL for the request.
@@ -138,6 +1376,35 @@ def request(
             Defaults to True.
         max_redirects (int): Maximum number of redirects to follow before failing.
             Defaults to 10.
+        pool (Optional[ConnectionPool]): Pool the connection is taken from.
+            Defaults to None (POOL, shared by every request in the process).
+        timeout (Timeout): Connect, read and total time limits. Defaults to
+            DEFAULT_TIMEOUT.
+        retry (Optional[RetryPolicy]): When to send idempotent requests
+            again after a connection error, timeout, 429 or 5xx response.
+            Defaults to DEFAULT_RETRY. Pass None to never retry.
+        rate_limiter (Optional[RateLimiter]): Per-host limit on how fast
+            requests are sent. Defaults to RATE_LIMITER, shared by every
+            request in the process. Pass None to send without limit.
+        stream (bool): Return as soon as the response headers arrived and
+            read the body only when the Response is consumed, through
+            iter_content() or raw, so it never has to fit in memory. The
+            connection is used until the body is read to the end or the
+            Response is closed. Defaults to False.
+        compress_request (Optional[int]): Gzip request bodies of at least
+            this many bytes for hosts that announced they accept gzip bodies
+            (Accept-Encoding in an earlier response, RFC 7694). Defaults to
+            COMPRESS_MIN_SIZE. Pass None to never compress.
+        cache (Optional[HTTPCache]): Store responses that have validators
+            and revalidate them on the next identical request, answering a
+            304 from the cache and retrying without the validators on a
+            412. A response that gets stored is read whole, even with
+            stream=True. Requests that already carry conditional headers
+            bypass the cache. Defaults to None (no caching).
+        redirect_cache (Optional[RedirectCache]): Where permanent redirects
+            are remembered, so later requests skip them. Defaults to
+            REDIRECTS, shared by every request in the process. Pass None to
+            always ask the server.
 
     Returns:
         Response: A Response object containing the result of the HTTP request.
@@ -159,91 +1426,146 @@ def request(
         ...     method="HEAD",
         ...     follow_redirects=False
         ... )
+        >>>
+        >>> # Parse a large multistatus document as it arrives
+        >>> with request(url, method="PROPFIND", data=body, stream=True) as response:
+        ...     response.raise_for_status()
+        ...     for event, element in ElementTree.iterparse(response.raw):
+        ...         ...
     """
+    request_headers = dict(headers or {})
+    given = {name.lower() for name in request_headers}
+    if "user-agent" not in given:
+        request_headers["User-Agent"] = USER_AGENT
+    if "accept-encoding" not in given:
+        request_headers["Accept-Encoding"] = ACCEPT_ENCODING
+    deadline = None if timeout.total is None else time.monotonic() + timeout.total
+    transfer = TransferStats()
+    if cache is not None and any(name.lower().startswith("if-") for name in request_headers):
+        cache = None
+    if not follow_redirects:
+        redirect_cache = None
     redirect_count = 0
     current_url = url
     current_method = method
     current_data = data
+    # Hops taken from redirect_cache instead of asking the server.
+    remembered: List[Tuple[str, str]] = []
 
     while redirect_count < max_redirects:
+        hop = redirect_cache.get(current_method, current_url) if redirect_cache is not None else None
+        if hop is not None:
+            status_code, location = hop
+            remembered.append((current_method, current_url))
+            redirect_count += 1
+            current_url = location
+            if status_code == 301 and current_method in ("POST", "PUT", "DELETE"):
+                current_method = "GET"
+                current_data = None
+            continue
+
+        cache_key = None
+        cached = None
+        hop_headers = request_headers
+        if cache is not None and current_method.upper() in cache.methods:
+            cache_key = cache.key(current_method, current_url, request_headers, current_data)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                hop_headers = {**request_headers, **cached.validators()}
+
         try:
-            request = urllib.request.Request(
+            status_code, response_headers, body = _send_with_retries(
+                pool or POOL,
                 current_url,
-                data=current_data,
-                headers=headers or {},
-                method=current_method,
+                current_method,
+                current_data,
+                hop_headers,
+                timeout,
+                deadline,
+                retry,
+                rate_limiter,
+                transfer,
+                compress_request,
+                stream,
             )
-            with urllib.request.urlopen(request) as response:
-                return Response(
-                    url=current_url,
-                    success=True,
-                    status_code=response.code,
-                    data=response.read(),
-                )
-        except urllib.error.HTTPError as e:
-            if follow_redirects and e.code in (301, 302, 303, 307, 308):
-                redirect_count += 1
-                location = e.headers.get("Location")
-                if not location:
-                    error_content = b""
-                    try:
-                        if e.fp:
-                            error_content = e.fp.read()
-                    except Exception:
-                        pass
-                    return Response(
-                        url=current_url,
-                        success=False,
-                        status_code=e.code,
-                        data=error_content,
-                    )
-
-                if not location.startswith(("http://", "https://")):
-                    from urllib.parse import urljoin
-
-                    location = urljoin(current_url, location)
-
-                current_url = location
-
-                if e.code == 303 or (e.code in (301, 302) and current_method in ("POST", "PUT", "DELETE")):
-                    current_method = "GET"
-                    current_data = None
-                elif e.code in (307, 308):
-                    pass
+        except Exception as e:
+            return Response(url=current_url, success=False, status_code=0, data=str(e).encode(), transfer=transfer)
 
-                continue
-            else:
-                error_content = b""
-                try:
-                    if e.fp:
-                        error_content = e.fp.read()
-                except Exception:
-                    pass
-
-                return Response(
-                    url=current_url,
-                    success=False,
-                    status_code=e.code,
-                    data=error_content,
-                )
-        except urllib.error.URLError as e:
+        if cached is not None and status_code == 304:
+            _discard(body)
             return Response(
                 url=current_url,
-                success=False,
-                status_code=0,
-                data=str(e.reason).encode(),
+                success=True,
+                status_code=cached.status_code,
+                data=cached.body,
+                headers=cached.message(),
+                transfer=transfer,
             )
-        except Exception as e:
-            return Response(url=current_url, success=False, status_code=0, data=str(e).encode())
+        if cached is not None and status_code == 412:
+            # The validators came from the cache, not the caller: the server
+            # refuses them for this method, so ask again without them.
+            _discard(body)
+            cache.delete(cache_key)
+            continue
+        if cache_key is not None and cache.storable(status_code, response_headers):
+            if isinstance(body, _ResponseBody):
+                try:
+                    body = body.readall()
+                except Exception as e:
+                    return Response(
+                        url=current_url, success=False, status_code=0, data=str(e).encode(), transfer=transfer
+                    )
+            cache.put(cache_key, current_url, status_code, response_headers, body)
+
+        if remembered and status_code in (404, 410):
+            # The resource moved again since the redirect was remembered.
+            _discard(body)
+            for remembered_method, remembered_url in remembered:
+                redirect_cache.forget(remembered_method, remembered_url)
+            remembered = []
+            current_url, current_method, current_data = url, method, data
+            continue
+
+        if follow_redirects and status_code in REDIRECT_CODES:
+            location = response_headers.get("Location")
+            if not location:
+                return _response(current_url, status_code, response_headers, body, transfer)
+
+            _discard(body)
+            redirect_count += 1
+            location = urllib.parse.urljoin(current_url, location)
+            if redirect_cache is not None and status_code in PERMANENT_REDIRECT_CODES:
+                redirect_cache.put(current_method, current_url, status_code, location)
+            current_url = location
+            if status_code == 303 or (status_code in (301, 302) and current_method in ("POST", "PUT", "DELETE")):
+                current_method = "GET"
+                current_data = None
+            continue
+
+        return _response(current_url, status_code, response_headers, body, transfer)
 
     return Response(
         url=current_url,
         success=False,
         status_code=0,
         data=b"Maximum redirects exceeded",
+        transfer=transfer,
     )
 
 
+def _response(
+    url: str,
+    status_code: int,
+    headers: http.client.HTTPMessage,
+    body: Union[bytes, _ResponseBody],
+    transfer: TransferStats,
+) -> Response:
+    success = 200 <= status_code < 300
+    if isinstance(body, _ResponseBody):
+        return Response(url=url, success=success, status_code=status_code, raw=body, headers=headers, transfer=transfer)
+    return Response(url=url, success=success, status_code=status_code, data=body, headers=headers, transfer=transfer)
+
+
 def post(url: str, json: Optional[Dict] = None, headers: Optional[Dict[str, str]] = None) -> Response:
     """
     Perform an HTTP POST request to send data to a server.
@@ -556,3 +1878,222 @@ def post_file(
         request_headers.update(headers)
 
     return request(url, method="POST", data=body, headers=request_headers)
+
+
+@dataclass
+class BatchRequest:
+    """
+    One request of a batch(), described with the arguments of request().
+
+    Attributes:
+        url (str): The target URL.
+        method (str): HTTP method. Defaults to "GET".
+        data (Optional[bytes]): Request body. Defaults to None.
+        headers (Optional[Dict[str, str]]): HTTP headers. Defaults to None.
+        options (Dict[str, Any]): Any other keyword arguments of request(),
+            e.g. {"cache": cache, "retry": None}. Defaults to none.
+    """
+
+    url: str
+    method: str = "GET"
+    data: Optional[bytes] = None
+    headers: Optional[Dict[str, str]] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+class Batch:
+    """
+    Requests sent concurrently by batch().
+
+    Iterating a Batch yields the responses in the order of the requests;
+    as_completed() yields them as they arrive. Requests that fail, are
+    cancelled or don't finish before the deadline get a Response with
+    success False and status_code 0, like network errors from request(), so
+    every request has exactly one response.
+
+    Use it as a context manager to cancel whatever is left when leaving the
+    block early.
+    """
+
+    def __init__(
+        self,
+        requests: List[BatchRequest],
+        max_concurrency: int,
+        per_host_limit: Optional[int],
+        timeout: Optional[float],
+    ) -> None:
+        self.requests = requests
+        self._deadline = None if timeout is None else time.monotonic() + timeout
+        self._per_host_limit = per_host_limit
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, threading.Semaphore] = {}
+        self._stopped = threading.Event()
+        self._reason = b"Batch cancelled"
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(max_concurrency, len(requests))),
+            thread_name_prefix="http-batch",
+        )
+        # Workers hitting the deadline call _stop(), which waits for the lock
+        # until every request is submitted.
+        with self._lock:
+            self._futures = [executor.submit(self._run, item) for item in requests]
+        # Submitted work still runs; the threads exit once it's done.
+        executor.shutdown(wait=False)
+
+    def __iter__(self) -> Iterator[Response]:
+        for index in range(len(self._futures)):
+            yield self._outcome(index)
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def __enter__(self) -> "Batch":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.cancel()
+
+    def results(self) -> List[Response]:
+        """
+        Wait for every request and get the responses in request order.
+        """
+        return list(self)
+
+    def as_completed(self) -> Iterator[Tuple[int, Response]]:
+        """
+        Yield the responses as they arrive.
+
+        Yields:
+            Tuple[int, Response]: The index of the request in the batch and
+            its response.
+        """
+        indexes = {future: index for index, future in enumerate(self._futures)}
+        pending = set(self._futures)
+        while pending:
+            # Past the deadline only requests already sent are left, and they
+            # end within their capped total timeout.
+            timeout = None if self._stopped.is_set() else self._remaining()
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                self._stop(b"Batch deadline exceeded")
+                continue
+            for index in sorted(indexes[future] for future in done):
+                yield index, self._outcome(index)
+
+    def cancel(self) -> int:
+        """
+        Cancel the requests that haven't been sent yet. Requests already
+        being sent are finished.
+
+        Returns:
+            int: How many requests were cancelled.
+        """
+        return self._stop(b"Batch cancelled")
+
+    def _stop(self, reason: bytes) -> int:
+        with self._lock:
+            if not self._stopped.is_set():
+                self._reason = reason
+                self._stopped.set()
+            return sum(future.cancel() for future in self._futures)
+
+    def _remaining(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def _outcome(self, index: int) -> Response:
+        future = self._futures[index]
+        if not future.done():
+            concurrent.futures.wait([future], timeout=self._remaining())
+            if not future.done():
+                self._stop(b"Batch deadline exceeded")
+                # A request already sent ends within its total timeout, which
+                # _run() capped at the deadline.
+                concurrent.futures.wait([future])
+        if future.cancelled():
+            return self._failed(index)
+        return future.result()
+
+    def _failed(self, index: int) -> Response:
+        return Response(url=self.requests[index].url, success=False, status_code=0, data=self._reason)
+
+    def _host_slot(self, url: str) -> threading.Semaphore:
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = threading.Semaphore(self._per_host_limit)
+            return slot
+
+    def _run(self, item: BatchRequest) -> Response:
+        try:
+            return self._send(item)
+        except Exception as e:
+            # request() reports network errors itself; this catches anything
+            # else (e.g. invalid options), so every request gets a response.
+            return Response(url=item.url, success=False, status_code=0, data=str(e).encode())
+
+    def _send(self, item: BatchRequest) -> Response:
+        options = dict(item.options)
+        slot = self._host_slot(item.url) if self._per_host_limit else None
+        acquired = slot is not None and slot.acquire(timeout=self._remaining())
+        if slot is not None and not acquired:
+            self._stop(b"Batch deadline exceeded")
+        try:
+            remaining = self._remaining()
+            if self._stopped.is_set() or remaining == 0:
+                return Response(url=item.url, success=False, status_code=0, data=self._reason)
+            if remaining is not None:
+                timeout = options.get("timeout", DEFAULT_TIMEOUT)
+                total = remaining if timeout.total is None else min(timeout.total, remaining)
+                options["timeout"] = replace(timeout, total=total)
+            return request(item.url, method=item.method, data=item.data, headers=item.headers, **options)
+        finally:
+            if acquired:
+                slot.release()
+
+
+def batch(
+    requests: List[BatchRequest],
+    max_concurrency: int = 8,
+    per_host_limit: Optional[int] = 4,
+    timeout: Optional[float] = None,
+) -> Batch:
+    """
+    Send several requests concurrently.
+
+    Each request runs request() on a thread of its own pool, so the waits
+    for independent responses overlap instead of adding up. Connections come
+    from the same ConnectionPool as sequential requests, and the per-host
+    RateLimiter still applies.
+
+    Args:
+        requests (List[BatchRequest]): The requests to send.
+        max_concurrency (int): Requests in flight at once. Defaults to 8.
+        per_host_limit (Optional[int]): Requests in flight at once to the
+            same host. Defaults to 4, the connections ConnectionPool keeps
+            per host. Pass None for no per-host limit.
+        timeout (Optional[float]): Seconds for the whole batch. Requests are
+            sent with their total timeout capped to what is left, and those
+            not started in time are not sent. Defaults to None (no limit).
+
+    Returns:
+        Batch: Already running; iterate it for the responses in request
+        order, or use as_completed().
+
+    Example:
+        >>> from src.ut_components.http import BatchRequest, batch
+        >>>
+        >>> requests = [BatchRequest(url) for url in vcard_urls]
+        >>> for response in batch(requests, timeout=60):
+        ...     print(response.status_code, len(response.data))
+        >>>
+        >>> with batch(requests, max_concurrency=4) as running:
+        ...     for index, response in running.as_completed():
+        ...         if not response.success:
+        ...             running.cancel()
+    """
+    return Batch(list(requests), max_concurrency, per_host_limit, timeout)
@@ -14,15 +14,765 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import json
 import os
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Any, List, Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+from .codec import BINARY_CODEC, Codec, decode_value
 from .config import get_config_path
 
 
+@dataclass(frozen=True)
+class KVShard:
+    """
+    A key namespace stored in its own SQLite file, attached to kv.db.
+
+    Every key starting with one of the prefixes is stored in
+    "kv.<name>.db" next to kv.db instead of in kv.db itself. Each shard has
+    its own pages, WAL and write lock, so cache churn does not fragment the
+    main file or hold up writers of other namespaces, and it can trade
+    durability for speed on its own (e.g. synchronous=OFF for a cache that
+    can be rebuilt).
+
+    Attributes:
+        name (str): Schema name the file is attached as. Must be a valid SQL
+            identifier other than "main" and "temp".
+        prefixes (Tuple[str, ...]): Key prefixes routed to this shard. When
+            prefixes of several shards match a key, the longest one wins.
+        synchronous (Optional[str]): SQLite synchronous level for this file.
+            Defaults to None (the profile's).
+        journal_mode (Optional[str]): SQLite journal mode for this file.
+            Defaults to None (the profile's).
+
+    Example:
+        >>> from src.ut_components.kv import KVProfile, KVShard
+        >>>
+        >>> profile = KVProfile(shards=(KVShard("cache", ("memoize.",), synchronous="OFF"),))
+    """
+
+    name: str
+    prefixes: Tuple[str, ...]
+    synchronous: Optional[str] = None
+    journal_mode: Optional[str] = None
+
+
+# memoize results can always be recomputed, so their file skips fsync
+# entirely; leases change on every heartbeat and are kept away from config.
+# Only kv.db has a change feed (see KV.changes_since()), so state the UI
+# watches, like the server.*.last_run.* results of a sync, stays there.
+DEFAULT_SHARDS = (
+    KVShard("cache", ("memoize.",), synchronous="OFF"),
+    KVShard("runtime", ("sync.",)),
+)
+
+
+@dataclass(frozen=True)
+class KVProfile:
+    """
+    Connection settings applied to every SQLite connection of a KV database.
+
+    The default profile is tuned for several processes sharing kv.db (the
+    QML app and the systemd background sync): WAL journaling lets readers
+    and a writer work at the same time, busy_timeout makes a blocked writer
+    wait instead of failing with "database is locked", and synchronous=NORMAL
+    drops the fsync on every commit, which is safe in WAL mode.
+
+    Attributes:
+        journal_mode (str): SQLite journal mode ("WAL", "DELETE", ...).
+        synchronous (str): SQLite synchronous level ("OFF", "NORMAL", "FULL").
+        busy_timeout_ms (int): How long to wait on a locked database before
+            raising, in milliseconds.
+        wal_autocheckpoint (int): WAL size in pages that triggers an automatic
+            checkpoint on commit. 0 disables automatic checkpoints, leaving
+            them to KV.checkpoint().
+        sweep_on_startup (bool): Purge expired rows when the database is first
+            opened by the process.
+        sweep_every_writes (int): Purge expired rows after this many writes in
+            the process. 0 disables write-triggered sweeps.
+        sweep_batch_size (int): Rows deleted per purge batch. Each batch is its
+            own short transaction so sweeps never hold the write lock for long.
+        sweep_max_batches (int): Maximum batches per automatic sweep, bounding
+            the work done on the caller's path.
+        incremental_vacuum (bool): Switch the database to
+            auto_vacuum=INCREMENTAL and give freed pages back to the file
+            system after each sweep. Enabling it on an existing database runs
+            a one-time VACUUM.
+        write_chunk_size (int): Rows sent per executemany() call when writing
+            entries staged with put_cached().
+        auto_flush_rows (int): Once this many rows are staged with
+            put_cached(), they are written into the open transaction so memory
+            stays bounded. Flushed rows are committed by commit_cached(), or
+            earlier by any other write (put(), delete(), ...) on the same
+            KV, so a batch larger than this is not atomic. 0 disables
+            auto-flush.
+        codec (Codec): Encoding used for values written through this profile.
+            Rows written with any codec remain readable (see
+            codec.decode_value()).
+        change_retention (int): Number of most recent entries of the change
+            feed (see KV.changes_since()) kept by sweeps. Readers further
+            behind than that get a reset instead of a delta.
+        shards (Tuple[KVShard, ...]): Namespaces stored in separate files
+            attached to kv.db. Keys matching no shard stay in kv.db. Rows
+            already in kv.db are moved to their shard when it is first
+            attached.
+
+    Example:
+        >>> from src.ut_components.kv import KV, KVProfile
+        >>>
+        >>> # Wait up to 10 seconds for other processes, checkpoint manually
+        >>> profile = KVProfile(busy_timeout_ms=10000, wal_autocheckpoint=0)
+        >>> with KV(profile=profile) as kv:
+        ...     kv.put("key", "value")
+        ...     kv.checkpoint()
+    """
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    wal_autocheckpoint: int = 1000
+    sweep_on_startup: bool = True
+    sweep_every_writes: int = 1000
+    sweep_batch_size: int = 500
+    sweep_max_batches: int = 10
+    incremental_vacuum: bool = False
+    write_chunk_size: int = 500
+    auto_flush_rows: int = 5000
+    codec: Codec = BINARY_CODEC
+    change_retention: int = 10000
+    shards: Tuple[KVShard, ...] = DEFAULT_SHARDS
+
+
+DEFAULT_PROFILE = KVProfile()
+
+
+@dataclass
+class PurgeStats:
+    """
+    Result of a sweep of expired KV rows.
+
+    Attributes:
+        rows_reclaimed (int): Number of expired rows deleted.
+        bytes_freed (int): Bytes of database pages no longer used by live data.
+        bytes_truncated (int): Bytes removed from the database file by
+            incremental vacuum (0 unless the profile enables it).
+        batches (int): Number of delete batches executed.
+        sweeps (int): Number of sweeps aggregated in these stats.
+        changes_pruned (int): Number of change feed entries dropped because
+            they fell outside the profile's change_retention.
+    """
+
+    rows_reclaimed: int = 0
+    bytes_freed: int = 0
+    bytes_truncated: int = 0
+    batches: int = 0
+    sweeps: int = 0
+    changes_pruned: int = 0
+
+    def add(self, other: "PurgeStats") -> None:
+        self.rows_reclaimed += other.rows_reclaimed
+        self.bytes_freed += other.bytes_freed
+        self.bytes_truncated += other.bytes_truncated
+        self.batches += other.batches
+        self.sweeps += other.sweeps
+        self.changes_pruned += other.changes_pruned
+
+
+@dataclass
+class Change:
+    """
+    One entry of the KV change feed.
+
+    Attributes:
+        revision (int): Revision of the write. Revisions only ever increase.
+        key (str): The key that was written or deleted.
+        deleted (bool): True if the key was deleted (or purged after
+            expiring), False if it was inserted or updated.
+    """
+
+    revision: int
+    key: str
+    deleted: bool
+
+
+@dataclass
+class ChangeSet:
+    """
+    Changes returned by KV.changes_since().
+
+    Attributes:
+        revision (int): Revision to pass to the next changes_since() call.
+        changes (List[Change]): The latest change of every key modified
+            after the requested revision, oldest first.
+        reset (bool): True if the requested revision is older than the
+            retained history. Changes may be missing and the caller should
+            reload everything it shows.
+    """
+
+    revision: int
+    changes: List[Change]
+    reset: bool = False
+
+
+# SQLite versions before 3.32 (e.g. Ubuntu Touch 20.04) allow at most 999
+# bound parameters per statement.
+MAX_VARIABLES = 999
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+def _expires_at(ttl_seconds: Optional[int]) -> Optional[int]:
+    if ttl_seconds:
+        return _now() + int(ttl_seconds)
+    return None
+
+
+def _page_counts(conn: sqlite3.Connection, schema: str = "main") -> Tuple[int, int, int]:
+    page_size = conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0]
+    page_count = conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+    freelist_count = conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+    return page_size, page_count, freelist_count
+
+
+def purge_expired(
+    conn: sqlite3.Connection,
+    batch_size: int,
+    max_batches: Optional[int] = None,
+    incremental_vacuum: bool = False,
+    change_retention: Optional[int] = None,
+    schema: str = "main",
+) -> PurgeStats:
+    """
+    Delete expired rows from a KV database in bounded batches.
+
+    Expired rows are found through the ttl index and deleted batch_size rows
+    at a time, committing after every batch so concurrent writers only wait
+    for one short transaction. The change feed is trimmed to its retention
+    in the same pass.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the KV database.
+        batch_size (int): Rows deleted per transaction.
+        max_batches (Optional[int]): Stop after this many batches even if
+            expired rows remain. Defaults to None (run until done).
+        incremental_vacuum (bool): Release free pages back to the file system
+            afterwards. Requires auto_vacuum=INCREMENTAL. Defaults to False.
+        change_retention (Optional[int]): Keep only this many most recent
+            change feed entries. Defaults to None (keep everything).
+        schema (str): The attached database to sweep (see KVShard).
+            Defaults to "main" (kv.db).
+
+    Returns:
+        PurgeStats: Rows and bytes reclaimed by this sweep.
+    """
+    conn.commit()
+    page_size, pages_before, free_before = _page_counts(conn, schema)
+    stats = PurgeStats(sweeps=1)
+    now_seconds = _now()
+
+    while max_batches is None or stats.batches < max_batches:
+        cursor = conn.execute(
+            f"""
+            DELETE FROM {schema}.kv WHERE rowid IN (
+                SELECT rowid FROM {schema}.kv WHERE ttl IS NOT NULL AND ttl <= ? LIMIT ?
+            )
+        """,
+            (now_seconds, batch_size),
+        )
+        conn.commit()
+        stats.batches += 1
+        stats.rows_reclaimed += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            break
+
+    if change_retention is not None:
+        cursor = conn.execute(
+            f"DELETE FROM {schema}.kv_changes WHERE rev <= (SELECT max(rev) FROM {schema}.kv_changes) - ?",
+            (change_retention,),
+        )
+        conn.commit()
+        stats.changes_pruned = cursor.rowcount
+
+    if incremental_vacuum and (stats.rows_reclaimed or stats.changes_pruned):
+        # executescript() steps the pragma to completion; execute() would
+        # only release a single page.
+        conn.executescript(f"PRAGMA {schema}.incremental_vacuum;")
+
+    _, pages_after, free_after = _page_counts(conn, schema)
+    stats.bytes_freed = max(0, (pages_before - free_before) - (pages_after - free_after)) * page_size
+    stats.bytes_truncated = max(0, pages_before - pages_after) * page_size
+    return stats
+
+
+class _PooledConnection:
+    """
+    A SQLite connection checked out of a ConnectionPool by one thread.
+
+    Nested KV instances opened on the same thread share the same handle, so
+    depth counts how many of them are currently holding it. tx_depth counts
+    nested KV.transaction() blocks, tx_schema the shard they write to,
+    pending_writes the rows written inside them that have not been
+    committed yet, and on_commit the callbacks waiting for them to commit
+    (see KV.on_commit()). generation is the pool's profile generation the
+    connection was set up for.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, generation: int = 0) -> None:
+        self.conn = conn
+        self.generation = generation
+        self.depth = 0
+        self.tx_depth = 0
+        self.tx_schema = "main"
+        self.pending_writes = 0
+        self.on_commit: List[Callable[[], None]] = []
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of SQLite connections for a single database file.
+
+    Opening a SQLite database, creating the schema and committing on every
+    KV() call is expensive when a single operation opens the store dozens of
+    times. The pool keeps warm connections around (together with the
+    statement cache sqlite3 keeps per connection) and hands them out to
+    KV instances.
+
+    Connections are thread-affine while checked out: a thread always gets the
+    same connection back for nested KV() calls, and different threads (e.g.
+    pyotherside worker threads) never share a connection at the same time.
+    Released connections go back to an idle list and can be picked up by any
+    thread.
+
+    Args:
+        path (str): Path to the SQLite database file.
+        profile (KVProfile): Settings applied to every connection opened by
+            the pool. Defaults to DEFAULT_PROFILE.
+        max_idle (int): Maximum number of idle connections kept open.
+            Extra connections are closed on release. Defaults to 4.
+
+    Example:
+        >>> pool = get_pool("/tmp/example.db")
+        >>> handle = pool.acquire()
+        >>> handle.conn.execute("SELECT 1").fetchone()
+        (1,)
+        >>> pool.release(handle)
+    """
+
+    def __init__(self, path: str, profile: KVProfile = DEFAULT_PROFILE, max_idle: int = 4) -> None:
+        self.path = path
+        self.profile = profile
+        self.max_idle = max_idle
+        self._lock = threading.RLock()
+        self._idle: List[sqlite3.Connection] = []
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._initialized = False
+        self._generation = 0
+        self._writes = 0
+        self.gc_stats = PurgeStats()
+
+    def set_profile(self, profile: KVProfile) -> None:
+        """
+        Switch the pool to another profile.
+
+        Pragmas and attached shards are set up when a connection is opened,
+        so idle connections are closed and connections currently checked out
+        are closed when released instead of going back to the idle list. The
+        new profile's schema (and any new shard) is created on the next
+        connection.
+
+        Args:
+            profile (KVProfile): The new connection settings.
+        """
+        with self._lock:
+            if profile == self.profile:
+                return
+            self.profile = profile
+            self._generation += 1
+            self._initialized = False
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def shard_path(self, shard: KVShard) -> str:
+        """
+        Get the file a shard is stored in: "kv.<name>.db" next to kv.db.
+
+        Args:
+            shard (KVShard): One of the profile's shards.
+
+        Returns:
+            str: Path to the shard's SQLite file.
+        """
+        root, extension = os.path.splitext(self.path)
+        return f"{root}.{shard.name}{extension}"
+
+    @property
+    def schemas(self) -> List[str]:
+        """
+        Names of every attached database holding KV rows, "main" first.
+        """
+        return ["main", *[shard.name for shard in self.profile.shards]]
+
+    def route(self, key: str) -> str:
+        """
+        Get the schema a key is stored in.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            str: The name of the shard with the longest prefix matching key,
+            or "main" if none does.
+        """
+        schema = "main"
+        matched = 0
+        for shard in self.profile.shards:
+            for prefix in shard.prefixes:
+                if len(prefix) > matched and key.startswith(prefix):
+                    schema = shard.name
+                    matched = len(prefix)
+        return schema
+
+    def prefix_schemas(self, prefix: str) -> List[str]:
+        """
+        Get the schemas that may hold keys starting with prefix.
+
+        That is the schema the prefix itself routes to, plus every shard
+        owning a longer prefix that starts with it.
+
+        Args:
+            prefix (str): The key prefix.
+
+        Returns:
+            List[str]: Schema names, the one the prefix routes to first.
+        """
+        owner = self.route(prefix)
+        schemas = [owner]
+        for shard in self.profile.shards:
+            if shard.name != owner and any(p.startswith(prefix) for p in shard.prefixes):
+                schemas.append(shard.name)
+        return schemas
+
+    def _create_schema(self, conn: sqlite3.Connection, schema: str, journal_mode: str) -> None:
+        if self.profile.incremental_vacuum and conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+            conn.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+            conn.execute(f"VACUUM {schema}")
+        conn.execute(f"PRAGMA {schema}.journal_mode = {journal_mode}")
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {schema}.kv (
+                key TEXT PRIMARY KEY,
+                value TEXT default '',
+                ttl integer DEFAULT NULL
+            )
+        """
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.kv_ttl ON kv (ttl) WHERE ttl IS NOT NULL")
+
+    def _connect(self) -> sqlite3.Connection:
+        profile = self.profile
+        conn = sqlite3.connect(self.path, timeout=profile.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(profile.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {int(profile.wal_autocheckpoint)}")
+        for shard in profile.shards:
+            conn.execute(f"ATTACH DATABASE ? AS {shard.name}", (self.shard_path(shard),))
+            conn.execute(f"PRAGMA {shard.name}.synchronous = {shard.synchronous or profile.synchronous}")
+            conn.execute(f"PRAGMA {shard.name}.wal_autocheckpoint = {int(profile.wal_autocheckpoint)}")
+        with self._lock:
+            if not self._initialized:
+                self._create_schema(conn, "main", profile.journal_mode)
+                # Change feed: every write gets a revision from the
+                # AUTOINCREMENT key, which never reuses values even after old
+                # entries are pruned. Rewriting an identical row is not a change.
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS kv_changes (
+                        rev INTEGER PRIMARY KEY AUTOINCREMENT,
+                        key TEXT NOT NULL,
+                        deleted INTEGER NOT NULL DEFAULT 0
+                    )
+                """
+                )
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS kv_changes_insert AFTER INSERT ON kv
+                    BEGIN
+                        INSERT INTO kv_changes (key) VALUES (new.key);
+                    END
+                """
+                )
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS kv_changes_update AFTER UPDATE ON kv
+                    WHEN old.key IS NOT new.key OR old.value IS NOT new.value OR old.ttl IS NOT new.ttl
+                    BEGIN
+                        INSERT INTO kv_changes (key, deleted) SELECT old.key, 1 WHERE old.key IS NOT new.key;
+                        INSERT INTO kv_changes (key) VALUES (new.key);
+                    END
+                """
+                )
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS kv_changes_delete AFTER DELETE ON kv
+                    BEGIN
+                        INSERT INTO kv_changes (key, deleted) VALUES (old.key, 1);
+                    END
+                """
+                )
+                conn.commit()
+                for shard in profile.shards:
+                    self._create_schema(conn, shard.name, shard.journal_mode or profile.journal_mode)
+                    conn.commit()
+                    # Move rows written before the namespace had its own file.
+                    for prefix in shard.prefixes:
+                        condition, params = prefix_condition(prefix)
+                        conn.execute(
+                            f"""
+                            INSERT OR REPLACE INTO {shard.name}.kv
+                            SELECT key, value, ttl FROM main.kv WHERE {condition}
+                        """,
+                            params,
+                        )
+                        conn.execute(f"DELETE FROM main.kv WHERE {condition}", params)
+                    conn.commit()
+                if profile.sweep_on_startup:
+                    self.sweep(conn, max_batches=profile.sweep_max_batches)
+                self._initialized = True
+        return conn
+
+    def sweep(
+        self,
+        conn: sqlite3.Connection,
+        batch_size: Optional[int] = None,
+        max_batches: Optional[int] = None,
+    ) -> PurgeStats:
+        """
+        Purge expired rows using the pool's profile and record the result.
+
+        kv.db and every shard are swept in turn; max_batches applies to each
+        of them.
+
+        Args:
+            conn (sqlite3.Connection): A connection checked out of this pool.
+            batch_size (Optional[int]): Rows per batch. Defaults to the
+                profile's sweep_batch_size.
+            max_batches (Optional[int]): Maximum number of batches.
+                Defaults to None (no limit).
+
+        Returns:
+            PurgeStats: Rows and bytes reclaimed by this sweep.
+        """
+        profile = self.profile
+        stats = PurgeStats(sweeps=1)
+        for schema in self.schemas:
+            schema_stats = purge_expired(
+                conn,
+                batch_size or profile.sweep_batch_size,
+                max_batches,
+                profile.incremental_vacuum,
+                profile.change_retention if schema == "main" else None,
+                schema,
+            )
+            schema_stats.sweeps = 0
+            stats.add(schema_stats)
+        with self._lock:
+            self.gc_stats.add(stats)
+        return stats
+
+    def get_gc_stats(self) -> PurgeStats:
+        """
+        Get a copy of the sweep totals recorded by this pool.
+
+        Returns:
+            PurgeStats: Aggregated stats of every sweep run in this process.
+        """
+        with self._lock:
+            return replace(self.gc_stats)
+
+    def record_writes(self, conn: sqlite3.Connection, count: int = 1) -> None:
+        """
+        Count committed writes and run an automatic sweep when due.
+
+        Called by KV after each committed write. Every
+        profile.sweep_every_writes writes, expired rows are purged on the
+        calling connection (at most profile.sweep_max_batches batches).
+
+        Args:
+            conn (sqlite3.Connection): The connection that performed the writes.
+            count (int): Number of rows written. Defaults to 1.
+        """
+        every = self.profile.sweep_every_writes
+        if not every:
+            return
+        with self._lock:
+            self._writes += count
+            due = self._writes >= every
+            if due:
+                self._writes = 0
+        if due:
+            self.sweep(conn, max_batches=self.profile.sweep_max_batches)
+
+    def acquire(self) -> _PooledConnection:
+        """
+        Check out a connection for the calling thread.
+
+        Returns the handle already held by this thread if there is one,
+        otherwise reuses an idle connection or opens a new one.
+
+        Returns:
+            _PooledConnection: The handle wrapping the SQLite connection.
+        """
+        if self._pid != os.getpid():
+            # SQLite connections must not be used across fork(); drop the ones
+            # inherited from the parent without touching them.
+            with self._lock:
+                self._idle = []
+                self._local = threading.local()
+                self._pid = os.getpid()
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                generation = self._generation
+            handle = _PooledConnection(conn or self._connect(), generation)
+            self._local.handle = handle
+        handle.depth += 1
+        return handle
+
+    def release(self, handle: _PooledConnection) -> None:
+        """
+        Return a connection previously obtained with acquire().
+
+        Pending changes are committed when the outermost holder on the thread
+        releases it, after which the connection goes back to the idle list.
+
+        Args:
+            handle (_PooledConnection): The handle returned by acquire().
+        """
+        handle.depth -= 1
+        if handle.depth > 0:
+            return
+        self._local.handle = None
+        handle.conn.commit()
+        with self._lock:
+            if handle.generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append(handle.conn)
+                return
+        handle.conn.close()
+
+    def close_all(self) -> None:
+        """
+        Close every idle connection in the pool.
+
+        Connections currently checked out are closed when released once the
+        idle list is full; this is mostly useful in tests and at shutdown.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_POOLS: Dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(path: str, profile: Optional[KVProfile] = None) -> ConnectionPool:
+    """
+    Get the process-wide ConnectionPool for a database file, creating it if needed.
+
+    Args:
+        path (str): Path to the SQLite database file.
+        profile (Optional[KVProfile]): Connection settings for the pool. When
+            given for an existing pool with other settings, its connections
+            are replaced (see ConnectionPool.set_profile()). Defaults to None
+            (DEFAULT_PROFILE for new pools, unchanged for existing ones).
+
+    Returns:
+        ConnectionPool: The pool shared by every KV instance using this file.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(path)
+        if pool is None:
+            pool = ConnectionPool(path, profile or DEFAULT_PROFILE)
+            _POOLS[path] = pool
+    if profile is not None:
+        pool.set_profile(profile)
+    return pool
+
+
+def _upsert_sql(schema: str) -> str:
+    # Unlike INSERT OR REPLACE (a delete plus an insert), an upsert leaves a
+    # row holding the same value and ttl untouched, so rewriting it doesn't
+    # show up in the change feed.
+    return f"""
+        INSERT INTO {schema}.kv (key, value, ttl) VALUES (?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value, ttl = excluded.ttl
+        WHERE kv.value IS NOT excluded.value OR kv.ttl IS NOT excluded.ttl
+    """
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Compute the smallest string greater than every string starting with prefix.
+
+    Keys are compared with SQLite's BINARY collation, which orders UTF-8 text
+    by code point, so "every key starting with prefix" is exactly the range
+    prefix <= key < prefix_upper_bound(prefix). Unlike LIKE, that range can be
+    answered with the primary key index.
+
+    Args:
+        prefix (str): The key prefix.
+
+    Returns:
+        Optional[str]: The exclusive upper bound, or None if the range is
+        unbounded (empty prefix, or a prefix made only of the highest code point).
+
+    Example:
+        >>> prefix_upper_bound("server.")
+        'server/'
+        >>> prefix_upper_bound("") is None
+        True
+    """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            next_char = last + 1
+            if 0xD800 <= next_char <= 0xDFFF:
+                next_char = 0xE000
+            return prefix[:-1] + chr(next_char)
+        prefix = prefix[:-1]
+    return None
+
+
+def prefix_condition(prefix: str) -> Tuple[str, List[str]]:
+    """
+    Build a SQL condition matching keys that start with prefix as a range scan.
+
+    Args:
+        prefix (str): The key prefix.
+
+    Returns:
+        Tuple[str, List[str]]: The SQL condition on the key column and its
+        bound parameters.
+
+    Example:
+        >>> prefix_condition("user:")
+        ('key >= ? AND key < ?', ['user:', 'user;'])
+    """
+    upper = prefix_upper_bound(prefix)
+    if upper is None:
+        return "key >= ?", [prefix]
+    return "key >= ? AND key < ?", [prefix, upper]
+
+
 class KV:
     """
     A persistent key-value storage system with TTL (time-to-live) support.
@@ -30,7 +780,8 @@ class KV:
     The KV class provides a simple yet powerful interface for storing and retrieving
     data persistently using SQLite as the backend. It supports automatic expiration
     of entries through TTL, batch operations for performance, and prefix-based queries.
-    All values are automatically serialized to JSON for storage.
+    Values are automatically serialized with the profile's codec (a compact binary
+    encoding by default; older JSON rows stay readable).
 
     Features:
         - Persistent storage using SQLite
@@ -38,7 +789,7 @@ class KV:
         - Batch operations for improved performance
         - Prefix-based queries and deletions
         - Context manager support for automatic cleanup
-        - JSON serialization for complex data types
+        - Pluggable value codecs for complex data types
 
     Example:
         >>> from src.ut_components.kv import KV
@@ -62,7 +813,7 @@ class KV:
         ...     kv.commit_cached()  # Single transaction for all items
     """
 
-    def __init__(self) -> None:
+    def __init__(self, profile: Optional[KVProfile] = None) -> None:
         """
         Initialize the KV storage system and create the database if needed.
 
@@ -70,7 +821,21 @@ class KV:
         (as determined by get_config_path()) and sets up the necessary
         table structure for key-value storage with TTL support.
 
-        The database file is created at: {config_path}/kv.db
+        Connections come from a process-wide ConnectionPool, so creating a
+        KV is cheap: the database is opened and the schema created only once
+        per process, and nested KV instances on the same thread share the
+        same connection.
+
+        Args:
+            profile (Optional[KVProfile]): Connection settings (journal mode,
+                busy timeout, synchronous level, checkpointing) for the
+                database. Defaults to None, which keeps the settings already in
+                use by this process or DEFAULT_PROFILE on first use.
+
+        The database file is created at: {config_path}/kv.db, with the
+        profile's shards (memoize.* and sync.* by default) in
+        {config_path}/kv.<shard>.db. Which file holds a key is transparent to
+        every KV method.
 
         Example:
             >>> from src.ut_components.kv import KV
@@ -84,44 +849,44 @@ class KV:
         """
         config_folder = get_config_path()
         os.makedirs(config_folder, exist_ok=True)
-        self.conn = sqlite3.connect(os.path.join(config_folder, "kv.db"))
+        self.pool = get_pool(os.path.join(config_folder, "kv.db"), profile)
+        self.handle = self.pool.acquire()
+        self.conn = self.handle.conn
         self.cursor = self.conn.cursor()
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS kv (
-                key TEXT PRIMARY KEY,
-                value TEXT default '',
-                ttl integer DEFAULT NULL
-            )
-        """
-        )
-        self.conn.commit()
-        self.cache_values = []
+        self.cache_values: List[Tuple[str, str, Optional[int]]] = []
         self.cache_row_count = 0
+        self.cache_flushed_rows = 0
 
-    def _encode_value(self, value: Any) -> str:
-        return json.dumps({"value": value})
+    def _encode_value(self, value: Any) -> Union[str, bytes]:
+        return self.pool.profile.codec.encode(value)
 
-    def _decode_value(self, value: str) -> Any:
-        return json.loads(value).get("value", None)
+    def _decode_value(self, value: Union[str, bytes]) -> Any:
+        return decode_value(value)
 
     def put(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> None:
         """
         Store a key-value pair in the database with optional TTL.
 
         Inserts or updates a key-value pair in the storage. The value is
-        automatically serialized to JSON before storage, allowing you to
-        store complex Python objects (dicts, lists, etc.).
+        encoded with the profile's codec (BinaryCodec by default) before
+        storage, allowing you to store complex Python objects (dicts, lists,
+        etc.).
 
         Args:
             key (str): The unique identifier for the value. If the key already
                 exists, its value will be replaced.
-            value (Any): The value to store. Can be any JSON-serializable Python
-                object (str, int, float, bool, dict, list, None).
+            value (Any): The value to store. Can be any value the profile's
+                codec supports (str, int, float, bool, bytes, dict, list,
+                tuple, None with BinaryCodec). Dict keys must be str, int,
+                float, bool or None; with BinaryCodec non-str keys are read
+                back with their own type instead of as strings.
             ttl_seconds (Optional[int]): Time-to-live in seconds. If provided,
                 the entry will automatically expire after this duration.
                 Defaults to None (no expiration).
 
+        Raises:
+            TypeError: If the value (or a dict key) can't be encoded.
+
         Example:
             >>> kv = KV()
             >>>
@@ -140,18 +905,11 @@ class KV:
             >>>
             >>> kv.close()
         """
-        if ttl_seconds:
-            ttl = int((datetime.now() + timedelta(seconds=ttl_seconds)).timestamp())
-        else:
-            ttl = None
+        ttl = _expires_at(ttl_seconds)
 
-        self.cursor.execute(
-            """
-            INSERT OR REPLACE INTO kv (key, value, ttl) VALUES (?, ?, ?)
-        """,
-            (key, self._encode_value(value), ttl),
-        )
-        self.conn.commit()
+        schema = self._write_schema(key)
+        self.cursor.execute(_upsert_sql(schema), (key, self._encode_value(value), ttl))
+        self._commit()
 
     def get(
         self,
@@ -176,7 +934,8 @@ class KV:
 
         Returns:
             Optional[Any]: The stored value if found and not expired, otherwise
-            the default value. The value is automatically deserialized from JSON.
+            the default value. The value is decoded with the codec that wrote
+            it (see codec.decode_value()).
 
         Example:
             >>> kv = KV()
@@ -203,11 +962,11 @@ class KV:
             >>>
             >>> kv.close()
         """
-        now_seconds = int(datetime.now().timestamp())
+        now_seconds = _now()
 
         self.cursor.execute(
-            """
-            SELECT value FROM kv WHERE key = ? AND (ttl IS NULL OR ttl > ?)
+            f"""
+            SELECT value FROM {self.pool.route(key)}.kv WHERE key = ? AND (ttl IS NULL OR ttl > ?)
         """,
             (key, now_seconds),
         )
@@ -224,22 +983,67 @@ class KV:
 
         return self._decode_value(result)
 
-    def get_partial(self, beginning: str) -> List[Tuple[str, Any]]:
+    def get_with_expiry(self, key: str, default: Optional[Any] = None) -> Tuple[Any, Optional[int]]:
+        """
+        Retrieve a value together with the time it expires.
+
+        Same lookup as get(), for callers that keep their own copy of the
+        value and must drop it when the stored one expires.
+
+        Args:
+            key (str): The key to look up in the storage.
+            default (Optional[Any]): The value to return if the key is not found
+                or has expired. Defaults to None.
+
+        Returns:
+            Tuple[Any, Optional[int]]: (value, expires_at), where expires_at is
+            a Unix timestamp in seconds, or None if the entry never expires or
+            was not found.
+
+        Example:
+            >>> with KV() as kv:
+            ...     kv.put("session:token", "abc123xyz", ttl_seconds=3600)
+            ...     token, expires_at = kv.get_with_expiry("session:token")
+        """
+        self.cursor.execute(
+            f"""
+            SELECT value, ttl FROM {self.pool.route(key)}.kv WHERE key = ? AND (ttl IS NULL OR ttl > ?)
+        """,
+            (key, _now()),
+        )
+        row = self.cursor.fetchone()
+        if not row or not row[0]:
+            return default, None
+        return self._decode_value(row[0]), row[1]
+
+    def get_partial(
+        self,
+        beginning: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[Tuple[str, Any]]:
         """
         Retrieve all key-value pairs where keys start with a given prefix.
 
         Performs a prefix search on keys and returns all matching entries
-        that haven't expired. Results are sorted by value (in JSON string form).
-        This is useful for implementing features like autocomplete, finding
-        all items in a category, or retrieving related configuration options.
+        that haven't expired, sorted by key. The prefix is turned into a key
+        range (see prefix_condition()) so the lookup is an index range scan
+        instead of a full table scan. This is useful for implementing features
+        like autocomplete, finding all items in a category, or retrieving
+        related configuration options.
 
         Args:
             beginning (str): The prefix to search for. All keys starting with
                 this string will be returned.
+            limit (Optional[int]): Maximum number of entries to return.
+                Defaults to None (no limit).
+            offset (int): Number of matching entries to skip, in key order.
+                Defaults to 0.
 
         Returns:
             List[Tuple[str, Any]]: A list of tuples where each tuple contains
-            (key, value). Values are automatically deserialized from JSON.
+            (key, value). Values are decoded with the codec that wrote them
+            (see codec.decode_value()).
             Returns empty list if no matches found.
 
         Example:
@@ -264,19 +1068,308 @@ class KV:
             >>> all_users = kv.get_partial("user:")
             >>> print(len(all_users))  # 4 (all user fields)
             >>>
+            >>> # Paginate through keys
+            >>> first_page = kv.get_partial("user:", limit=2)
+            >>> second_page = kv.get_partial("user:", limit=2, offset=2)
+            >>>
             >>> kv.close()
         """
-        now_seconds = int(datetime.now().timestamp())
+        sql, params = self._select_prefix("key, value", beginning)
+        sql = f"SELECT key, value FROM ({sql}) ORDER BY key"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset])
 
-        self.cursor.execute(
-            """
-            SELECT key, value FROM kv WHERE key LIKE ? || '%' AND (ttl IS NULL OR ttl > ?) ORDER BY value
-        """,
-            (beginning, now_seconds),
-        )
+        self.cursor.execute(sql, params)
         result = self.cursor.fetchall()
         return [(x[0], self._decode_value(x[1])) for x in result]
 
+    def _select_prefix(self, columns: str, prefix: str) -> Tuple[str, List[Any]]:
+        # Live rows under prefix from every schema that may hold them, as one
+        # UNION ALL query (a single SELECT in the common one-schema case).
+        condition, params = prefix_condition(prefix)
+        now_seconds = _now()
+        selects = []
+        select_params: List[Any] = []
+        for schema in self.pool.prefix_schemas(prefix):
+            selects.append(f"SELECT {columns} FROM {schema}.kv WHERE {condition} AND (ttl IS NULL OR ttl > ?)")
+            select_params.extend([*params, now_seconds])
+        return " UNION ALL ".join(selects), select_params
+
+    def get_many(self, keys: Iterable[str], default: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Retrieve several keys at once.
+
+        Fetches all the given keys with a single query (split in chunks of
+        MAX_VARIABLES keys if needed) instead of one round trip per key.
+        Missing or expired keys are mapped to the default value.
+
+        Args:
+            keys (Iterable[str]): The keys to look up.
+            default (Optional[Any]): The value used for keys that are not found
+                or have expired. Defaults to None.
+
+        Returns:
+            Dict[str, Any]: A dictionary with one entry per requested key.
+
+        Example:
+            >>> kv = KV()
+            >>> kv.put("user:123:name", "Alice")
+            >>> kv.put("user:123:email", "alice@example.com")
+            >>>
+            >>> kv.get_many(["user:123:name", "user:123:email", "user:123:age"])
+            >>> # {"user:123:name": "Alice", "user:123:email": "alice@example.com", "user:123:age": None}
+            >>>
+            >>> kv.close()
+        """
+        result = {key: default for key in keys}
+        by_schema: Dict[str, List[str]] = {}
+        for key in result:
+            by_schema.setdefault(self.pool.route(key), []).append(key)
+        now_seconds = _now()
+        chunk_size = MAX_VARIABLES - 1
+
+        for schema, schema_keys in by_schema.items():
+            for start in range(0, len(schema_keys), chunk_size):
+                chunk = schema_keys[start : start + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                self.cursor.execute(
+                    f"SELECT key, value FROM {schema}.kv WHERE key IN ({placeholders}) AND (ttl IS NULL OR ttl > ?)",
+                    [*chunk, now_seconds],
+                )
+                for key, value in self.cursor.fetchall():
+                    if value:
+                        result[key] = self._decode_value(value)
+        return result
+
+    def get_tree(self, prefix: str) -> Dict[str, Any]:
+        """
+        Retrieve every key under a prefix as a dictionary.
+
+        This is get_partial() returning a dictionary, which is convenient to
+        load a whole record (e.g. all fields of a server) with one query and
+        then look fields up by key.
+
+        Args:
+            prefix (str): The prefix to search for.
+
+        Returns:
+            Dict[str, Any]: Mapping of full key to decoded value, in key order.
+
+        Example:
+            >>> kv = KV()
+            >>> kv.put("user:123:name", "Alice")
+            >>> kv.put("user:123:age", 30)
+            >>>
+            >>> user = kv.get_tree("user:123:")
+            >>> print(user["user:123:name"])  # "Alice"
+            >>>
+            >>> kv.close()
+        """
+        return dict(self.get_partial(prefix))
+
+    def usage(self, prefix: str) -> Tuple[int, int]:
+        """
+        Count the live entries under a prefix and the size of their values.
+
+        Values are not decoded, so this is cheap even for large prefixes.
+
+        Args:
+            prefix (str): The prefix to measure.
+
+        Returns:
+            Tuple[int, int]: (entries, bytes), bytes being the total length
+            of the stored values.
+
+        Example:
+            >>> kv = KV()
+            >>> entries, size = kv.usage("memoize.")
+            >>> print(f"{entries} cached results, {size} bytes")
+            >>>
+            >>> kv.close()
+        """
+        sql, params = self._select_prefix("length(value) AS size", prefix)
+        self.cursor.execute(f"SELECT count(*), coalesce(sum(size), 0) FROM ({sql})", params)
+        entries, size = self.cursor.fetchone()
+        return entries, size
+
+    def children(self, prefix: str, depth: int = 1) -> List[Tuple[str, int]]:
+        """
+        List the distinct key segments below a prefix, with their key counts.
+
+        Keys are treated as dot-separated paths. For every key under
+        "prefix." this takes the next depth segments and returns each distinct
+        one with the number of keys below it. Children are found by seeking
+        the primary key index and counted with count(*), so only one row per
+        child reaches Python no matter how many keys each child has. Keys with
+        fewer than depth segments below the prefix are returned whole.
+
+        Args:
+            prefix (str): The parent path, with or without a trailing dot.
+                An empty prefix lists top-level segments.
+            depth (int): How many segments to return per child. Defaults to 1.
+
+        Returns:
+            List[Tuple[str, int]]: (segment, key_count) tuples sorted by segment.
+
+        Example:
+            >>> kv = KV()
+            >>> kv.put("server.a.name", "Home")
+            >>> kv.put("server.a.addressbook.x.name", "Contacts")
+            >>> kv.put("server.a.addressbook.y.name", "Work")
+            >>> kv.put("server.b.name", "Office")
+            >>>
+            >>> kv.children("server")
+            >>> # [("a", 3), ("b", 1)]
+            >>> kv.children("server.a.addressbook")
+            >>> # [("x", 1), ("y", 1)]
+            >>> kv.children("server", depth=2)
+            >>> # [("a.addressbook", 2), ("a.name", 1), ("b.name", 1)]
+            >>>
+            >>> kv.close()
+        """
+        if prefix and not prefix.endswith("."):
+            prefix = f"{prefix}."
+        upper = prefix_upper_bound(prefix)
+        upper_sql = "" if upper is None else " AND key < ?"
+        upper_params = [] if upper is None else [upper]
+        now = _now()
+
+        # Skip-scan: seek to the first live key after the previous child and
+        # count the new child's keys in the index, so the cost is a couple of
+        # queries per child instead of one row per key. Siblings like "a" and
+        # "a-b" interleave ("a-b." sorts before "a."), so a seek that lands in
+        # a child already counted jumps past that child's range and retries.
+        results: Dict[str, int] = {}
+        for schema in self.pool.prefix_schemas(prefix):
+            counted: Dict[str, int] = {}
+            lower, lower_op = prefix, ">="
+            while True:
+                self.cursor.execute(
+                    f"""
+                    SELECT key FROM {schema}.kv WHERE key {lower_op} ?{upper_sql} AND (ttl IS NULL OR ttl > ?)
+                    ORDER BY key LIMIT 1
+                    """,
+                    [lower, *upper_params, now],
+                )
+                row = self.cursor.fetchone()
+                if row is None:
+                    break
+                key = row[0]
+                parts = key[len(prefix) :].split(".", depth)
+                segment = ".".join(parts[:depth])
+                child = f"{prefix}{segment}"
+
+                if segment in counted:
+                    lower, lower_op = prefix_upper_bound(f"{child}."), ">="
+                    continue
+
+                if len(parts) < depth:
+                    counted[segment] = 1
+                else:
+                    condition, params = prefix_condition(f"{child}.")
+                    self.cursor.execute(
+                        f"SELECT count(*) FROM {schema}.kv WHERE (key = ? OR {condition}) AND (ttl IS NULL OR ttl > ?)",
+                        [child, *params, now],
+                    )
+                    counted[segment] = self.cursor.fetchone()[0]
+                lower, lower_op = child, ">"
+
+            for segment, count in counted.items():
+                results[segment] = results.get(segment, 0) + count
+
+        return sorted(results.items())
+
+    def revision(self) -> int:
+        """
+        Get the current revision of the change feed.
+
+        Every committed insert, update or delete of a key increments the
+        revision, across all processes using the database.
+
+        Returns:
+            int: The latest revision, or 0 if nothing was written yet.
+
+        Example:
+            >>> with KV() as kv:
+            ...     start = kv.revision()
+            ...     kv.put("key", "value")
+            ...     kv.revision() > start
+            True
+        """
+        self.cursor.execute("SELECT seq FROM main.sqlite_sequence WHERE name = 'kv_changes'")
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, revision: int, prefix: str = "", limit: Optional[int] = None) -> ChangeSet:
+        """
+        Get the keys written or deleted after a revision.
+
+        Lets a reader keep a view in sync by re-reading only the keys that
+        changed instead of everything under a prefix. Only the latest change
+        of each key is returned. Changes come from triggers on the kv table,
+        so writes from other processes (e.g. the background sync) show up
+        too. Keys that expire are reported once a sweep purges them.
+
+        Only keys stored in kv.db are tracked. Keys routed to a shard (see
+        KVShard; "memoize." and "sync." with the default profile) never show
+        up, even under a prefix that includes them, such as "". Keys a view
+        polls must therefore not be routed to a shard.
+
+        Args:
+            revision (int): The revision returned by the previous call (or by
+                revision()). Pass 0 to get every retained change.
+            prefix (str): Only report keys starting with this prefix.
+                Defaults to "" (all keys).
+            limit (Optional[int]): Maximum number of changes to return. The
+                returned revision then points at the last change included, so
+                the next call continues from there. Defaults to None (no limit).
+
+        Returns:
+            ChangeSet: The changes, the revision to resume from and whether
+            the history needed to answer was already pruned.
+
+        Raises:
+            ValueError: If every key starting with prefix is stored in a
+                shard, so no change could ever be reported.
+
+        Example:
+            >>> kv = KV()
+            >>> revision = kv.revision()
+            >>> kv.put("server.abc.name", "Home")
+            >>>
+            >>> change_set = kv.changes_since(revision, "server.")
+            >>> [change.key for change in change_set.changes]
+            >>> # ["server.abc.name"]
+            >>> revision = change_set.revision
+            >>>
+            >>> kv.close()
+        """
+        schema = self.pool.route(prefix)
+        if schema != "main":
+            raise ValueError(f"keys starting with {prefix!r} are stored in {schema}, which has no change feed")
+        current = self.revision()
+        self.cursor.execute("SELECT min(rev) FROM main.kv_changes")
+        oldest = self.cursor.fetchone()[0]
+        reset = revision > current or (revision < current and (oldest is None or revision < oldest - 1))
+
+        condition, params = prefix_condition(prefix)
+        sql = f"""
+            SELECT max(rev), key, deleted FROM main.kv_changes
+            WHERE rev > ? AND rev <= ? AND {condition}
+            GROUP BY key ORDER BY max(rev)
+        """
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        # With max(), SQLite takes the bare "deleted" column from the row
+        # holding the maximum, i.e. the latest change of the key.
+        self.cursor.execute(sql, [revision, current, *params])
+        changes = [Change(revision=rev, key=key, deleted=bool(deleted)) for rev, key, deleted in self.cursor.fetchall()]
+
+        if limit is not None and len(changes) == limit:
+            current = changes[-1].revision
+        return ChangeSet(revision=current, changes=changes, reset=reset)
+
     def delete(self, key: str) -> None:
         """
         Delete a specific key-value pair from the database.
@@ -302,20 +1395,21 @@ class KV:
             >>> kv.close()
         """
         self.cursor.execute(
-            """
-            DELETE FROM kv WHERE key = ?
+            f"""
+            DELETE FROM {self._write_schema(key)}.kv WHERE key = ?
         """,
             (key,),
         )
-        self.conn.commit()
+        self._commit()
 
     def delete_partial(self, beginning: str):
         """
         Delete all key-value pairs where keys start with a given prefix.
 
         Performs a bulk deletion of all entries whose keys match the specified
-        prefix. This is useful for cleaning up related data, removing all items
-        in a category, or clearing cache entries with a common prefix.
+        prefix, using the same index range scan as get_partial(). This is
+        useful for cleaning up related data, removing all items in a category,
+        or clearing cache entries with a common prefix.
 
         Args:
             beginning (str): The prefix to match. All keys starting with
@@ -344,21 +1438,467 @@ class KV:
             >>>
             >>> kv.close()
         """
-        self.cursor.execute(
-            """
-            DELETE FROM kv WHERE key like ? || '%'
+        condition, params = prefix_condition(beginning)
+        deleted = 0
+        schemas = self.pool.prefix_schemas(beginning)
+        for schema in schemas:
+            self._check_transaction_schema(schema)
+        for schema in schemas:
+            self.cursor.execute(f"DELETE FROM {schema}.kv WHERE {condition}", params)
+            deleted += self.cursor.rowcount
+        self._commit(deleted)
+
+    def _commit(self, writes: int = 1) -> None:
+        if self.handle.tx_depth:
+            self.handle.pending_writes += writes
+            return
+        self.conn.commit()
+        self.pool.record_writes(self.conn, writes)
+
+    def _ensure_no_transaction(self, operation: str) -> None:
+        if self.handle.tx_depth:
+            raise sqlite3.OperationalError(f"cannot run {operation} inside a KV transaction")
+
+    def _check_transaction_schema(self, schema: str) -> None:
+        # WAL commits every attached file on its own, so a transaction
+        # spanning two shards could be half committed after a crash.
+        if self.handle.tx_depth and schema != self.handle.tx_schema:
+            raise sqlite3.OperationalError(
+                f"cannot write to {schema} inside a KV transaction on {self.handle.tx_schema}"
+            )
+
+    def _write_schema(self, key: str) -> str:
+        schema = self.pool.route(key)
+        self._check_transaction_schema(schema)
+        return schema
+
+    @contextmanager
+    def transaction(self, prefix: Optional[str] = None) -> Iterator["KV"]:
+        """
+        Group several writes into one atomic commit.
+
+        Inside the block, put(), delete(), delete_partial() and
+        commit_cached() don't commit on their own: everything is committed
+        (with a single fsync) when the outermost block exits, or rolled back
+        if it raises. Nested blocks use SQLite savepoints, so an exception
+        caught inside an inner block only undoes that block's writes.
+
+        A transaction writes to a single file: the one prefix routes to (see
+        KVShard). SQLite only makes a commit atomic within one WAL file, so
+        writing a key stored in another shard inside the block raises
+        sqlite3.OperationalError. Reads of any key are allowed. Code that may
+        run inside someone else's transaction (e.g. memoize) checks
+        can_write() and defers its other writes with on_commit().
+
+        The outermost block takes the write lock of that file up front, so it
+        can never fail half way through with "database is locked" when
+        upgrading from a read, while writers of other shards carry on.
+
+        Args:
+            prefix (Optional[str]): A prefix of the keys written in the block,
+                e.g. "memoize." or "server.". Defaults to None: kv.db for
+                the outermost block, the enclosing block's file when nested.
+
+        Yields:
+            KV: This KV instance.
+
+        Raises:
+            sqlite3.OperationalError: If the block writes to another shard
+                than the one prefix routes to.
+            Exception: Any exception raised inside the block, after rolling
+                back its writes.
+
+        Example:
+            >>> with KV() as kv:
+            ...     with kv.transaction():
+            ...         kv.delete("user:123:session")
+            ...         kv.put("user:123:status", "logged_out")
+            ...         try:
+            ...             with kv.transaction():
+            ...                 kv.put("user:123:audit", "logout")
+            ...                 raise ValueError("audit failed")
+            ...         except ValueError:
+            ...             pass  # only the audit write is undone
+        """
+        handle = self.handle
+        savepoint = f"kv_savepoint_{handle.tx_depth}"
+        callbacks = len(handle.on_commit)
+        if handle.tx_depth == 0:
+            if self.conn.in_transaction:
+                self.conn.commit()
+            schema = self.pool.route(prefix or "")
+            # BEGIN IMMEDIATE would lock every attached file; a write that
+            # matches no row takes the lock of this one only.
+            self.cursor.execute("BEGIN")
+            try:
+                self.cursor.execute(f"DELETE FROM {schema}.kv WHERE 0")
+            except BaseException:
+                self.conn.rollback()
+                raise
+            handle.tx_schema = schema
+        else:
+            if prefix is not None:
+                self._check_transaction_schema(self.pool.route(prefix))
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+        handle.tx_depth += 1
+
+        try:
+            yield self
+        except BaseException:
+            handle.tx_depth -= 1
+            # Callbacks registered in the rolled back block are dropped.
+            del handle.on_commit[callbacks:]
+            if handle.tx_depth == 0:
+                self.conn.rollback()
+                handle.pending_writes = 0
+            else:
+                self.cursor.execute(f"ROLLBACK TO {savepoint}")
+                self.cursor.execute(f"RELEASE {savepoint}")
+            raise
+
+        handle.tx_depth -= 1
+        if handle.tx_depth == 0:
+            pending, handle.on_commit = handle.on_commit, []
+            self.conn.commit()
+            writes, handle.pending_writes = handle.pending_writes, 0
+            self.pool.record_writes(self.conn, writes)
+            self._run_callbacks(pending)
+        else:
+            self.cursor.execute(f"RELEASE {savepoint}")
+
+    def can_write(self, prefix: str) -> bool:
+        """
+        Tell whether keys starting with prefix can be written right now.
+
+        Always True outside a transaction. Inside one, only keys stored in
+        the transaction's shard can be written (see transaction()).
+
+        Args:
+            prefix (str): A key or key prefix, e.g. "memoize.".
+
+        Returns:
+            bool: False if writing such a key would raise
+            sqlite3.OperationalError.
+        """
+        if not self.handle.tx_depth:
+            return True
+        return all(schema == self.handle.tx_schema for schema in self.pool.prefix_schemas(prefix))
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Run callback once the current transaction is committed.
+
+        This is how writes to another shard than the transaction's are made
+        without failing it: they happen right after its commit. Callbacks
+        run in the order they were registered, outside any transaction, and
+        are dropped if the block they were registered in is rolled back.
+        Outside a transaction, callback runs right away.
+
+        Args:
+            callback (Callable[[], None]): The function to call. If it
+                raises, the other callbacks still run and the first
+                exception is raised from the transaction block afterwards.
+
+        Example:
+            >>> with KV() as kv:
+            ...     with kv.transaction("server."):
+            ...         kv.put("server.1.name", "Home")
+            ...         kv.on_commit(lambda: invalidate_tag("server:1"))
+        """
+        if self.handle.tx_depth:
+            self.handle.on_commit.append(callback)
+        else:
+            self._run_callbacks([callback])
+
+    def _run_callbacks(self, callbacks: List[Callable[[], None]]) -> None:
+        error: Optional[BaseException] = None
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def _execute_atomic(self, schema: str, sql: str, params: Iterable[Any]) -> int:
+        # Run a single write statement in a transaction of its own. One
+        # statement is atomic by itself; without BEGIN IMMEDIATE it only
+        # locks the file of the shard it writes to.
+        self._check_transaction_schema(schema)
+        if self.handle.tx_depth:
+            self.cursor.execute(sql, params)
+            self.handle.pending_writes += self.cursor.rowcount
+            return self.cursor.rowcount
+
+        if self.conn.in_transaction:
+            self.conn.commit()
+        try:
+            self.cursor.execute(sql, params)
+            rowcount = self.cursor.rowcount
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.pool.record_writes(self.conn, rowcount)
+        return rowcount
+
+    def compare_and_set(
+        self,
+        key: str,
+        expected: Optional[Any],
+        value: Any,
+        ttl_seconds: Optional[int] = None,
+    ) -> bool:
+        """
+        Atomically replace a value only if it currently equals an expected value.
+
+        The check and the write are a single SQL statement, so two
+        connections (or processes) can never both succeed on the same
+        expected value.
+
+        Args:
+            key (str): The key to update.
+            expected (Optional[Any]): The value the key must currently hold.
+                None means the key must not exist (or must have expired).
+            value (Any): The new value to store.
+            ttl_seconds (Optional[int]): Time-to-live for the new value in
+                seconds. Defaults to None (no expiration).
+
+        Returns:
+            bool: True if the value was written, False if the current value
+            did not match.
+
+        Example:
+            >>> with KV() as kv:
+            ...     kv.compare_and_set("counter", None, 1)  # True, key was absent
+            ...     kv.compare_and_set("counter", 1, 2)  # True
+            ...     kv.compare_and_set("counter", 1, 3)  # False, value is 2
+        """
+        now_seconds = _now()
+        ttl = _expires_at(ttl_seconds)
+        schema = self.pool.route(key)
+        if expected is None:
+            rowcount = self._execute_atomic(
+                schema,
+                f"""
+                INSERT INTO {schema}.kv (key, value, ttl) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, ttl = excluded.ttl
+                WHERE kv.ttl IS NOT NULL AND kv.ttl <= ?
+            """,
+                (key, self._encode_value(value), ttl, now_seconds),
+            )
+        else:
+            rowcount = self._execute_atomic(
+                schema,
+                f"""
+                UPDATE {schema}.kv SET value = ?, ttl = ? WHERE key = ? AND value = ? AND (ttl IS NULL OR ttl > ?)
+            """,
+                (self._encode_value(value), ttl, key, self._encode_value(expected), now_seconds),
+            )
+        return rowcount == 1
+
+    def acquire_lease(self, key: str, owner: str, ttl_seconds: int) -> bool:
+        """
+        Try to take an exclusive, expiring lease stored under key.
+
+        The lease is granted if nobody holds it, if the previous holder's lease
+        expired, or if owner already holds it (in which case it is extended).
+        Holders must renew the lease before ttl_seconds elapse; a crashed holder
+        therefore blocks others for at most ttl_seconds. See Lease for a
+        context manager that renews and releases automatically.
+
+        Args:
+            key (str): The key storing the lease.
+            owner (str): A unique identifier of the caller.
+            ttl_seconds (int): How long the lease is valid without renewal.
+
+        Returns:
+            bool: True if owner now holds the lease.
+
+        Example:
+            >>> with KV() as kv:
+            ...     if kv.acquire_lease("sync.lease", "worker-1", ttl_seconds=60):
+            ...         try:
+            ...             do_work()
+            ...         finally:
+            ...             kv.release_lease("sync.lease", "worker-1")
+        """
+        encoded_owner = self._encode_value(owner)
+        schema = self.pool.route(key)
+        rowcount = self._execute_atomic(
+            schema,
+            f"""
+            INSERT INTO {schema}.kv (key, value, ttl) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, ttl = excluded.ttl
+            WHERE (kv.ttl IS NOT NULL AND kv.ttl <= ?) OR kv.value = excluded.value
         """,
-            (beginning,),
+            (key, encoded_owner, _expires_at(ttl_seconds), _now()),
         )
+        return rowcount == 1
+
+    def renew_lease(self, key: str, owner: str, ttl_seconds: int) -> bool:
+        """
+        Extend a lease held by owner for another ttl_seconds.
+
+        Args:
+            key (str): The key storing the lease.
+            owner (str): The identifier used to acquire the lease.
+            ttl_seconds (int): New validity period, counted from now.
+
+        Returns:
+            bool: True if the lease was renewed, False if owner no longer holds
+            it (it expired and may have been taken by someone else).
+        """
+        schema = self.pool.route(key)
+        rowcount = self._execute_atomic(
+            schema,
+            f"""
+            UPDATE {schema}.kv SET ttl = ? WHERE key = ? AND value = ? AND ttl > ?
+        """,
+            (_expires_at(ttl_seconds), key, self._encode_value(owner), _now()),
+        )
+        return rowcount == 1
+
+    def release_lease(self, key: str, owner: str) -> bool:
+        """
+        Give up a lease held by owner.
+
+        Args:
+            key (str): The key storing the lease.
+            owner (str): The identifier used to acquire the lease.
+
+        Returns:
+            bool: True if the lease was released, False if owner did not hold it.
+        """
+        schema = self.pool.route(key)
+        rowcount = self._execute_atomic(
+            schema,
+            f"""
+            DELETE FROM {schema}.kv WHERE key = ? AND value = ?
+        """,
+            (key, self._encode_value(owner)),
+        )
+        return rowcount == 1
+
+    def purge_expired(self, batch_size: Optional[int] = None, max_batches: Optional[int] = None) -> PurgeStats:
+        """
+        Delete expired entries from the database.
+
+        Expired entries are already hidden from reads, but they keep taking
+        space until deleted. This runs a sweep in bounded batches (see
+        purge_expired() at module level); sweeps also run automatically
+        according to the KVProfile sweep settings.
+
+        Args:
+            batch_size (Optional[int]): Rows deleted per transaction.
+                Defaults to the profile's sweep_batch_size.
+            max_batches (Optional[int]): Maximum number of batches to run.
+                Defaults to None (purge everything that has expired).
+
+        Returns:
+            PurgeStats: Rows and bytes reclaimed by this sweep.
+
+        Example:
+            >>> with KV() as kv:
+            ...     stats = kv.purge_expired()
+            ...     print(f"Reclaimed {stats.rows_reclaimed} rows, {stats.bytes_freed} bytes")
+        """
+        self._ensure_no_transaction("purge_expired()")
+        return self.pool.sweep(self.conn, batch_size, max_batches)
+
+    def gc_stats(self) -> PurgeStats:
+        """
+        Get the totals of every expired-row sweep run by this process.
+
+        Returns:
+            PurgeStats: Aggregated rows reclaimed, bytes freed and sweep count
+            for this database since the process started.
+
+        Example:
+            >>> with KV() as kv:
+            ...     print(kv.gc_stats().rows_reclaimed)
+        """
+        return self.pool.get_gc_stats()
+
+    def migrate_codec(self, batch_size: int = 500) -> int:
+        """
+        Re-encode rows written with another codec using the profile's codec.
+
+        Rows written by older versions are JSON text; this rewrites them in
+        the current encoding (the compact binary one by default), batch_size
+        rows per transaction. Reading never requires the migration, it only
+        saves space and decoding time, and running it again is a no-op.
+
+        Args:
+            batch_size (int): Rows rewritten per transaction. Defaults to 500.
+
+        Returns:
+            int: Number of rows migrated.
+
+        Example:
+            >>> with KV() as kv:
+            ...     migrated = kv.migrate_codec()
+            ...     print(f"Migrated {migrated} rows")
+        """
+        self._ensure_no_transaction("migrate_codec()")
+        codec = self.pool.profile.codec
+        source_type = "blob" if isinstance(codec.encode(None), str) else "text"
+        migrated = 0
+
+        for schema in self.pool.schemas:
+            last_rowid = 0
+            while True:
+                self.cursor.execute(
+                    f"""
+                    SELECT rowid, value FROM {schema}.kv WHERE rowid > ? AND typeof(value) = ? ORDER BY rowid LIMIT ?
+                """,
+                    (last_rowid, source_type, batch_size),
+                )
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                last_rowid = rows[-1][0]
+                updates = [(codec.encode(decode_value(value)), rowid) for rowid, value in rows if value]
+                self.cursor.executemany(f"UPDATE {schema}.kv SET value = ? WHERE rowid = ?", updates)
+                self.conn.commit()
+                migrated += len(updates)
+        return migrated
+
+    def checkpoint(self, mode: str = "PASSIVE") -> Tuple[int, int, int]:
+        """
+        Copy the write-ahead log back into the database file.
+
+        SQLite checkpoints automatically according to the profile's
+        wal_autocheckpoint, but long-running writers (like a background
+        sync) can call this at a quiet point to keep the -wal file small.
+        Pending changes on this connection are committed first.
+
+        Args:
+            mode (str): SQLite checkpoint mode: "PASSIVE" (never waits),
+                "FULL", "RESTART" or "TRUNCATE" (waits for readers, then
+                truncates the WAL file). Defaults to "PASSIVE".
+
+        Returns:
+            Tuple[int, int, int]: (busy, log_frames, checkpointed_frames) as
+            reported by PRAGMA wal_checkpoint. busy is 1 if the checkpoint
+            could not complete because of other connections.
+
+        Example:
+            >>> with KV() as kv:
+            ...     busy, log_frames, checkpointed = kv.checkpoint("TRUNCATE")
+        """
+        self._ensure_no_transaction("checkpoint()")
         self.conn.commit()
+        self.cursor.execute(f"PRAGMA wal_checkpoint({mode})")
+        return tuple(self.cursor.fetchone())
 
     def close(self) -> None:
         """
-        Close the database connection and commit any pending changes.
+        Commit any pending changes and return the connection to the pool.
 
-        Ensures all pending transactions are committed and properly closes
-        the SQLite database connection. This should be called when you're
-        done using the KV instance to free up resources.
+        Ensures all pending transactions are committed and hands the SQLite
+        connection back to the process-wide pool so the next KV instance can
+        reuse it. This should be called when you're done using the KV instance.
 
         Note: If using the KV class as a context manager (with statement),
         this method is called automatically.
@@ -373,8 +1913,11 @@ class KV:
             ...     kv.put("data", "value")
             >>> # close() is called automatically here
         """
-        self.conn.commit()
-        self.conn.close()
+        if self.handle is None:
+            return
+        self.cursor.close()
+        self.pool.release(self.handle)
+        self.handle = None
 
     def __enter__(self):
         return self
@@ -391,10 +1934,18 @@ class KV:
         committed together in a single transaction using commit_cached(),
         significantly improving performance for bulk insertions.
 
+        When the number of staged entries reaches the profile's
+        auto_flush_rows, they are written into the open transaction and
+        dropped from memory, so arbitrarily large batches use bounded
+        memory. Those rows share the connection's transaction, so any other
+        write made through this KV before commit_cached() (put(), delete(),
+        ...) commits them too.
+
         Args:
             key (str): The unique identifier for the value.
-            value (Any): The value to store. Can be any JSON-serializable Python
-                object (str, int, float, bool, dict, list, None).
+            value (Any): The value to store. Can be any value the profile's
+                codec supports (str, int, float, bool, bytes, dict, list,
+                tuple, None with BinaryCodec).
             ttl_seconds (Optional[int]): Time-to-live in seconds. If provided,
                 the entry will automatically expire after this duration.
                 Defaults to None (no expiration).
@@ -418,21 +1969,42 @@ class KV:
             >>>
             >>> kv.close()
         """
-        if ttl_seconds:
-            ttl = int((datetime.now() + timedelta(seconds=ttl_seconds)).timestamp())
-        else:
-            ttl = None
+        ttl = _expires_at(ttl_seconds)
 
-        self.cache_values.extend([key, self._encode_value(value), ttl])
+        self.cache_values.append((key, self._encode_value(value), ttl))
         self.cache_row_count += 1
 
+        auto_flush_rows = self.pool.profile.auto_flush_rows
+        if auto_flush_rows and self.cache_row_count >= auto_flush_rows:
+            self._flush_cached()
+
+    def _flush_cached(self) -> None:
+        chunk_size = self.pool.profile.write_chunk_size
+        by_schema: Dict[str, List[Tuple[str, Union[str, bytes], Optional[int]]]] = {}
+        for row in self.cache_values:
+            by_schema.setdefault(self.pool.route(row[0]), []).append(row)
+        for schema in by_schema:
+            self._check_transaction_schema(schema)
+        for schema, rows in by_schema.items():
+            for start in range(0, len(rows), chunk_size):
+                self.cursor.executemany(_upsert_sql(schema), rows[start : start + chunk_size])
+        self.cache_flushed_rows += self.cache_row_count
+        self.cache_values = []
+        self.cache_row_count = 0
+
     def commit_cached(self) -> None:
         """
         Commit all cached key-value pairs to the database in a single transaction.
 
         Writes all entries added via put_cached() to the database in one
-        efficient bulk operation. After committing, the cache is cleared.
-        If no cached entries exist, this method does nothing.
+        transaction, using executemany() in chunks of the profile's
+        write_chunk_size rows, which keeps every statement well under
+        SQLite's bound parameter limit. After committing, the cache is
+        cleared. If no cached entries exist, this method does nothing.
+        Entries stored in different shards (see KVShard) are committed file
+        by file, so only the entries of each file are atomic together, and
+        entries already auto-flushed may have been committed by an earlier
+        write (see put_cached()).
 
         This method is essential for achieving high performance when inserting
         many entries, as it reduces the overhead of individual transactions.
@@ -459,16 +2031,109 @@ class KV:
             >>>
             >>> kv.close()
         """
-        if not self.cache_values:
+        if not self.cache_values and not self.cache_flushed_rows:
             return
 
-        values = ",".join(["(?, ?, ?)" for _ in range(self.cache_row_count)])
+        self._flush_cached()
+        writes, self.cache_flushed_rows = self.cache_flushed_rows, 0
+        self._commit(writes)
 
-        sql = f"""
-            INSERT OR REPLACE INTO kv (key, value, ttl) VALUES {values}
+
+class Lease:
+    """
+    Context manager holding a KV lease with automatic renewal and release.
+
+    On enter the lease is requested once; a background thread then renews it
+    every third of its TTL for as long as the block runs, and the lease is
+    released on exit even if the block raises. If renewal ever fails (for
+    example because the process was suspended past the TTL), lost is set.
+    The heartbeat only notices that at its next renewal, which can come
+    late after a suspension, so call confirm() before work that must not
+    run twice.
+
+    Args:
+        key (str): The key storing the lease.
+        ttl_seconds (int): Lease validity without renewal. A crashed holder
+            blocks others for at most this long.
+        owner (Optional[str]): Unique identifier of the holder. Defaults to
+            one derived from the process id and a random string.
+        profile (Optional[KVProfile]): Profile used for the KV connections
+            opened by the lease. Defaults to None.
+
+    Attributes:
+        acquired (bool): Whether the lease was granted on enter.
+        lost (bool): Whether a renewal failed while the lease was held.
+
+    Example:
+        >>> from src.ut_components.kv import Lease
+        >>>
+        >>> with Lease("sync.lease", ttl_seconds=300) as lease:
+        ...     if not lease.acquired:
+        ...         print("Another instance is running")
+        ...     else:
+        ...         for step in steps:
+        ...             if not lease.confirm():
+        ...                 break  # another instance took over
+        ...             step()
+    """
+
+    def __init__(
+        self,
+        key: str,
+        ttl_seconds: int,
+        owner: Optional[str] = None,
+        profile: Optional[KVProfile] = None,
+    ) -> None:
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.owner = owner or f"{os.getpid()}.{threading.get_ident()}.{os.urandom(4).hex()}"
+        self.profile = profile
+        self.acquired = False
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _heartbeat(self) -> None:
+        interval = max(self.ttl_seconds / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                with KV(self.profile) as kv:
+                    renewed = kv.renew_lease(self.key, self.owner, self.ttl_seconds)
+            except sqlite3.Error:
+                continue
+            if not renewed:
+                self.lost = True
+                return
+
+    def confirm(self) -> bool:
         """
+        Renew the lease now and tell whether it is still held.
 
-        self.cursor.execute(sql, self.cache_values)
-        self.conn.commit()
-        self.cache_values = []
-        self.cache_row_count = 0
+        Returns:
+            bool: False if the lease was not acquired or has been lost, in
+            which case lost is set.
+        """
+        if not self.acquired or self.lost:
+            return False
+        with KV(self.profile) as kv:
+            if not kv.renew_lease(self.key, self.owner, self.ttl_seconds):
+                self.lost = True
+        return not self.lost
+
+    def __enter__(self) -> "Lease":
+        with KV(self.profile) as kv:
+            self.acquired = kv.acquire_lease(self.key, self.owner, self.ttl_seconds)
+        if self.acquired:
+            self._thread = threading.Thread(target=self._heartbeat, name=f"lease-{self.key}", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if not self.acquired:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with KV(self.profile) as kv:
+            kv.release_lease(self.key, self.owner)
+        self.acquired = False
@@ -14,12 +14,365 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import dataclasses
+import datetime
+import enum
 import functools
 import hashlib
-import json
-from typing import Any, Callable
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from .kv import KV
+from .codec import BINARY_CODEC, decode_value
+from .kv import KV, Lease
+
+# How long a single-flight computation may go without a lease heartbeat
+# before other processes assume its owner died, and how often waiters in
+# other processes look for the result.
+SINGLE_FLIGHT_LEASE_SECONDS = 60
+SINGLE_FLIGHT_POLL_SECONDS = 0.1
+
+_MISS = object()
+
+
+class MemoryCache:
+    """
+    In-process cache in front of the persistent memoize store.
+
+    Entries are kept encoded with the KV BinaryCodec, so a hit costs a
+    dictionary lookup and a fast decode instead of a database round trip, and
+    returns exactly what the KV store would (e.g. tuples come back as lists).
+    Callers always get their own copy of the value, and the memory used is
+    known exactly. Every entry
+    carries the expiry of the matching persistent entry and is dropped with it.
+
+    The cache is bounded both in entries and in bytes; when either bound is
+    exceeded, entries are evicted according to the eviction policy. Entries
+    deleted by another process (e.g. delete_memoized() in the background
+    sync) stay visible here until they expire. Usage is also tracked per
+    group of keys (per memoized function), see usage().
+
+    Args:
+        max_entries (int): Maximum number of entries. Defaults to 1024.
+        max_bytes (int): Maximum total size of the encoded values. Values
+            larger than this are not kept in memory. Defaults to 4 MiB.
+        eviction (str): "lru" evicts the least recently used entry, "fifo"
+            the oldest inserted one. Defaults to "lru".
+
+    Attributes:
+        evictions (int): Number of entries evicted to respect the bounds.
+        bytes (int): Total size of the stored values.
+
+    Example:
+        >>> from src.ut_components.memoize import MemoryCache, memoize
+        >>>
+        >>> small_cache = MemoryCache(max_entries=64, max_bytes=256 * 1024)
+        >>>
+        >>> @memoize(ttl_seconds=3600, memory=small_cache)
+        >>> def get_settings(user_id: str):
+        ...     return load_settings(user_id)
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 4 * 1024 * 1024, eviction: str = "lru") -> None:
+        if eviction not in ("lru", "fifo"):
+            raise ValueError(f"Unknown eviction policy {eviction!r}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.evictions = 0
+        self.bytes = 0
+        self._groups: Dict[str, List[int]] = {}
+        self._entries: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get the encoded value stored under key.
+
+        Args:
+            key (str): The memoize key.
+
+        Returns:
+            Optional[bytes]: The encoded value, or None if it is missing or expired.
+        """
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        """
+        Get the encoded value stored under key together with its expiry.
+
+        Args:
+            key (str): The memoize key.
+
+        Returns:
+            Optional[Tuple[bytes, Optional[float]]]: (raw, expires_at), or None
+            if the entry is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                self._remove(key)
+                return None
+            if self.eviction == "lru":
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, raw: bytes, expires_at: Optional[float]) -> None:
+        """
+        Store an encoded value, evicting other entries if the bounds require it.
+
+        Args:
+            key (str): The memoize key.
+            raw (bytes): The value encoded with BINARY_CODEC.encode().
+            expires_at (Optional[float]): Unix timestamp after which the entry
+                is dropped, or None if it never expires.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if len(raw) > self.max_bytes or self.max_entries <= 0:
+                return
+            self._entries[key] = (raw, expires_at)
+            self.bytes += len(raw)
+            group = self._group(key)
+            group[0] += 1
+            group[1] += len(raw)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+                self._group(oldest)[2] += 1
+
+    def delete(self, key: str) -> None:
+        """
+        Drop the entry stored under key, if any.
+
+        Args:
+            key (str): The memoize key.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        """
+        Drop every entry whose key starts with prefix.
+
+        Args:
+            prefix (str): The key prefix.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        """
+        Drop every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            for group in self._groups.values():
+                group[0] = group[1] = 0
+
+    def usage(self, group: str) -> Tuple[int, int, int]:
+        """
+        Get the memory used by one group of keys.
+
+        Args:
+            group (str): The key prefix up to the last dot, e.g.
+                "memoize.<function hash>".
+
+        Returns:
+            Tuple[int, int, int]: (entries, bytes, evictions) of the group.
+        """
+        with self._lock:
+            entries, size, evictions = self._groups.get(group, (0, 0, 0))
+            return entries, size, evictions
+
+    def _group(self, key: str) -> List[int]:
+        group = key.rpartition(".")[0]
+        counters = self._groups.get(group)
+        if counters is None:
+            counters = self._groups[group] = [0, 0, 0]
+        return counters
+
+    def _remove(self, key: str) -> None:
+        raw, _ = self._entries.pop(key)
+        self.bytes -= len(raw)
+        group = self._group(key)
+        group[0] -= 1
+        group[1] -= len(raw)
+
+
+# Shared by every memoized function unless memoize() is given another one.
+MEMORY_CACHE = MemoryCache()
+
+_FLIGHTS: Dict[str, List[Any]] = {}
+_FLIGHTS_LOCK = threading.Lock()
+
+
+@dataclass
+class MemoizeStats:
+    """
+    Counters of a memoized function in the current process.
+
+    Attributes:
+        hits (int): Calls answered with a fresh cached result.
+        stale_hits (int): Calls answered with a result past ttl_seconds but
+            within stale_ttl_seconds (see memoize()).
+        misses (int): Calls that had to compute the result before returning.
+        refresh_errors (int): Refreshes of a stale result that raised; the
+            stale result kept being served.
+        computes (int): Calls of the function itself that returned.
+        compute_seconds (float): Total time spent in those calls.
+        avg_compute_seconds (float): compute_seconds / computes.
+        memory_entries (int): Results currently held in the memory tier.
+        memory_bytes (int): Size of those results.
+        evictions (int): Results evicted from the memory tier to respect its
+            bounds.
+        stored_entries (int): Live results in the KV store, shared by all
+            processes.
+        stored_bytes (int): Size of those results.
+    """
+
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    refresh_errors: int = 0
+    computes: int = 0
+    compute_seconds: float = 0.0
+    avg_compute_seconds: float = 0.0
+    memory_entries: int = 0
+    memory_bytes: int = 0
+    evictions: int = 0
+    stored_entries: int = 0
+    stored_bytes: int = 0
+
+
+_STATS: Dict[str, MemoizeStats] = {}
+_STATS_LOCK = threading.Lock()
+# Key group ("memoize.<function hash>") and memory tier of every memoized
+# function, by "module.qualified_name".
+_FUNCTIONS: Dict[str, Tuple[str, Optional["MemoryCache"]]] = {}
+
+
+def memoize_stats() -> Dict[str, MemoizeStats]:
+    """
+    Get the statistics of every memoized function used in this process.
+
+    Call counters and compute times are those of this process; memory usage
+    is read from each function's memory tier and stored entries from the KV
+    store (one prefix count per function) when this is called.
+
+    Returns:
+        Dict[str, MemoizeStats]: Snapshots keyed by the function's
+        "module.qualified_name".
+
+    Example:
+        >>> from src.ut_components.memoize import memoize_stats
+        >>>
+        >>> for name, stats in memoize_stats().items():
+        ...     print(f"{name}: {stats.hits} hits, {stats.misses} misses, {stats.avg_compute_seconds:.3f}s")
+    """
+    with _STATS_LOCK:
+        snapshot = {name: replace(stats) for name, stats in _STATS.items()}
+        functions = dict(_FUNCTIONS)
+
+    with KV() as kv:
+        for name, stats in snapshot.items():
+            group, memory = functions[name]
+            if stats.computes:
+                stats.avg_compute_seconds = stats.compute_seconds / stats.computes
+            if memory is not None:
+                stats.memory_entries, stats.memory_bytes, stats.evictions = memory.usage(group)
+            stats.stored_entries, stats.stored_bytes = kv.usage(f"{group}.")
+    return snapshot
+
+
+def _count(stats: MemoizeStats, counter: str) -> None:
+    with _STATS_LOCK:
+        setattr(stats, counter, getattr(stats, counter) + 1)
+
+
+def _count_compute(stats: MemoizeStats, seconds: float) -> None:
+    with _STATS_LOCK:
+        stats.computes += 1
+        stats.compute_seconds += seconds
+
+
+class _RefreshWorker:
+    """
+    Daemon thread running background refreshes of stale memoized results.
+
+    A key already queued or being refreshed is not queued again. The thread
+    is started on first use, and again in a forked child, where threads of
+    the parent don't exist.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._queue: "queue.Queue[Tuple[str, Callable[[], None]]]" = queue.Queue()
+        self._pending: set = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, key: str, task: Callable[[], None]) -> None:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._pending = set()
+                self._thread = None
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self._queue.put((key, task))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="memoize-refresh", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            key, task = self._queue.get()
+            try:
+                task()
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+
+_REFRESH_WORKER = _RefreshWorker()
+
+
+@contextmanager
+def _thread_flight(key: str, timeout: float) -> Iterator[bool]:
+    # Per-key lock shared by the threads of this process, dropped once no
+    # thread uses it anymore.
+    with _FLIGHTS_LOCK:
+        flight = _FLIGHTS.setdefault(key, [threading.Lock(), 0])
+        flight[1] += 1
+    acquired = flight[0].acquire(timeout=max(timeout, 0))
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            flight[0].release()
+        with _FLIGHTS_LOCK:
+            flight[1] -= 1
+            if not flight[1]:
+                del _FLIGHTS[key]
 
 
 def hash_function_name(func: Callable) -> str:
@@ -47,35 +400,139 @@ def hash_function_name(func: Callable) -> str:
     return hashlib.sha1(f"{function_name}".encode()).hexdigest()
 
 
+def _encode_canonical(value: Any, out: List[bytes]) -> None:
+    # Type-tagged, length-prefixed encoding: equal values always encode the
+    # same way (dict and set items are sorted by their encoding) and values
+    # of different types never collide. Lists and tuples encode alike.
+    value_type = type(value)
+    if value_type is str:
+        encoded = value.encode("utf-8")
+        out.append(b"s%d:" % len(encoded))
+        out.append(encoded)
+    elif value is None:
+        out.append(b"N")
+    elif value_type is bool:
+        out.append(b"T" if value else b"F")
+    elif value_type is int:
+        out.append(b"i%d;" % value)
+    elif value_type is float:
+        out.append(b"d%r;" % value)
+    elif value_type is list or value_type is tuple:
+        out.append(b"l%d:" % len(value))
+        for item in value:
+            _encode_canonical(item, out)
+    elif value_type is dict:
+        out.append(b"m%d:" % len(value))
+        if all(type(key) is str for key in value):
+            for key in sorted(value):
+                _encode_canonical(key, out)
+                _encode_canonical(value[key], out)
+        else:
+            for encoded_key, item in sorted((_canonical(key), item) for key, item in value.items()):
+                out.append(encoded_key)
+                _encode_canonical(item, out)
+    elif value_type is bytes:
+        out.append(b"b%d:" % len(value))
+        out.append(value)
+    elif value_type is set or value_type is frozenset:
+        out.append(b"u%d:" % len(value))
+        out.extend(sorted(_canonical(item) for item in value))
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        out.append(b"c%s:" % _type_name(value))
+        _encode_canonical([(field.name, getattr(value, field.name)) for field in dataclasses.fields(value)], out)
+    elif isinstance(value, enum.Enum):
+        out.append(b"e%s:" % _type_name(value))
+        _encode_canonical(value.value, out)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        out.append(b"t%s:" % _type_name(value))
+        _encode_canonical(value.isoformat(), out)
+    elif isinstance(value, (str, int, float, bytes, list, tuple, dict, set, frozenset)):
+        # Subclasses (IntEnum members are caught above) encode as their base type.
+        for base in (str, int, float, bytes, list, tuple, dict, set, frozenset):
+            if isinstance(value, base):
+                _encode_canonical(base(value), out)
+                return
+    else:
+        raise TypeError(f"Cannot derive a memoize key from {value_type.__name__}; pass key= to memoize() to build one")
+
+
+def _type_name(value: Any) -> bytes:
+    value_type = type(value)
+    return f"{value_type.__module__}.{value_type.__qualname__}".encode("utf-8")
+
+
+def _canonical(value: Any) -> bytes:
+    out: List[bytes] = []
+    _encode_canonical(value, out)
+    return b"".join(out)
+
+
+def hash_value(value: Any) -> str:
+    """
+    Generate a stable hash of a Python value for use in memoize keys.
+
+    The value is turned into a canonical, type-tagged byte string and hashed
+    with BLAKE2b. Besides JSON types this supports tuples, bytes, sets,
+    dataclasses, enums and dates; dictionaries and sets hash the same
+    whatever their order.
+
+    Args:
+        value (Any): The value to hash.
+
+    Returns:
+        str: A 32 character hexadecimal digest.
+
+    Raises:
+        TypeError: If the value contains a type with no canonical encoding.
+
+    Example:
+        >>> hash_value({"b": 1, "a": {2, 1}}) == hash_value({"a": {1, 2}, "b": 1})
+        True
+    """
+    return hashlib.blake2b(_canonical(value), digest_size=16).hexdigest()
+
+
 def hash_function_args(args, kwargs) -> str:
     """
     Generate a unique hash identifier for function arguments.
 
-    This helper function creates a SHA1 hash of the function's arguments
-    (both positional and keyword arguments) by JSON-serializing them.
-    This allows the cache system to differentiate between different function
-    calls with different arguments.
+    This helper function hashes the function's arguments (both positional
+    and keyword arguments) with hash_value(). This allows the cache system to
+    differentiate between different function calls with different arguments.
 
     Args:
         args: Positional arguments passed to the function.
         kwargs: Keyword arguments passed to the function.
 
     Returns:
-        str: A hexadecimal SHA1 hash string representing the arguments' unique identifier.
+        str: A hexadecimal BLAKE2b hash string representing the arguments' unique identifier.
 
     Note:
-        Arguments must be JSON-serializable. Non-serializable objects like
-        custom classes, datetime objects, or sets will cause this function to fail.
+        Arguments must be made of types hash_value() supports. For anything
+        else, give memoize() a key function.
 
     Example:
         >>> hash_id = hash_function_args(("hello", 42), {"key": "value"})
         >>> print(hash_id)  # e.g., "b7c4d8f2a91e3..."
     """
-    encoded_args = f"{json.dumps(args, sort_keys=True)}-{json.dumps(kwargs, sort_keys=True)}"
-    return hashlib.sha1(f"{encoded_args}".encode()).hexdigest()
-
-
-def memoize(ttl_seconds: int):
+    out: List[bytes] = []
+    _encode_canonical(args, out)
+    _encode_canonical(kwargs, out)
+    return hashlib.blake2b(b"".join(out), digest_size=16).hexdigest()
+
+
+def memoize(
+    ttl_seconds: int,
+    memory: Optional[MemoryCache] = MEMORY_CACHE,
+    single_flight: bool = False,
+    single_flight_timeout: float = 30.0,
+    stale_ttl_seconds: int = 0,
+    refresh: str = "sync",
+    cache_none: bool = True,
+    none_ttl_seconds: Optional[int] = None,
+    key: Optional[Callable[..., Any]] = None,
+    tags: Optional[Union[Iterable[str], Callable[..., Iterable[str]]]] = None,
+):
     """
     Decorator factory for caching function results with time-to-live (TTL).
 
@@ -87,18 +544,55 @@ def memoize(ttl_seconds: int):
 
     The decorator uses a key-value store to persist cache across application
     restarts and creates unique cache keys based on the function name and arguments.
+    Results are also kept in an in-process MemoryCache with the same expiry, so
+    repeated calls in the same process don't touch the database at all.
 
     Args:
         ttl_seconds (int): Time-to-live for cached results in seconds. After this
             period, the cache expires and the function will be executed again.
+        memory (Optional[MemoryCache]): In-process tier checked before the KV
+            store. Defaults to MEMORY_CACHE, shared by all memoized functions.
+            Pass None to always read from the KV store.
+        single_flight (bool): On a miss, let only one caller compute the result
+            while concurrent callers for the same arguments wait and reuse it.
+            Threads of the same process wait on a lock, other processes (e.g.
+            the background sync and the UI) on a KV lease. If the computing
+            caller fails, the next waiter takes over. Defaults to False.
+        single_flight_timeout (float): How long a caller waits for another
+            one's result, in seconds, before computing it itself.
+            Defaults to 30.
+        stale_ttl_seconds (int): How long a result is kept after ttl_seconds
+            to be served as stale. A stale result is refreshed on use; if the
+            refresh raises, the stale result is returned instead of the error.
+            Defaults to 0 (results are dropped at ttl_seconds).
+        refresh (str): How stale results are refreshed: "sync" recomputes on
+            the caller's path, "background" returns the stale result at once
+            and recomputes on a worker thread. Defaults to "sync".
+        cache_none (bool): Cache None results like any other result, so a
+            function answering "nothing found" is not called again on every
+            use. Defaults to True.
+        none_ttl_seconds (Optional[int]): Time-to-live for cached None
+            results. Defaults to None (same as ttl_seconds).
+        key (Optional[Callable[..., Any]]): Called with the function's
+            arguments to build the value the cache key is derived from, for
+            arguments hash_value() can't encode or that should be partly
+            ignored. Defaults to None (all arguments are hashed).
+        tags (Optional[Union[Iterable[str], Callable[..., Iterable[str]]]]):
+            Tags attached to every cached result, or a function called with
+            the arguments returning them (e.g. ["server:<id>"]). All results
+            carrying a tag, whatever the function, are dropped at once with
+            invalidate_tag(). Defaults to None.
 
     Returns:
         Callable: A decorator function that can be applied to any function.
 
     Note:
-        - Function arguments must be JSON-serializable for caching to work.
+        - Function arguments must be supported by hash_value() (JSON types,
+          tuples, sets, bytes, dataclasses, enums, dates) unless key is given.
         - Cached results are stored in a persistent KV store.
         - Each unique combination of arguments creates a separate cache entry.
+        - Hit, stale and miss counts, compute times and cache sizes are
+          available from memoize_stats().
 
     Example:
         >>> from src.ut_components.memoize import memoize
@@ -118,30 +612,252 @@ def memoize(ttl_seconds: int):
         >>>
         >>> # Different arguments create a new cache entry
         >>> result3 = expensive_api_call("user456", "/profile")
+        >>>
+        >>> # Serve day-old discovery results instantly while refreshing them
+        >>> @memoize(ttl_seconds=3600, stale_ttl_seconds=86400, refresh="background")
+        >>> def discover(url: str):
+        ...     return run_discovery(url)
     """
+    key_function = key
+    if refresh not in ("sync", "background"):
+        raise ValueError(f"Unknown refresh mode {refresh!r}")
+    stored_ttl_seconds = ttl_seconds + stale_ttl_seconds if ttl_seconds else ttl_seconds
+    if none_ttl_seconds is None:
+        none_ttl_seconds = ttl_seconds
+    stored_none_ttl_seconds = none_ttl_seconds + stale_ttl_seconds if none_ttl_seconds else none_ttl_seconds
+    tag_function = tags if callable(tags) else None
+    fixed_tags = () if tags is None or tag_function is not None else tuple(tags)
 
     def decorator(func: Callable) -> Callable:
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs) -> Any:
-            hashed_function_name = hash_function_name(func)
-            hashed_encoded_args = hash_function_args(args, kwargs)
+        hashed_function_name = hash_function_name(func)
+        name = f"{func.__module__}.{func.__qualname__}"
+        with _STATS_LOCK:
+            stats = _STATS.setdefault(name, MemoizeStats())
+            _FUNCTIONS[name] = (f"memoize.{hashed_function_name}", memory)
+
+        def remember(key: str, value: Any, expires_at: Optional[float]) -> None:
+            # The memory tier is best effort: the value is already in the KV store.
+            if memory is None:
+                return
+            try:
+                memory.put(key, BINARY_CODEC.encode(value), expires_at)
+            except (TypeError, ValueError, OverflowError):
+                memory.delete(key)
+
+        def lookup(key: str) -> Any:
+            # (value, expires_at) from the memory tier or the KV store, or _MISS.
+            if memory is not None:
+                entry = memory.get_entry(key)
+                if entry is not None:
+                    return decode_value(entry[0]), entry[1]
+
             with KV() as kv:
-                response = kv.get(f"memoize.{hashed_function_name}.{hashed_encoded_args}")
-                if response is not None:
-                    return response
-                result = func(*args, **kwargs)
-                kv.put(
-                    f"memoize.{hashed_function_name}.{hashed_encoded_args}",
-                    result,
-                    ttl_seconds=ttl_seconds,
-                )
+                response, expires_at = kv.get_with_expiry(key, _MISS)
+            if response is _MISS:
+                return _MISS
+            remember(key, response, expires_at)
+            return response, expires_at
+
+        def is_fresh(expires_at: Optional[float]) -> bool:
+            return expires_at is None or time.time() < expires_at - stale_ttl_seconds
+
+        def lookup_fresh(key: str) -> Any:
+            found = lookup(key)
+            if found is _MISS or not is_fresh(found[1]):
+                return _MISS
+            return found[0]
+
+        def compute(key: str, args, kwargs) -> Any:
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            _count_compute(stats, time.perf_counter() - started)
+            if result is None and not cache_none:
                 return result
+            ttl = stored_ttl_seconds if result is not None else stored_none_ttl_seconds
+            entry_tags = fixed_tags if tag_function is None else tag_function(*args, **kwargs)
+
+            def store() -> None:
+                with KV() as kv:
+                    if not entry_tags:
+                        kv.put(key, result, ttl_seconds=ttl)
+                    else:
+                        # The entry and its tag index rows are committed together.
+                        kv.put_cached(key, result, ttl_seconds=ttl)
+                        entry = key[len("memoize.") :]
+                        for tag in entry_tags:
+                            kv.put_cached(f"{_tag_prefix(tag)}{entry}", True, ttl_seconds=ttl)
+                        kv.commit_cached()
+                remember(key, result, time.time() + ttl if ttl else None)
+
+            _write_cache(store)
+            return result
+
+        def compute_single_flight(key: str, lease_key: str, args, kwargs) -> Any:
+            deadline = time.monotonic() + single_flight_timeout
+            with _thread_flight(key, single_flight_timeout) as acquired:
+                if not acquired:
+                    return compute(key, args, kwargs)
+                result = lookup_fresh(key)
+                if result is not _MISS:
+                    return result
+
+                while True:
+                    with Lease(lease_key, SINGLE_FLIGHT_LEASE_SECONDS) as lease:
+                        if lease.acquired:
+                            result = lookup_fresh(key)
+                            if result is not _MISS:
+                                return result
+                            return compute(key, args, kwargs)
+
+                    # Another process is computing: wait for its result, or
+                    # for its lease to go away (finished without a cacheable
+                    # result, failed or died) and try to take over.
+                    while time.monotonic() < deadline:
+                        time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+                        result = lookup_fresh(key)
+                        if result is not _MISS:
+                            return result
+                        with KV() as kv:
+                            if kv.get(lease_key) is None:
+                                break
+                    else:
+                        return compute(key, args, kwargs)
+
+        def refresh_now(key: str, hashed_encoded_args: str, args, kwargs) -> Any:
+            # The lease is a write too; without it, callers inside a KV
+            # transaction on another shard compute on their own.
+            if single_flight and _cache_writable():
+                lease_key = f"memoize.flight.{hashed_function_name}.{hashed_encoded_args}"
+                return compute_single_flight(key, lease_key, args, kwargs)
+            return compute(key, args, kwargs)
+
+        def refresh_in_background(key: str, hashed_encoded_args: str, args, kwargs) -> None:
+            try:
+                refresh_now(key, hashed_encoded_args, args, kwargs)
+            except Exception:
+                _count(stats, "refresh_errors")
 
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            if key_function is None:
+                hashed_encoded_args = hash_function_args(args, kwargs)
+            else:
+                hashed_encoded_args = hash_value(key_function(*args, **kwargs))
+            key = f"memoize.{hashed_function_name}.{hashed_encoded_args}"
+            found = lookup(key)
+            if found is _MISS:
+                _count(stats, "misses")
+                return refresh_now(key, hashed_encoded_args, args, kwargs)
+
+            value, expires_at = found
+            if is_fresh(expires_at):
+                _count(stats, "hits")
+                return value
+
+            _count(stats, "stale_hits")
+            if refresh == "background":
+                _REFRESH_WORKER.submit(
+                    key,
+                    functools.partial(refresh_in_background, key, hashed_encoded_args, args, kwargs),
+                )
+                return value
+            try:
+                return refresh_now(key, hashed_encoded_args, args, kwargs)
+            except Exception:
+                _count(stats, "refresh_errors")
+                return value
+
+        wrapper.memoize_memory = memory
         return wrapper
 
     return decorator
 
 
+def _cache_writable() -> bool:
+    with KV() as kv:
+        return kv.can_write("memoize.")
+
+
+def _write_cache(write: Callable[[], None]) -> None:
+    # Cached results may live in their own shard (the "cache" shard of
+    # DEFAULT_PROFILE), which a KV transaction on another shard can't write
+    # to. Inside one, the write waits for that transaction to commit instead
+    # of failing it.
+    with KV() as kv:
+        if kv.can_write("memoize."):
+            write()
+        else:
+            kv.on_commit(write)
+
+
+def _tag_prefix(tag: str) -> str:
+    # Dots separate key segments, so they are escaped in tags (and "%" as
+    # the escape character) to keep each tag one segment.
+    escaped = tag.replace("%", "%25").replace(".", "%2E")
+    return f"memoize.tag.{escaped}."
+
+
+def invalidate_tag(tag: str) -> int:
+    """
+    Drop every cached result carrying a tag, across all memoized functions.
+
+    Each tagged result has an index row "memoize.tag.<tag>.<function
+    hash>.<arguments hash>" next to it, so this is a prefix scan of the tag
+    plus one delete per result, committed in a single transaction. Results
+    are also dropped from the memory tier of this process; like with
+    delete_memoized(), other processes keep theirs until they expire.
+    Called inside a KV transaction on another shard, the results are dropped
+    once that transaction commits.
+
+    Args:
+        tag (str): The tag given to memoize() (e.g. "server:<id>").
+
+    Returns:
+        int: The number of cached results dropped.
+
+    Example:
+        >>> from src.ut_components.memoize import memoize, invalidate_tag
+        >>>
+        >>> @memoize(ttl_seconds=86400, tags=lambda server_id: [f"server:{server_id}"])
+        >>> def get_capabilities(server_id: str):
+        ...     return probe(server_id)
+        >>>
+        >>> invalidate_tag("server:1")  # after the server is deleted or its credentials change
+    """
+    prefix = _tag_prefix(tag)
+
+    def drop() -> int:
+        with KV() as kv:
+            with kv.transaction("memoize."):
+                indexed, keys = _tagged_keys(kv, prefix)
+                for key in keys:
+                    kv.delete(key)
+                kv.delete_partial(prefix)
+
+        with _STATS_LOCK:
+            memories = dict(_FUNCTIONS.values())
+        for key in indexed:
+            memory = memories.get(key.rpartition(".")[0], MEMORY_CACHE)
+            if memory is not None:
+                memory.delete(key)
+        return len(keys)
+
+    with KV() as kv:
+        if kv.can_write("memoize."):
+            return drop()
+        kv.on_commit(drop)
+        return len(_tagged_keys(kv, prefix)[1])
+
+
+def _tagged_keys(kv: KV, prefix: str) -> Tuple[List[str], List[str]]:
+    # (indexed, keys): the results the tag index lists, and those of them
+    # still stored. Results may already be gone, e.g. dropped through
+    # another tag.
+    indexed = [f"memoize.{index_key[len(prefix) :]}" for index_key, _ in kv.get_partial(prefix)]
+    keys = [key for key, value in kv.get_many(indexed, _MISS).items() if value is not _MISS]
+    return indexed, keys
+
+
 def delete_memoized(function: Callable):
     """
     Clear all cached entries for a specific memoized function.
@@ -177,5 +893,12 @@ def delete_memoized(function: Callable):
         >>> data3 = get_user_data("user123")  # Fetches from database
     """
     hashed_function_name = hash_function_name(function)
-    with KV() as kv:
-        kv.delete_partial(f"memoize.{hashed_function_name}")
+    memory = getattr(function, "memoize_memory", MEMORY_CACHE)
+
+    def drop() -> None:
+        if memory is not None:
+            memory.delete_prefix(f"memoize.{hashed_function_name}.")
+        with KV() as kv:
+            kv.delete_partial(f"memoize.{hashed_function_name}")
+
+    _write_cache(drop)